@@ -12,4 +12,35 @@ app.conf.task_queues = [
 ]
 app.conf.task_acks_late = True
 
+app.conf.beat_schedule = {
+    'release-expired-reserve-holds': {
+        'task': 'online_reservation.tasks.release_expired_reserve_holds',
+        'schedule': 60,
+        'options': {'queue': 'tasks'}
+    },
+    'release-unpaid-past-reserves': {
+        'task': 'online_reservation.tasks.release_unpaid_past_reserves',
+        'schedule': 300,
+        'options': {'queue': 'tasks'}
+    },
+    'refresh-alternative-doctors': {
+        'task': 'online_reservation.tasks.refresh_alternative_doctors',
+        'schedule': 60,
+        'options': {'queue': 'tasks'}
+    },
+    'reconcile-payments': {
+        'task': 'online_reservation.tasks.reconcile_payments',
+        'schedule': 120,
+        'options': {'queue': 'tasks'}
+    },
+    'purge-expired-otps': {
+        'task': 'core.tasks.purge_expired_otps',
+        'schedule': 600,
+        'options': {'queue': 'tasks'}
+    }
+}
+
 app.autodiscover_tasks()
+
+# Connect the task duration metrics in the workers too
+from . import metrics  # noqa: E402,F401
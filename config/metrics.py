@@ -0,0 +1,160 @@
+"""
+Prometheus metrics of the HTTP requests, their database usage, the response cache, the idempotency keys, the Zarinpal requests and the Celery tasks.
+
+The metrics are served by `metrics_view` only to the scrapers that send the
+METRICS_BEARER_TOKEN setting or come from the METRICS_ALLOWED_IPS addresses.
+
+With several processes (gunicorn workers, Celery prefork children) set the
+PROMETHEUS_MULTIPROC_DIR environment variable to an empty directory shared by
+all of them, and use `child_exit` as gunicorn's child_exit hook.
+"""
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, Http404
+from celery.signals import task_prerun, task_postrun
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+from contextlib import ExitStack
+import hmac
+import os
+import time
+
+
+MULTIPROCESS_MODE = 'PROMETHEUS_MULTIPROC_DIR' in os.environ
+
+INSTRUMENTED_TASKS_PREFIX = 'online_reservation.tasks.'
+
+UNRESOLVED_VIEW = '<unresolved>'
+
+
+REQUEST_LATENCY = Histogram(
+    'django_http_request_duration_seconds',
+    'Latency of the HTTP requests by route.',
+    ['view', 'method', 'status'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'django_http_requests_in_flight',
+    'Number of HTTP requests being processed.',
+    multiprocess_mode='livesum'
+)
+REQUEST_DB_QUERIES = Histogram(
+    'django_http_request_db_queries',
+    'Number of SQL queries of the HTTP requests by route.',
+    ['view', 'method'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+)
+REQUEST_DB_DURATION = Histogram(
+    'django_http_request_db_duration_seconds',
+    'Time spent in the database by the HTTP requests by route.',
+    ['view', 'method'],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+TASK_DURATION = Histogram(
+    'celery_task_duration_seconds',
+    'Duration of the Celery tasks.',
+    ['task', 'state'],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+PAYMENT_GATEWAY_REQUEST_LATENCY = Histogram(
+    'zarinpal_request_duration_seconds',
+    'Latency of the attempts of the Zarinpal requests by operation and outcome (response, retry or error).',
+    ['operation', 'outcome'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+RESPONSE_CACHE_REQUESTS = Counter(
+    'django_response_cache_requests_total',
+    'Lookups in the response cache by view, action and result (hit or miss).',
+    ['view', 'action', 'result']
+)
+IDEMPOTENT_REQUESTS = Counter(
+    'django_idempotent_requests_total',
+    'Requests with an idempotency key by view and result (stored, replayed, in_progress or mismatch).',
+    ['view', 'result']
+)
+
+
+class QueryTimer:
+    """
+    Database execute wrapper that counts the queries and sums their durations.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started_at
+
+
+class PrometheusMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        query_timer = QueryTimer()
+        started_at = time.perf_counter()
+
+        with REQUESTS_IN_FLIGHT.track_inprogress(), ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_timer))
+            response = self.get_response(request)
+
+        # The route name is only known after the URL has been resolved
+        resolver_match = getattr(request, 'resolver_match', None)
+        view = resolver_match.view_name if resolver_match else UNRESOLVED_VIEW
+
+        REQUEST_LATENCY.labels(view, request.method, response.status_code).observe(time.perf_counter() - started_at)
+        REQUEST_DB_QUERIES.labels(view, request.method).observe(query_timer.count)
+        REQUEST_DB_DURATION.labels(view, request.method).observe(query_timer.duration)
+
+        return response
+
+
+def is_metrics_scraper(request):
+    authorization = request.headers.get('Authorization', '')
+    if settings.METRICS_BEARER_TOKEN and hmac.compare_digest(authorization, f'Bearer {settings.METRICS_BEARER_TOKEN}'):
+        return True
+    # The address of the connection, a proxy's X-Forwarded-For can be forged
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def metrics_view(request):
+    # Hidden from the others, the route names and timings are internal
+    if not is_metrics_scraper(request):
+        raise Http404
+
+    if MULTIPROCESS_MODE:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def child_exit(server, worker):
+    if MULTIPROCESS_MODE:
+        multiprocess.mark_process_dead(worker.pid)
+
+
+_task_started_at = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id, task, **kwargs):
+    if task.name.startswith(INSTRUMENTED_TASKS_PREFIX):
+        _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def observe_task_duration(task_id, task, state=None, **kwargs):
+    started_at = _task_started_at.pop(task_id, None)
+    if started_at is not None:
+        TASK_DURATION.labels(task.name, state or 'UNKNOWN').observe(time.perf_counter() - started_at)
@@ -0,0 +1,34 @@
+"""
+JSON renderer built on orjson, a drop-in replacement of DRF's JSONRenderer.
+
+Values orjson doesn't encode itself the same way as DRF (datetimes, Decimal, lazy
+translation strings, ...) are handed to DRF's own encoder, so the output stays the
+same. Without orjson installed, or for what only the stdlib encoder supports
+(indented output, ASCII-only output, NaN), it renders like JSONRenderer.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    # DRF formats datetimes itself, microseconds cut to milliseconds and 'Z' for UTC
+    orjson_options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if orjson is None or indent is not None or self.ensure_ascii or not self.compact or not self.strict:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        ret = orjson.dumps(data, default=self.encoder_class().default, option=self.orjson_options)
+
+        # Same escaping as JSONRenderer, the output stays a strict javascript subset
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+        return ret
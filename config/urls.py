@@ -17,9 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('auth/', include('core.urls')),
     path('online_reservation/', include('online_reservation.urls')),
+    path('metrics', metrics_view, name='metrics'),
     path('__debug__/', include('debug_toolbar.urls')),
 ]
@@ -0,0 +1,22 @@
+from django.core.management import BaseCommand
+from django.utils import timezone
+
+from core.models import OTP
+from core.otp_stores import purge_otps
+
+
+class Command(BaseCommand):
+    help = 'Delete the expired one-time passwords of the OTP table, or all of them once the passwords are kept in Redis'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also delete the unexpired passwords.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of passwords deleted per statement.')
+
+    def handle(self, *args, **options):
+        queryset = OTP.objects.all()
+        if not options['all']:
+            queryset = queryset.filter(expired_datetime__lt=timezone.now())
+
+        self.stdout.write('Purging one-time passwords...', ending='')
+        count = purge_otps(queryset, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'DONE ({count} passwords)'))
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_otp'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['expired_datetime'], name='otp_expired_datetime_idx'),
+        ),
+    ]
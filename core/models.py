@@ -61,9 +61,12 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         verbose_name_plural = _('Users')
 
 
+OTP_LIFETIME = timezone.timedelta(seconds=120)
+
+
 # default value for expired datetime otp
 def get_expired_datetime():
-    return timezone.now() + timezone.timedelta(seconds=120)
+    return timezone.now() + OTP_LIFETIME
 
 
 class OTP(models.Model):
@@ -89,3 +92,7 @@ class OTP(models.Model):
     class Meta:
         verbose_name = _('One time password')
         verbose_name_plural = _('One time passwords')
+        indexes = [
+            # For purging the expired passwords
+            models.Index(fields=['expired_datetime'], name='otp_expired_datetime_idx'),
+        ]
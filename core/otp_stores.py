@@ -0,0 +1,93 @@
+"""
+Stores of the one-time passwords sent by OTPGenericAPIView and checked by VerifyOTPGenericAPIView.
+
+The store is chosen by the OTP_STORE setting. RedisOTPStore keeps each password in a key
+that expires on its own, DatabaseOTPStore keeps them in the OTP table as before.
+"""
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from functools import lru_cache
+
+from .models import OTP, OTP_LIFETIME
+
+
+class DatabaseOTPStore:
+
+    def create(self, phone):
+        otp = OTP(phone=phone)
+        otp.generate_password()
+        otp.save()
+        return otp
+
+    def verify(self, request_id, phone, password):
+        """
+        Delete the matching unexpired password and return whether there was one,
+        in one statement so a password is never accepted twice.
+        """
+        deleted_count, _ = OTP.objects.filter(
+            id=request_id,
+            phone=phone,
+            password=password,
+            expired_datetime__gte=timezone.now()
+        ).delete()
+        return deleted_count > 0
+
+    def purge_expired(self, batch_size=1000):
+        return purge_otps(OTP.objects.filter(expired_datetime__lt=timezone.now()), batch_size)
+
+
+class RedisOTPStore:
+    key_prefix = 'otp:'
+
+    # Compare and delete in one step, of two simultaneous verifications only one gets 1
+    VERIFY_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url=None):
+        import redis
+
+        self.client = redis.Redis.from_url(url or settings.OTP_REDIS_URL)
+        self.verify_script = self.client.register_script(self.VERIFY_SCRIPT)
+
+    def get_key(self, request_id):
+        return f'{self.key_prefix}{request_id}'
+
+    def create(self, phone):
+        otp = OTP(phone=phone)
+        otp.generate_password()
+        self.client.set(self.get_key(otp.id), f'{phone}:{otp.password}', px=int(OTP_LIFETIME.total_seconds() * 1000))
+        return otp
+
+    def verify(self, request_id, phone, password):
+        return bool(self.verify_script(keys=[self.get_key(request_id)], args=[f'{phone}:{password}']))
+
+    def purge_expired(self, batch_size=1000):
+        # Redis drops the expired keys by itself
+        return 0
+
+
+def purge_otps(queryset, batch_size=1000):
+    """
+    Delete the OTPs of queryset by batches of batch_size, so the table isn't locked for the whole purge.
+    """
+    deleted_count = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted_count
+        deleted_count += OTP.objects.filter(id__in=ids).delete()[0]
+
+
+@lru_cache
+def load_otp_store(path):
+    return import_string(path)()
+
+
+def get_otp_store():
+    return load_otp_store(settings.OTP_STORE)
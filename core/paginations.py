@@ -1,19 +1,275 @@
-from rest_framework.pagination import LimitOffsetPagination
+from django.db import connections
+from django.db.models import Q
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext as _
+from rest_framework.pagination import LimitOffsetPagination, BasePagination, _positive_int, _divide_with_ceil
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
 
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import binascii
+import hashlib
+import json
+import math
 
-class CustomLimitOffsetPagination(LimitOffsetPagination):
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate on a unique ordering such as ('-reserve_datetime', '-id') by filtering
+    on the last row of the current page instead of scanning OFFSET rows.
+    The view gives the ordering with its `keyset_ordering` attribute.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
     default_limit = 10
     max_limit = 15
 
+    def __init__(self, ordering, with_count=True, get_count=None):
+        self.ordering = ordering
+        self.with_count = with_count
+        self.get_count = get_count or (lambda queryset: queryset.count())
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.is_reversed, position = self.decode_cursor(request, queryset.model)
+
+        ordering = [self._reverse_field(field) for field in self.ordering] if self.is_reversed else list(self.ordering)
+
+        self.count = self.get_count(queryset) if self.with_count else None
+
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._build_position_filter(ordering, position))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        results = results[:self.limit]
+
+        if self.is_reversed:
+            results.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.page = results
+        return results
+
+    def get_limit(self, request):
+        try:
+            return _positive_int(request.query_params[self.limit_query_param], strict=True, cutoff=self.max_limit)
+        except (KeyError, ValueError):
+            return self.default_limit
+
     def get_paginated_response(self, data):
-        context = self.get_html_context()
-        
-        return Response({
-            'total_items': self.count,
-            'count_pages': context['page_links'][-1].number,
+        response_data = {}
+
+        if self.with_count:
+            response_data['total_items'] = self.count
+            response_data['count_pages'] = self.get_count_pages()
+
+        response_data.update({
             'previous': self.get_previous_link(),
             'next': self.get_next_link(),
             'count_items_current_page': len(data),
             'results': data
         })
+        return Response(response_data)
+
+    def get_count_pages(self):
+        return max(math.ceil(self.count / self.limit), 1)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], is_reversed=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], is_reversed=True)
+
+    def encode_cursor(self, instance, is_reversed):
+        position = [self._get_field(instance._meta.model, field).value_to_string(instance) for field in self.ordering]
+        cursor = urlsafe_b64encode(json.dumps({'r': is_reversed, 'p': position}).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return False, None
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode()).decode())
+            position = [
+                self._get_field(model, field).to_python(value)
+                for field, value in zip(self.ordering, cursor['p'], strict=True)
+            ]
+            return bool(cursor['r']), position
+        except (TypeError, ValueError, KeyError, binascii.Error, ValidationError):
+            raise NotFound(_('Invalid cursor.'))
+
+    def _build_position_filter(self, ordering, position):
+        # (a, b) < (x, y) is expanded to a < x OR (a = x AND b < y)
+        position_filter = Q()
+        equal_filter = Q()
+
+        for field, value in zip(ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            position_filter |= equal_filter & Q(**{f'{name}__{lookup}': value})
+            equal_filter &= Q(**{name: value})
+
+        return position_filter
+
+    def _get_field(self, model, field):
+        return model._meta.get_field(field.lstrip('-'))
+
+    def _reverse_field(self, field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+
+class CustomLimitOffsetPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination that views with a `keyset_ordering` can switch to keyset
+    pagination with `?pagination=cursor`, and where `?count=false` skips the COUNT query.
+    """
+    default_limit = 10
+    max_limit = 15
+    pagination_query_param = 'pagination'
+    pagination_cursor = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.with_count = request.query_params.get(self.count_query_param, '').lower() not in ['false', '0']
+        self.keyset_paginator = None
+
+        keyset_ordering = getattr(view, 'keyset_ordering', None)
+        if keyset_ordering and (
+            request.query_params.get(self.pagination_query_param) == self.pagination_cursor
+            or KeysetPagination.cursor_query_param in request.query_params
+        ):
+            self.keyset_paginator = KeysetPagination(keyset_ordering, with_count=self.with_count, get_count=self.get_count)
+            return self.keyset_paginator.paginate_queryset(queryset, request, view)
+
+        if self.with_count:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        results = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(results) > self.limit
+        return results[:self.limit]
+
+    def get_paginated_response(self, data):
+        paginator = self.keyset_paginator or self
+        response_data = {}
+
+        if self.with_count:
+            response_data.update(self.get_count_data(paginator))
+
+        response_data.update({
+            'previous': paginator.get_previous_link(),
+            'next': paginator.get_next_link(),
+            'count_items_current_page': len(data),
+            'results': data
+        })
+        return Response(response_data)
+
+    def get_count_data(self, paginator):
+        return {
+            'total_items': paginator.count,
+            'count_pages': paginator.get_count_pages()
+        }
+
+    def get_count_pages(self):
+        # Same number as the last page link of get_html_context(), without building all the links
+        return max(_divide_with_ceil(self.count - self.offset, self.limit) + _divide_with_ceil(self.offset, self.limit), 1)
+
+    def get_next_link(self):
+        if self.with_count:
+            return super().get_next_link()
+
+        if not self.has_next:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_previous_link(self):
+        if self.with_count:
+            return super().get_previous_link()
+
+        if self.offset <= 0:
+            return None
+
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+
+        if self.offset - self.limit <= 0:
+            return remove_query_param(url, self.offset_query_param)
+        return replace_query_param(url, self.offset_query_param, self.offset - self.limit)
+
+
+class CachedCountLimitOffsetPagination(CustomLimitOffsetPagination):
+    """
+    Cache the total count of each (view, filters) for a short time, and for an
+    unfiltered table with many rows use PostgreSQL's reltuples estimate instead
+    of counting. `is_count_exact` in the response tells which one was used.
+    """
+    count_cache_timeout = 30
+    estimated_count_threshold = 100000
+
+    def get_count(self, queryset):
+        self.is_count_exact = True
+        queryset = queryset.order_by()
+
+        if not queryset.query.where:
+            estimated_count = self.get_estimated_count(queryset)
+            if estimated_count is not None and estimated_count >= self.estimated_count_threshold:
+                self.is_count_exact = False
+                return estimated_count
+
+        cache_key = self.get_count_cache_key(queryset)
+        count = cache.get(cache_key)
+
+        if count is None:
+            count = super().get_count(queryset)
+            cache.set(cache_key, count, self.count_cache_timeout)
+        return count
+
+    def get_count_cache_key(self, queryset):
+        # The compiled SQL is the normalized form of the view's filters, including the ones coming from the URL or the user
+        sql, params = queryset.query.sql_with_params()
+        digest = hashlib.md5(f'{sql}{params!r}'.encode()).hexdigest()
+        return f'pagination_count:{type(self.view).__name__}:{digest}'
+
+    def get_estimated_count(self, queryset):
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+
+        # reltuples is -1 for a table that has never been vacuumed or analyzed
+        if row is None or row[0] < 0:
+            return None
+        return row[0]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.view = view
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_data(self, paginator):
+        count_data = super().get_count_data(paginator)
+        count_data['is_count_exact'] = self.is_count_exact
+        return count_data
@@ -8,6 +8,7 @@ from rest_framework.exceptions import AuthenticationFailed
 from online_reservation.models import Doctor
 
 from .models import OTP
+from .otp_stores import get_otp_store
 
 
 User = get_user_model()
@@ -24,11 +25,7 @@ class OTPSerializer(serializers.ModelSerializer):
         }
 
     def create(self, validated_data):
-        otp = OTP()
-        otp.phone = validated_data.get('phone')
-        otp.generate_password()
-        otp.save()
-        return otp
+        return get_otp_store().create(validated_data.get('phone'))
 
 
 class VerifyOTPSerializer(serializers.ModelSerializer):
@@ -0,0 +1,8 @@
+from config.celery_config import app
+from .otp_stores import get_otp_store
+
+
+@app.task(queue='tasks')
+def purge_expired_otps():
+    deleted_count = get_otp_store().purge_expired()
+    return f'{deleted_count} expired one-time passwords were purged.'
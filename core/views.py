@@ -1,5 +1,3 @@
-from django.db import transaction
-from django.utils import timezone
 from django.utils.translation import gettext as _
 from django.contrib.auth import get_user_model
 from rest_framework import status, generics
@@ -12,8 +10,8 @@ from rest_framework_simplejwt.views import TokenObtainPairView
 
 from .serializers import OTPSerializer, VerifyOTPSerializer, UserSerializer, UserDetailSerializer, SetPasswordSerializer, CustomTokenObtainPairSerializer
 from .throttles import RequestOTPThrottle
-from .models import OTP
-from .paginations import CustomLimitOffsetPagination
+from .otp_stores import get_otp_store
+from .paginations import CachedCountLimitOffsetPagination
 from online_reservation.models import Doctor
 
 
@@ -39,46 +37,35 @@ class VerifyOTPGenericAPIView(generics.GenericAPIView):
     serializer_class = VerifyOTPSerializer
 
     def post(self, request, *args, **kwargs):
-        with transaction.atomic():
-            serializer = self.get_serializer(data=request.data)
-            serializer.is_valid(raise_exception=True)
-            validated_data = serializer.validated_data
-            phone = validated_data.get('phone')
-            password = validated_data.get('password')
-            request_id = validated_data.get('id')
-
-            try:
-                otp_obj = OTP.objects.get(
-                    id=request_id,
-                    phone=phone,
-                    password=password,
-                    expired_datetime__gte=timezone.now(),
-                )
-
-                try:
-                    user = User.objects.get(phone=phone)
-                except User.DoesNotExist:
-                    user = User(phone=phone)
-                    user.set_unusable_password()
-                    user.save()
-                
-                otp_obj.delete()
-
-                refresh_token = RefreshToken.for_user(user=user)
-                return Response({
-                        'refresh': str(refresh_token),
-                        'access': str(refresh_token.access_token), 
-                        'user_id': user.id,
-                        'phone': user.phone,
-                    }, status=status.HTTP_200_OK)
-            
-            except OTP.DoesNotExist:
-                return Response({'detail': _('Your one-time password is incorrect or has expired!')}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
+        phone = validated_data.get('phone')
+        password = validated_data.get('password')
+        request_id = validated_data.get('id')
+
+        if not get_otp_store().verify(request_id, phone, password):
+            return Response({'detail': _('Your one-time password is incorrect or has expired!')}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            user = User.objects.get(phone=phone)
+        except User.DoesNotExist:
+            user = User(phone=phone)
+            user.set_unusable_password()
+            user.save()
+
+        refresh_token = RefreshToken.for_user(user=user)
+        return Response({
+                'refresh': str(refresh_token),
+                'access': str(refresh_token.access_token), 
+                'user_id': user.id,
+                'phone': user.phone,
+            }, status=status.HTTP_200_OK)
 
 
 class UserViewSet(ModelViewSet):
     queryset = User.objects.order_by('-id')
-    pagination_class = CustomLimitOffsetPagination
+    pagination_class = CachedCountLimitOffsetPagination
     permission_classes = [IsAdminUser]
 
     def get_serializer_class(self):
@@ -9,6 +9,7 @@ from django.utils.html import format_html
 from datetime import datetime, timezone, timedelta
 
 from . import models
+from .search import search_doctors
 
 
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
@@ -153,6 +154,12 @@ class DoctorAdmin(admin.ModelAdmin):
         return super().get_queryset(request)\
                .annotate(specialties_count=Count('specialties', distinct=True), reserves_count=Count('reserves', distinct=True), comments_count=Count('comments', distinct=True))
 
+    def get_search_results(self, request, queryset, search_term):
+        # Same indexed search as the API instead of scanning the names with icontains
+        if not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        return search_doctors(queryset, search_term), False
+
     @admin.display(description=_('phone'))
     def get_phone(self, patient):
         return patient.user.phone
@@ -274,6 +281,7 @@ class CommentAdmin(admin.ModelAdmin):
 @admin.register(models.Reserve)
 class ReserveAdmin(admin.ModelAdmin):
     list_display = ['patient', 'get_doctor', 'status', 'price', 'get_reserve_datetime', 'celery_task_id', 'celery_payment_expiration_datetime', 'is_expired']
+    list_filter = ['status', 'payment_verification_status']
     list_per_page = 15
     list_select_related = ['patient', 'doctor']
     autocomplete_fields = ['patient', 'doctor']
@@ -296,3 +304,61 @@ class ReserveAdmin(admin.ModelAdmin):
     @admin.display(description=_('is_expired'))
     def is_expired(self, reserve):
         return True if reserve.reserve_datetime < datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=5) else False
+
+
+@admin.register(models.ReservePayment)
+class ReservePaymentAdmin(admin.ModelAdmin):
+    list_display = ['authority', 'reserve', 'patient', 'amount', 'status', 'ref_id', 'created_datetime']
+    list_filter = ['status']
+    list_per_page = 15
+    list_select_related = ['reserve__doctor', 'reserve__patient', 'patient']
+    search_fields = ['authority', 'ref_id']
+    readonly_fields = [field.name for field in models.ReservePayment._meta.fields]
+    ordering = ['-created_datetime']
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(models.DoctorStats)
+class DoctorStatsAdmin(admin.ModelAdmin):
+    list_display = ['get_full_name', 'comment_count', 'rating_average', 'suggest_percentage', 'paid_reserve_count', 'next_free_reserve_datetime', 'updated_datetime']
+    list_per_page = 15
+    list_select_related = ['doctor']
+    search_fields = ['doctor__first_name', 'doctor__last_name']
+    readonly_fields = [field.name for field in models.DoctorStats._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description=_('full_name'))
+    def get_full_name(self, doctor_stats):
+        return doctor_stats.doctor.full_name
+
+
+@admin.register(models.DoctorAlternative)
+class DoctorAlternativeAdmin(admin.ModelAdmin):
+    list_display = ['get_full_name', 'specialty', 'city', 'next_free_reserve_datetime']
+    list_per_page = 15
+    list_select_related = ['doctor', 'specialty', 'city']
+    list_filter = ['specialty']
+    readonly_fields = [field.name for field in models.DoctorAlternative._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    @admin.display(description=_('full_name'))
+    def get_full_name(self, doctor_alternative):
+        return doctor_alternative.doctor.full_name
+
+
+@admin.register(models.ScheduleTemplate)
+class ScheduleTemplateAdmin(admin.ModelAdmin):
+    list_display = ['get_doctor', 'weekdays', 'start_time', 'end_time', 'slot_minutes', 'price']
+    list_per_page = 15
+    list_select_related = ['doctor']
+    autocomplete_fields = ['doctor']
+
+    @admin.display(description=_('doctor'), ordering='doctor__id')
+    def get_doctor(self, schedule_template):
+        return schedule_template.doctor.full_name
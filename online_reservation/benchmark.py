@@ -0,0 +1,677 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, Q
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.urls import reverse, get_resolver, URLPattern, URLResolver
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from rest_framework.parsers import JSONParser
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+import io
+import statistics
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone, time as day_time
+
+from config.parsers import ORJSONParser
+from config.renderers import ORJSONRenderer
+from core.models import OTP
+from .caching import invalidate_doctor_responses
+from .fake_data import RESERVE_FUTURE_DAYS
+from .models import Province, Insurance, Specialty, Patient, Doctor, Reserve, ReservePayment, Comment, ScheduleTemplate
+from .payment import verify_reserve_payment
+from .search import search_doctors, search_doctors_icontains
+from .serializers import DoctorSerializer, ReservePatientSerializer, CommentSerializer
+
+
+User = get_user_model()
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+BENCHMARKED_URLCONFS = ['core', 'online_reservation']
+
+# Routes that call an external service in every request, they can't be measured offline
+EXTERNAL_ROUTES = {
+    ('POST', 'online_reservation:payment-process-sandbox'): 'Sends a payment request to Zarinpal.'
+}
+
+
+@contextmanager
+def benchmark_database(keepdb=False):
+    """
+    Run the block in a test database, created before it and destroyed after it
+    (or reused and kept with keepdb), as the test runner does.
+    """
+    old_database_name = connection.settings_dict['NAME']
+    setup_test_environment(debug=False)
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_database_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+class RowCountingCursor:
+    """
+    Proxy of a DB-API cursor that counts the rows fetched through it.
+    """
+
+    def __init__(self, cursor, stats):
+        self.cursor = cursor
+        self.stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.stats.rows += 1
+            yield row
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        if row is not None:
+            self.stats.rows += 1
+        return row
+
+    def fetchmany(self, *args, **kwargs):
+        rows = self.cursor.fetchmany(*args, **kwargs)
+        self.stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self.cursor.fetchall()
+        self.stats.rows += len(rows)
+        return rows
+
+
+class QueryStats:
+    """
+    Count the queries executed and the rows fetched on the default connection inside a with block.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        cursor_wrapper = context['cursor']
+        if not isinstance(cursor_wrapper.cursor, RowCountingCursor):
+            cursor_wrapper.cursor = RowCountingCursor(cursor_wrapper.cursor, self)
+        else:
+            cursor_wrapper.cursor.stats = self
+
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self.wrapper = connection.execute_wrapper(self)
+        self.wrapper.__enter__()
+        return self
+
+    def __exit__(self, *args):
+        self.wrapper.__exit__(*args)
+
+
+class BenchmarkCase:
+
+    def __init__(self, method, url_name, kwargs=None, user=None, data=None, setup=None, label=''):
+        self.method = method
+        self.url_name = url_name
+        self.kwargs = kwargs or {}
+        self.user = user
+        self.data = data or {}
+        self.setup = setup
+        self.label = label
+
+    @property
+    def name(self):
+        name = f'{self.method} {self.url_name}'
+        return f'{name} ({self.label})' if self.label else name
+
+
+class BenchmarkFixtures:
+    """
+    Users and objects of the seeded dataset that the benchmark cases point to.
+    """
+
+    def __init__(self):
+        now = datetime.now(tz=TEHRAN_TZ)
+
+        self.admin = User.objects.create_superuser(phone='09999999999', password='benchmark-password')
+        self.doctor = Doctor.objects.select_related('user').order_by('id').first()
+        self.reserve = Reserve.objects.filter(patient__isnull=False, patient__user__doctor__isnull=True).select_related('patient__user').order_by('id').first()
+        self.patient = self.reserve.patient
+        self.doctor_reserve = Reserve.objects.filter(doctor=self.doctor).order_by('id').first()
+        self.free_reserve = Reserve.objects.filter(patient__isnull=True, reserve_datetime__gte=now + timedelta(days=1)).order_by('id').first()
+        self.comment = Comment.objects.filter(doctor=self.doctor, status=Comment.COMMENT_STATUS_APPROVED).order_by('id').first()
+        self.waiting_comment = Comment.objects.filter(status=Comment.COMMENT_STATUS_WAITING).order_by('id').first()
+        self.province = Province.objects.order_by('id').first()
+        self.city = self.province.cities.order_by('id').first()
+        self.insurance = Insurance.objects.order_by('id').first()
+        self.specialty = Specialty.objects.order_by('id').first()
+
+        # A doctor request waiting for the admin, and a patient who can send one
+        requester = Patient.objects.filter(user__doctor__isnull=True).exclude(id=self.patient.id).order_by('id').first()
+        self.doctor_request = Doctor.objects.create(
+            user=requester.user, first_name=requester.first_name, last_name=requester.last_name,
+            national_code=requester.national_code, gender=requester.gender, medical_council_number='99999'
+        )
+        self.doctor_request.specialties.create(specialty=self.specialty)
+        self.new_doctor_patient = Patient.objects.filter(user__doctor__isnull=True).exclude(id__in=[self.patient.id, requester.id]).order_by('id').first()
+        # A patient without an upcoming reserve, so holding one doesn't release another
+        self.paying_patient = Patient.objects.filter(user__doctor__isnull=True).exclude(reserves__reserve_datetime__gte=now) \
+                                             .exclude(id__in=[requester.id, self.new_doctor_patient.id]).order_by('id').first()
+
+        self.schedule_template = ScheduleTemplate.objects.create(doctor=self.doctor, weekdays=list(range(7)), start_time=day_time(9), end_time=day_time(17), price=10000)
+        self.schedule_start_date = (now + timedelta(days=RESERVE_FUTURE_DAYS + 1)).date()
+
+        self.otp = OTP(phone='09999999998', expired_datetime=now + timedelta(days=1))
+        self.otp.generate_password()
+        self.otp.save()
+
+        self.refresh_token = str(RefreshToken.for_user(self.admin))
+        self.new_reserve_datetime = (now + timedelta(days=3)).replace(minute=7, second=0, microsecond=0)
+
+
+def get_benchmark_cases(fixtures):
+    f = fixtures
+    admin, doctor_user, patient_user = f.admin, f.doctor.user, f.patient.user
+
+    return [
+        # core
+        BenchmarkCase('GET', 'core:api-root'),
+        BenchmarkCase('POST', 'core:otp', data={'phone': '09999999997'}, setup=cache.clear),
+        BenchmarkCase('POST', 'core:otp-verify', data={'request_id': str(f.otp.id), 'phone': f.otp.phone, 'password': f.otp.password}),
+        BenchmarkCase('POST', 'core:login', data={'phone': admin.phone, 'password': 'benchmark-password'}),
+        BenchmarkCase('POST', 'core:refresh-token', data={'refresh': f.refresh_token}),
+        BenchmarkCase('GET', 'core:user-list', user=admin),
+        BenchmarkCase('GET', 'core:user-detail', {'pk': patient_user.id}, user=admin),
+        BenchmarkCase('PATCH', 'core:user-detail', {'pk': patient_user.id}, user=admin, data={'is_active': True}),
+        BenchmarkCase('POST', 'core:user-set-password', {'pk': patient_user.id}, user=admin, data={'password': 'benchmark-password'}),
+
+        # online_reservation
+        BenchmarkCase('GET', 'online_reservation:api-root'),
+        BenchmarkCase('GET', 'online_reservation:province-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:province-detail', {'pk': f.province.id}, user=admin),
+        BenchmarkCase('GET', 'online_reservation:province-cities-list', {'province_pk': f.province.id}),
+        BenchmarkCase('GET', 'online_reservation:province-cities-detail', {'province_pk': f.province.id, 'pk': f.city.id}),
+        BenchmarkCase('GET', 'online_reservation:insurance-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:insurance-detail', {'pk': f.insurance.id}, user=admin),
+        BenchmarkCase('POST', 'online_reservation:insurance-list', user=admin, data={'name': 'Benchmark'}),
+        BenchmarkCase('GET', 'online_reservation:specialty-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:specialty-detail', {'pk': f.specialty.id}, user=admin),
+        BenchmarkCase('GET', 'online_reservation:patient-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:patient-detail', {'pk': f.patient.id}, user=admin),
+        BenchmarkCase('GET', 'online_reservation:patient-me', user=patient_user),
+        BenchmarkCase('GET', 'online_reservation:patient-reserves-list', {'patient_pk': 'me'}, user=patient_user),
+        BenchmarkCase('GET', 'online_reservation:patient-reserves-list', {'patient_pk': 'me'}, user=patient_user,
+                      data={'pagination': 'cursor'}, label='cursor'),
+        BenchmarkCase('GET', 'online_reservation:patient-reserves-detail', {'patient_pk': 'me', 'pk': f.reserve.id}, user=patient_user),
+        # Measured without the response cache, the cached cases measure a hit
+        BenchmarkCase('GET', 'online_reservation:doctor-list', setup=invalidate_doctor_responses),
+        BenchmarkCase('GET', 'online_reservation:doctor-list', data={'has_free_reserve': True, 'ordering': 'closest_free_reserve'},
+                      setup=invalidate_doctor_responses, label='free reserve'),
+        BenchmarkCase('GET', 'online_reservation:doctor-list', data={'ordering': '-max_successful_reserve'},
+                      setup=invalidate_doctor_responses, label='successful reserves'),
+        BenchmarkCase('GET', 'online_reservation:doctor-list', label='cached'),
+        BenchmarkCase('GET', 'online_reservation:doctor-list', data={'search': f.doctor.last_name},
+                      setup=invalidate_doctor_responses, label='search'),
+        BenchmarkCase('GET', 'online_reservation:doctor-detail', {'pk': f.doctor.id}, setup=invalidate_doctor_responses),
+        BenchmarkCase('GET', 'online_reservation:doctor-detail', {'pk': f.doctor.id}, label='cached'),
+        BenchmarkCase('GET', 'online_reservation:doctor-me', user=doctor_user),
+        BenchmarkCase('GET', 'online_reservation:appointment', {'pk': f.doctor.id}),
+        BenchmarkCase('GET', 'online_reservation:appointment-calendar', {'pk': f.doctor.id}),
+        BenchmarkCase('GET', 'online_reservation:doctor-comments-list', {'doctor_pk': f.doctor.id}),
+        BenchmarkCase('GET', 'online_reservation:doctor-comments-detail', {'doctor_pk': f.doctor.id, 'pk': f.comment.id}, user=admin),
+        BenchmarkCase('POST', 'online_reservation:doctor-comments-list', {'doctor_pk': f.doctor.id}, user=patient_user,
+                      data={'rating': 5, 'is_suggest': True, 'waiting_time': 0, 'body': 'Benchmark', 'is_anonymous': False}),
+        BenchmarkCase('GET', 'online_reservation:doctor-reserves-list', {'doctor_pk': f.doctor.id}, user=admin),
+        BenchmarkCase('GET', 'online_reservation:doctor-reserves-list', {'doctor_pk': 'me'}, user=doctor_user,
+                      data={'pagination': 'cursor'}, label='cursor'),
+        BenchmarkCase('GET', 'online_reservation:doctor-reserves-detail', {'doctor_pk': f.doctor.id, 'pk': f.doctor_reserve.id}, user=admin),
+        BenchmarkCase('POST', 'online_reservation:doctor-reserves-list', {'doctor_pk': 'me'}, user=doctor_user,
+                      data={'price': 10000, 'reserve_datetime': f.new_reserve_datetime.strftime('%Y-%m-%d %H:%M')}),
+        BenchmarkCase('GET', 'online_reservation:doctor-schedule-templates-list', {'doctor_pk': 'me'}, user=doctor_user),
+        BenchmarkCase('GET', 'online_reservation:doctor-schedule-templates-detail', {'doctor_pk': 'me', 'pk': f.schedule_template.id}, user=doctor_user),
+        BenchmarkCase('POST', 'online_reservation:doctor-schedule-templates-list', {'doctor_pk': 'me'}, user=doctor_user,
+                      data={'weekdays': [5, 6, 0], 'start_time': '09:00', 'end_time': '12:00', 'price': 10000}),
+        BenchmarkCase('POST', 'online_reservation:doctor-schedule-templates-create-reserves', {'doctor_pk': 'me', 'pk': f.schedule_template.id}, user=doctor_user,
+                      data={'start_date': f.schedule_start_date, 'end_date': f.schedule_start_date + timedelta(days=29)}, label='30 days'),
+        BenchmarkCase('GET', 'online_reservation:list-waiting-comments-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:list-waiting-comments-detail', {'pk': f.waiting_comment.id}, user=admin),
+        BenchmarkCase('GET', 'online_reservation:list-doctor-requests-list', user=admin),
+        BenchmarkCase('GET', 'online_reservation:list-doctor-requests-detail', {'pk': f.doctor_request.id}, user=admin),
+        BenchmarkCase('POST', 'online_reservation:request-doctor', user=f.new_doctor_patient.user,
+                      data={'medical_council_number': '99998', 'first_name': 'Benchmark', 'last_name': 'Benchmark', 'national_code': '9999999999',
+                            'gender': Doctor.PERSON_GENDER_FEMALE, 'specialties_list': [f.specialty.id]}),
+        BenchmarkCase('GET', 'online_reservation:payment-process-sandbox', user=f.paying_patient.user, data={'reserve_id': f.free_reserve.id}),
+        BenchmarkCase('GET', 'online_reservation:payment-callback-sandbox', data={'Status': 'NOK', 'Authority': f.reserve.zarinpal_authority}),
+    ]
+
+
+def get_route_names():
+    """
+    Return the namespaced names of all routes of the benchmarked apps.
+    """
+    route_names = set()
+
+    def collect(patterns, namespace):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                collect(pattern.url_patterns, pattern.namespace or namespace)
+            elif isinstance(pattern, URLPattern) and pattern.name and namespace in BENCHMARKED_URLCONFS:
+                route_names.add(f'{namespace}:{pattern.name}')
+
+    collect(get_resolver().url_patterns, None)
+    return route_names
+
+
+class APIBenchmark:
+    """
+    Run every case against the current database, each request in a transaction that is
+    rolled back so every run sees the same data. Query count, rows fetched and peak
+    memory are measured on a separate run, so the instrumentation isn't in the timings.
+    """
+
+    def __init__(self, repeat=20, warmup=2):
+        self.repeat = repeat
+        self.warmup = warmup
+        self.clients = {}
+
+    def get_client(self, user):
+        if user not in self.clients:
+            client = APIClient()
+            if user is not None:
+                client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+            self.clients[user] = client
+        return self.clients[user]
+
+    def request(self, case):
+        client = self.get_client(case.user)
+        url = reverse(case.url_name, kwargs=case.kwargs)
+        method = getattr(client, case.method.lower())
+
+        if case.method == 'GET':
+            return method(url, case.data)
+        return method(url, case.data, format='json')
+
+    def run_once(self, case, measure=None):
+        with transaction.atomic():
+            if case.setup:
+                case.setup()
+
+            started_at = time.perf_counter()
+            if measure:
+                with measure:
+                    response = self.request(case)
+            else:
+                response = self.request(case)
+            elapsed = time.perf_counter() - started_at
+
+            transaction.set_rollback(True)
+        return response, elapsed
+
+    def run_case(self, case):
+        for _ in range(self.warmup):
+            self.run_once(case)
+
+        query_stats = QueryStats()
+        response, _ = self.run_once(case, query_stats)
+
+        tracemalloc.start()
+        self.run_once(case)
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings = [self.run_once(case)[1] * 1000 for _ in range(self.repeat)]
+
+        return {
+            'status_code': response.status_code,
+            'queries': query_stats.queries,
+            'rows': query_stats.rows,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(statistics.quantiles(timings, n=20, method='inclusive')[18], 3) if len(timings) > 1 else round(timings[0], 3),
+            'peak_memory_kb': round(peak_memory / 1024, 1)
+        }
+
+    def run(self, cases, log=print):
+        results = {}
+        for case in cases:
+            results[case.name] = self.run_case(case)
+            log(f'{case.name}: {results[case.name]}')
+        return results
+
+
+def compare_with_baseline(results, baseline, latency_threshold=0.25, latency_min_ms=2):
+    """
+    Return the regressions of results against baseline: more queries, another status code,
+    or a p95 latency more than latency_threshold (and latency_min_ms) above the baseline's.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        base = baseline[name]
+
+        if result['status_code'] != base['status_code']:
+            regressions.append(f"{name}: status code {base['status_code']} -> {result['status_code']}")
+        if result['queries'] > base['queries']:
+            regressions.append(f"{name}: queries {base['queries']} -> {result['queries']}")
+
+        latency_increase = result['p95_ms'] - base['p95_ms']
+        if latency_increase > latency_min_ms and latency_increase > base['p95_ms'] * latency_threshold:
+            regressions.append(f"{name}: p95 latency {base['p95_ms']}ms -> {result['p95_ms']}ms")
+
+    return regressions
+
+
+def get_search_benchmark_queries():
+    """
+    Search texts taken from the seeded doctors: whole words of every searched field and a misspelled name.
+    """
+    doctor = Doctor.objects.exclude(bio='').exclude(office_address='').order_by('id').first()
+    last_name = doctor.last_name
+    # Two letters swapped in the middle of the name, the kind of typo trigrams are there for
+    middle = len(last_name) // 2
+    misspelled_last_name = last_name[:middle - 1] + last_name[middle] + last_name[middle - 1] + last_name[middle + 1:]
+
+    return {
+        'last name': last_name,
+        'full name': f'{doctor.first_name} {doctor.last_name}',
+        'misspelled last name': misspelled_last_name,
+        'specialty': doctor.specialties.select_related('specialty').first().specialty.name,
+        'bio word': max(doctor.bio.split(), key=len),
+        'office address word': max(doctor.office_address.split(), key=len)
+    }
+
+
+class SearchBenchmark:
+    """
+    Time the doctor search against the icontains scan it replaces, for the count and
+    the first page of the results, like the doctor list does.
+    """
+    searches = {
+        'search': search_doctors,
+        'icontains': search_doctors_icontains
+    }
+
+    def __init__(self, repeat=20, page_size=10):
+        self.repeat = repeat
+        self.page_size = page_size
+
+    def run_once(self, search, text):
+        queryset = search(Doctor.objects.filter(status=Doctor.DOCTOR_STATUS_ACCEPTED), text)
+
+        started_at = time.perf_counter()
+        count = queryset.count()
+        page = list(queryset.values_list('id', flat=True)[:self.page_size])
+        return count, page, time.perf_counter() - started_at
+
+    def run_case(self, search, text):
+        count, page, _ = self.run_once(search, text)
+        timings = [self.run_once(search, text)[2] * 1000 for _ in range(self.repeat)]
+
+        return {
+            'count': count,
+            'first_page': page,
+            'p50_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(statistics.quantiles(timings, n=20, method='inclusive')[18], 3) if len(timings) > 1 else round(timings[0], 3)
+        }
+
+    def run(self, queries, log=print):
+        results = {}
+        for label, text in queries.items():
+            results[label] = {'text': text}
+            for name, search in self.searches.items():
+                results[label][name] = self.run_case(search, text)
+                log(f'{label} ({text}) {name}: {results[label][name]}')
+        return results
+
+
+def get_json_benchmark_payloads():
+    """
+    Response data of the routes with the biggest payloads, for the doctors of the
+    seeded dataset that make them the biggest.
+    """
+    now = datetime.now(tz=TEHRAN_TZ)
+    client = APIClient()
+
+    commented_doctor = Doctor.objects.annotate(
+        approved_comment_count=Count('comments', filter=Q(comments__status=Comment.COMMENT_STATUS_APPROVED))
+    ).order_by('-approved_comment_count', 'id').first()
+    busy_doctor = Doctor.objects.annotate(
+        future_reserve_count=Count('reserves', filter=Q(reserves__reserve_datetime__gte=now))
+    ).order_by('-future_reserve_count', 'id').first()
+
+    return {
+        'doctor detail': client.get(reverse('online_reservation:doctor-detail', kwargs={'pk': commented_doctor.id})).data,
+        'doctor list': client.get(reverse('online_reservation:doctor-list'), {'limit': 15}).data,
+        'appointments': client.get(reverse('online_reservation:appointment', kwargs={'pk': busy_doctor.id})).data,
+    }
+
+
+class JSONBenchmark:
+    """
+    Time the rendering and the parsing of payloads with DRF's stdlib JSON classes and
+    the orjson ones, and check that both render the same bytes.
+    """
+    renderers = {
+        'json': JSONRenderer(),
+        'orjson': ORJSONRenderer()
+    }
+    parsers = {
+        'json': JSONParser(),
+        'orjson': ORJSONParser()
+    }
+
+    def __init__(self, repeat=200):
+        self.repeat = repeat
+
+    def measure(self, function):
+        timings = []
+        for _ in range(self.repeat):
+            started_at = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started_at) * 1000)
+
+        return {
+            'p50_ms': round(statistics.median(timings), 4),
+            'p95_ms': round(statistics.quantiles(timings, n=20, method='inclusive')[18], 4) if len(timings) > 1 else round(timings[0], 4)
+        }
+
+    def run_case(self, data):
+        result = {}
+        rendered = {name: renderer.render(data) for name, renderer in self.renderers.items()}
+
+        for name, renderer in self.renderers.items():
+            result[name] = {
+                'bytes': len(rendered[name]),
+                'render': self.measure(lambda: renderer.render(data)),
+                'parse': self.measure(lambda: self.parsers[name].parse(io.BytesIO(rendered['json'])))
+            }
+        result['same_output'] = rendered['json'] == rendered['orjson']
+        return result
+
+    def run(self, payloads, log=print):
+        results = {}
+        for name, data in payloads.items():
+            results[name] = self.run_case(data)
+            log(f'{name}: {results[name]}')
+        return results
+
+
+def get_serializer_benchmark_instances(count=500):
+    """
+    Instances of the list endpoints with the fast serializers, loaded as those endpoints load them.
+    """
+    # Imported here, the views import this module's neighbours and not the other way round
+    from .views import DoctorViewSet
+
+    return {
+        'doctors': (DoctorSerializer, list(DoctorViewSet(action='list').get_queryset()[:count])),
+        'patient reserves': (ReservePatientSerializer, list(Reserve.objects.select_related('doctor').order_by('-reserve_datetime')[:count])),
+        'comments': (CommentSerializer, list(Comment.objects.select_related('patient').order_by('-created_datetime')[:count])),
+    }
+
+
+class SerializerBenchmark:
+    """
+    Time the serialization of lists through the fields of the serializers and through
+    their fast path, per item, and check that both render the same JSON.
+    """
+
+    def __init__(self, repeat=20):
+        self.repeat = repeat
+
+    def measure(self, serialize, count):
+        timings = []
+        for _ in range(self.repeat):
+            started_at = time.perf_counter()
+            serialize()
+            timings.append((time.perf_counter() - started_at) * 1000000 / count)
+        return {
+            'p50_us_per_item': round(statistics.median(timings), 2),
+            'p95_us_per_item': round(statistics.quantiles(timings, n=20, method='inclusive')[18], 2) if len(timings) > 1 else round(timings[0], 2)
+        }
+
+    def run_case(self, serializer_class, instances):
+        serialize_fields = lambda: ListSerializer(instances, child=serializer_class()).data
+        serialize_fast = lambda: serializer_class(instances, many=True).data
+
+        return {
+            'items': len(instances),
+            'fields': self.measure(serialize_fields, len(instances)),
+            'fast': self.measure(serialize_fast, len(instances)),
+            'same_output': JSONRenderer().render(serialize_fields()) == JSONRenderer().render(serialize_fast())
+        }
+
+    def run(self, cases, log=print):
+        results = {}
+        for name, (serializer_class, instances) in cases.items():
+            results[name] = self.run_case(serializer_class, instances)
+            log(f'{name}: {results[name]}')
+        return results
+
+
+class OTPVerifyBenchmark:
+    """
+    Verify passwords of an OTP store from concurrent workers, each password once, and
+    report the throughput, the latency and whether every password was accepted exactly once.
+    """
+
+    def __init__(self, passwords=2000, workers=8):
+        self.passwords = passwords
+        self.workers = workers
+
+    def verify(self, store, otp):
+        started_at = time.perf_counter()
+        is_verified = store.verify(otp.id, otp.phone, otp.password)
+        latency = (time.perf_counter() - started_at) * 1000
+        connection.close()
+        return is_verified, latency
+
+    def run_case(self, store):
+        otps = [store.create(f'09{index:09d}') for index in range(self.passwords)]
+
+        started_at = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            verifications = list(executor.map(lambda otp: self.verify(store, otp), otps))
+        duration = time.perf_counter() - started_at
+
+        latencies = [latency for _, latency in verifications]
+        return {
+            'verifies_per_second': round(len(otps) / duration, 1),
+            'p50_ms': round(statistics.median(latencies), 4),
+            'p95_ms': round(statistics.quantiles(latencies, n=20, method='inclusive')[18], 4) if len(latencies) > 1 else round(latencies[0], 4),
+            'all_verified': all(is_verified for is_verified, _ in verifications),
+            'none_verified_twice': not any(store.verify(otp.id, otp.phone, otp.password) for otp in otps)
+        }
+
+    def run(self, stores, log=print):
+        results = {}
+        for name, store in stores.items():
+            results[name] = self.run_case(store)
+            log(f'{name}: {results[name]}')
+        return results
+
+
+class PaymentCallbackBenchmark:
+    """
+    Send the payment callbacks of paid reserves from concurrent clients, with the verification
+    done in the request and left to Celery, against a gateway stand-in, and report the
+    callbacks' throughput and latency and the reserves paid in the end.
+    """
+
+    def __init__(self, gateway, callbacks=200, workers=8):
+        self.gateway = gateway
+        self.callbacks = callbacks
+        self.workers = workers
+
+    def create_paid_reserves(self, doctor, patient, start_datetime):
+        reserves = []
+        for index in range(self.callbacks):
+            price = 10000 + index
+            authority = self.gateway.payment_request({'Amount': price, 'CallbackURL': 'http://testserver/'})['Authority']
+            self.gateway.pay(authority)
+            reserves.append(Reserve(
+                doctor=doctor, patient=patient, price=price, zarinpal_authority=authority,
+                reserve_datetime=start_datetime + timedelta(minutes=15 * index)
+            ))
+
+        reserves = Reserve.objects.bulk_create(reserves)
+        ReservePayment.objects.bulk_create([
+            ReservePayment(reserve=reserve, patient=patient, authority=reserve.zarinpal_authority, amount=reserve.price)
+            for reserve in reserves
+        ])
+        return reserves
+
+    def callback(self, authority):
+        started_at = time.perf_counter()
+        response = APIClient().get(reverse('online_reservation:payment-callback-sandbox'), {'Status': 'OK', 'Authority': authority})
+        latency = (time.perf_counter() - started_at) * 1000
+        connection.close()
+        return response.status_code, latency
+
+    def run_case(self, reserves, is_async):
+        authorities = [reserve.zarinpal_authority for reserve in reserves]
+
+        with override_settings(PAYMENT_VERIFICATION_ASYNC=is_async, ZARINPAL_SANDBOX_URL=self.gateway.url):
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                callbacks = list(executor.map(self.callback, authorities))
+            duration = time.perf_counter() - started_at
+
+            # What the workers of the queue do afterwards
+            if is_async:
+                for authority in authorities:
+                    verify_reserve_payment(authority)
+
+        latencies = [latency for _, latency in callbacks]
+        return {
+            'callbacks_per_second': round(len(callbacks) / duration, 1),
+            'p50_ms': round(statistics.median(latencies), 4),
+            'p95_ms': round(statistics.quantiles(latencies, n=20, method='inclusive')[18], 4) if len(latencies) > 1 else round(latencies[0], 4),
+            'status_codes': dict(Counter(status_code for status_code, _ in callbacks)),
+            'paid': Reserve.objects.filter(id__in=[reserve.id for reserve in reserves], status=Reserve.RESERVE_STATUS_PAID).count()
+        }
+
+    def run(self, doctor, patient, log=print):
+        results = {}
+        start_datetime = (datetime.now(tz=TEHRAN_TZ) + timedelta(days=RESERVE_FUTURE_DAYS + 1)).replace(minute=0, second=0, microsecond=0)
+
+        for name, is_async in [('sync', False), ('async', True)]:
+            reserves = self.create_paid_reserves(doctor, patient, start_datetime)
+            start_datetime += timedelta(days=self.callbacks)
+            results[name] = self.run_case(reserves, is_async)
+            log(f'{name}: {results[name]}')
+        return results
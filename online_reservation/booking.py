@@ -0,0 +1,122 @@
+from django.db import connection, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from datetime import datetime, timezone, timedelta
+
+from .models import Reserve
+from .stats import refresh_next_free_reserves
+
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+HOLD_CLAIMED = 'claimed'
+HOLD_ALREADY_HELD = 'already_held'
+HOLD_CONFLICT = 'conflict'
+
+HOLD_DURATION = timedelta(minutes=20)
+HOLD_MARGIN_BEFORE_RESERVE = timedelta(minutes=5)
+
+# The payment fields of a reserve are about its holder's payment, they are cleared whenever
+# it is claimed or released. The payments themselves stay in ReservePayment.
+CLEARED_PAYMENT_FIELDS = {'zarinpal_authority': '', 'zarinpal_ref_id': '', 'payment_verification_status': ''}
+
+
+class ReserveTakenError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _('This reserve has been taken by another patient.')
+    default_code = 'reserve_taken'
+
+
+def get_hold_expiration_datetime(reserve, now):
+    return min(reserve.reserve_datetime - HOLD_MARGIN_BEFORE_RESERVE, now + HOLD_DURATION)
+
+
+def hold_reserve(reserve, patient):
+    """
+    Hold reserve for patient until they pay, and release the patient's previous hold.
+    The reserve is claimed with an UPDATE conditioned on it being free, so of several
+    patients holding the same reserve at the same time only one gets HOLD_CLAIMED,
+    the others get HOLD_CONFLICT. HOLD_ALREADY_HELD means patient already holds it.
+
+    The claim and the release are one UPDATE, followed by the refresh of the doctors'
+    next free reserve. A failed claim is followed by one SELECT of the holder.
+    """
+    now = datetime.now(tz=TEHRAN_TZ)
+    expiration_datetime = get_hold_expiration_datetime(reserve, now)
+
+    with transaction.atomic():
+        # reserve id: doctor id, of the claimed reserve and the released ones
+        updated_reserves = claim_and_release_reserves(reserve, patient, expiration_datetime, now)
+        is_claimed = reserve.id in updated_reserves
+
+        if is_claimed:
+            # The update bypasses the signals, so the doctors' next free reserve is refreshed here
+            refresh_next_free_reserves(set(updated_reserves.values()))
+        elif updated_reserves:
+            # The reserve was claimed by another patient during the update, the release is undone
+            transaction.set_rollback(True)
+
+    if not is_claimed:
+        holder_id = Reserve.objects.filter(id=reserve.id).values_list('patient_id', flat=True).first()
+        return HOLD_ALREADY_HELD if holder_id == patient.id else HOLD_CONFLICT
+
+    reserve.patient = patient
+    reserve.celery_payment_expiration_datetime = expiration_datetime
+    for field, value in CLEARED_PAYMENT_FIELDS.items():
+        setattr(reserve, field, value)
+    # The instance matches its row again, for the statistics signals of its next save
+    if hasattr(reserve, '_loaded_values'):
+        reserve._loaded_values.update(patient_id=patient.id, celery_payment_expiration_datetime=expiration_datetime)
+    return HOLD_CLAIMED
+
+
+def claim_and_release_reserves(reserve, patient, expiration_datetime, now):
+    """
+    Claim reserve for patient if it is free and release the patient's previous holds, in one
+    UPDATE ... RETURNING (PostgreSQL and SQLite). The previous holds are only released while
+    the reserve is free. Return {reserve id: doctor id} of the updated reserves.
+    """
+    cleared_fields = ', '.join(f'{field} = %({field})s' for field in CLEARED_PAYMENT_FIELDS)
+    table = Reserve._meta.db_table
+    sql = f"""
+        UPDATE {table} SET
+            patient_id = CASE WHEN id = %(reserve_id)s THEN %(patient_id)s ELSE NULL END,
+            celery_payment_expiration_datetime = CASE WHEN id = %(reserve_id)s THEN %(expiration_datetime)s ELSE NULL END,
+            {cleared_fields}
+        WHERE (id = %(reserve_id)s AND patient_id IS NULL)
+            OR (
+                patient_id = %(patient_id)s
+                AND status = %(unpaid)s
+                AND reserve_datetime >= %(released_from)s
+                AND id <> %(reserve_id)s
+                -- A hold whose payment is being verified is kept, the patient may have paid it
+                AND payment_verification_status <> %(verification_pending)s
+                AND EXISTS (SELECT 1 FROM {table} AS claimed WHERE claimed.id = %(reserve_id)s AND claimed.patient_id IS NULL)
+            )
+        RETURNING id, doctor_id
+    """
+    params = {
+        'reserve_id': reserve.id,
+        'patient_id': patient.id,
+        'expiration_datetime': connection.ops.adapt_datetimefield_value(expiration_datetime),
+        'released_from': connection.ops.adapt_datetimefield_value(now + HOLD_MARGIN_BEFORE_RESERVE),
+        'unpaid': Reserve.RESERVE_STATUS_UNPAID,
+        'verification_pending': Reserve.PAYMENT_VERIFICATION_PENDING,
+        **CLEARED_PAYMENT_FIELDS
+    }
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return dict(cursor.fetchall())
+
+
+def hold_reserve_or_raise(reserve, patient):
+    """
+    hold_reserve for the views, raise ReserveTakenError if another patient holds reserve.
+    """
+    result = hold_reserve(reserve, patient)
+    if result == HOLD_CONFLICT:
+        raise ReserveTakenError()
+    return result
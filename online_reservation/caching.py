@@ -0,0 +1,123 @@
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+import hashlib
+import time
+
+from config.metrics import RESPONSE_CACHE_REQUESTS
+
+
+DOCTOR_RESPONSES_NAMESPACE = 'doctors'
+
+
+def get_response_cache_version(namespace):
+    return get_response_cache_versions([namespace])[0]
+
+
+def get_response_cache_versions(namespaces):
+    """
+    Return the current version of each namespace, reading them all in one round trip.
+    """
+    version_keys = [f'response_cache_version:{namespace}' for namespace in namespaces]
+    versions = cache.get_many(version_keys)
+
+    for version_key in version_keys:
+        if version_key not in versions:
+            # Start from the clock, not from 1, so a lost version key never brings back the responses of an older version
+            cache.add(version_key, time.time_ns(), None)
+            versions[version_key] = cache.get(version_key)
+    return [versions[version_key] for version_key in version_keys]
+
+
+def invalidate_responses(namespace):
+    """
+    Make every cached response of namespace stale by moving to a new version,
+    the old entries are left to expire.
+    """
+    version_key = f'response_cache_version:{namespace}'
+    try:
+        cache.incr(version_key)
+    except ValueError:
+        cache.add(version_key, time.time_ns(), None)
+
+
+def get_list_namespace(namespace):
+    return f'{namespace}:list'
+
+
+def get_object_namespace(namespace, pk):
+    return f'{namespace}:{pk}'
+
+
+def invalidate_doctor_responses(doctor_ids=None, is_list_changed=True):
+    """
+    Make the cached details of the given doctors stale (of every doctor, and the lists, if None),
+    and the cached lists too if is_list_changed, that is if a field shown in the lists changed.
+    """
+    if doctor_ids is None:
+        invalidate_responses(DOCTOR_RESPONSES_NAMESPACE)
+        return
+
+    for doctor_id in set(doctor_ids):
+        invalidate_responses(get_object_namespace(DOCTOR_RESPONSES_NAMESPACE, doctor_id))
+    if is_list_changed:
+        invalidate_responses(get_list_namespace(DOCTOR_RESPONSES_NAMESPACE))
+
+
+class CachedResponseMixin:
+    """
+    Cache the successful responses of the `cached_actions` of a public viewset, keyed on
+    the action, the URL kwargs and the normalized query params. Every response is invalidated
+    by `invalidate_responses(response_cache_namespace)`, the lists alone by invalidating
+    `get_list_namespace(response_cache_namespace)` and the details of one object alone by
+    invalidating `get_object_namespace(response_cache_namespace, pk)`. The responses expire
+    after `response_cache_timeout` seconds for what changes without a save, such as time.
+    """
+    cached_actions = ['list', 'retrieve']
+    response_cache_namespace = None
+    response_cache_timeout = 60
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_cached_response(self, get_response, request, *args, **kwargs):
+        if self.action not in self.cached_actions:
+            return get_response(request, *args, **kwargs)
+
+        view_name = type(self).__name__
+        cache_key = self.get_response_cache_key(request)
+        data = cache.get(cache_key)
+
+        if data is not None:
+            RESPONSE_CACHE_REQUESTS.labels(view_name, self.action, 'hit').inc()
+            response = Response(data, status=status.HTTP_200_OK)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        RESPONSE_CACHE_REQUESTS.labels(view_name, self.action, 'miss').inc()
+        response = get_response(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(cache_key, response.data, self.response_cache_timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def get_response_cache_key(self, request):
+        # The order of the query params doesn't change the response, the host does through the pagination links
+        query_params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+        kwargs = sorted(self.kwargs.items())
+        digest = hashlib.md5(f'{request.get_host()}{kwargs!r}{query_params!r}'.encode()).hexdigest()
+
+        versions = '.'.join(str(version) for version in get_response_cache_versions(self.get_response_cache_namespaces()))
+        return f'response_cache:{self.response_cache_namespace}:{versions}:{self.action}:{digest}'
+
+    def get_response_cache_namespaces(self):
+        namespace = self.response_cache_namespace
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+
+        if lookup_url_kwarg in self.kwargs:
+            return [namespace, get_object_namespace(namespace, self.kwargs[lookup_url_kwarg])]
+        return [namespace, get_list_namespace(namespace)]
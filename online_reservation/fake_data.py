@@ -0,0 +1,312 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.conf import settings
+from django.db import connection
+
+from faker import Faker
+import csv
+import io
+import json
+import random
+from datetime import datetime, date, time, timedelta, timezone
+
+from .models import Province, City, Insurance, Patient, Doctor, Specialty, DoctorSpecialty, \
+                    DoctorInsurance, DoctorStats, DoctorAlternative, Comment, Reserve, ReservePayment, ScheduleTemplate, Person
+from .stats import rebuild_doctor_stats, refresh_doctor_alternatives
+from .search import update_doctor_search_vectors
+
+
+User = get_user_model()
+
+SIZES = {
+    'small': {
+        'insurances': 20,
+        'specialties': 30,
+        'patients': 40,
+        'doctors': 15,
+        'reserves': 110,
+        'comments': 80
+    },
+    'benchmark': {
+        'insurances': 20,
+        'specialties': 50,
+        'patients': 2000,
+        'doctors': 200,
+        'reserves': 50000,
+        'comments': 10000
+    },
+    'production': {
+        'insurances': 50,
+        'specialties': 200,
+        'patients': 100000,
+        'doctors': 5000,
+        'reserves': 10000000,
+        'comments': 1000000
+    }
+}
+
+RESERVE_SLOT_MINUTES = 15
+RESERVE_PAST_DAYS = 730
+RESERVE_FUTURE_DAYS = 60
+NAME_POOL_SIZE = 500
+
+
+class FakeDataGenerator:
+    """
+    Generate a reproducible dataset of any size: the same seed on the same day gives
+    the same rows. Rows are written with COPY on PostgreSQL and with bulk_create in
+    batches otherwise, so signals don't run and doctor statistics are rebuilt at the end.
+    """
+    deleted_models = [DoctorAlternative, DoctorStats, ScheduleTemplate, ReservePayment, Reserve, Comment, DoctorSpecialty, DoctorInsurance, Patient, Doctor, City, Province, Insurance, Specialty]
+
+    def __init__(self, seed=None, batch_size=5000, use_copy=True, log=print):
+        self.random = random.Random(seed)
+        self.fake = Faker(locale='fa_IR')
+        self.fake.seed_instance(seed)
+        self.batch_size = batch_size
+        self.use_copy = use_copy and connection.vendor == 'postgresql'
+        self.log = log
+
+        # Reserve datetimes are relative to the start of today, so free future slots always exist
+        self.anchor_datetime = datetime.combine(date.today(), time(), tzinfo=timezone.utc)
+
+        self.first_names = [self.fake.first_name() for _ in range(NAME_POOL_SIZE)]
+        self.last_names = [self.fake.last_name() for _ in range(NAME_POOL_SIZE)]
+        self.sentences = [self.fake.sentence(nb_words=10, variable_nb_words=True) for _ in range(NAME_POOL_SIZE)]
+
+        self.person_counter = 0
+
+    def generate(self, insurances, specialties, patients, doctors, reserves, comments):
+        self.delete_old_data()
+
+        insurance_ids = self.step(f'Adding {insurances} insurances', self.create_insurances, insurances)
+        specialty_ids = self.step(f'Adding {specialties} specialties', self.create_specialties, specialties)
+        cities_by_province = self.step('Adding provinces & cities', self.create_provinces_and_cities)
+        patient_ids = self.step(f'Adding {patients} patients', self.create_patients, patients, insurance_ids, cities_by_province)
+        doctor_ids, doctor_patient_ids = self.step(f'Adding {doctors} doctors', self.create_doctors, doctors, insurance_ids, specialty_ids, cities_by_province)
+        patient_ids += doctor_patient_ids
+        self.step(f'Adding {reserves} reserves', self.create_reserves, reserves, doctor_ids, patient_ids)
+        self.step(f'Adding {comments} comments', self.create_comments, comments, doctor_ids, patient_ids)
+        self.step('Rebuilding doctor statistics', rebuild_doctor_stats)
+        self.step('Refreshing alternative doctors', refresh_doctor_alternatives)
+        self.step('Indexing doctors for search', update_doctor_search_vectors)
+
+    def step(self, title, function, *args):
+        started_at = datetime.now()
+        result = function(*args)
+        self.log(f'{title}...DONE ({(datetime.now() - started_at).total_seconds():.1f}s)')
+        return result
+
+    def delete_old_data(self):
+        if connection.vendor == 'postgresql':
+            tables = ', '.join(model._meta.db_table for model in self.deleted_models)
+            with connection.cursor() as cursor:
+                cursor.execute(f'TRUNCATE {tables} CASCADE')
+        else:
+            for model in self.deleted_models:
+                model.objects.all()._raw_delete(model.objects.db)
+
+    def insert(self, model, fields, rows):
+        """
+        Insert rows (tuples of values for fields, given by attname) in batches.
+        """
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._insert_batch(model, fields, batch)
+                batch = []
+
+        if batch:
+            self._insert_batch(model, fields, batch)
+
+    def _insert_batch(self, model, fields, batch):
+        if not self.use_copy:
+            model.objects.bulk_create([model(**dict(zip(fields, row))) for row in batch])
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in batch:
+            writer.writerow(['\\N' if value is None else value for value in row])
+        buffer.seek(0)
+
+        columns_by_attname = {field.attname: field.column for field in model._meta.concrete_fields}
+        columns = ', '.join(columns_by_attname[field] for field in fields)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {model._meta.db_table} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+    def random_datetime(self, start, end):
+        return start + timedelta(seconds=self.random.randint(0, int((end - start).total_seconds())))
+
+    def create_insurances(self, count):
+        self.insert(Insurance, ['name'], ((self.fake.word(),) for _ in range(count)))
+        return list(Insurance.objects.values_list('id', flat=True))
+
+    def create_specialties(self, count):
+        names = set()
+        while len(names) < count:
+            name = self.fake.word()
+            names.add(name if name not in names else f'{name} {len(names)}')
+
+        self.insert(Specialty, ['name'], ((name,) for name in sorted(names)))
+        return list(Specialty.objects.values_list('id', flat=True))
+
+    def create_provinces_and_cities(self):
+        with open(settings.BASE_DIR / 'json' / 'provinces.json') as file:
+            list_provinces = json.loads(file.read())
+        with open(settings.BASE_DIR / 'json' / 'cities.json') as file:
+            list_cities = json.loads(file.read())
+
+        self.insert(Province, ['name'], ((province.get('name'),) for province in list_provinces))
+        province_ids = dict(Province.objects.values_list('name', 'id'))
+        province_ids_by_json_id = {province.get('id'): province_ids[province.get('name')] for province in list_provinces}
+
+        self.insert(City, ['name', 'province_id'], (
+            (city.get('name'), province_ids_by_json_id[city.get('province_id')])
+            for city in list_cities if city.get('province_id') in province_ids_by_json_id
+        ))
+
+        cities_by_province = {}
+        for city_id, province_id in City.objects.values_list('id', 'province_id'):
+            cities_by_province.setdefault(province_id, []).append(city_id)
+        return cities_by_province
+
+    def create_users(self, count):
+        latest_user = User.objects.filter(phone__startswith='09').order_by('-phone').first()
+        first_number = int(latest_user.phone[2:]) + 1 if latest_user else 1
+        phones = ['09%09d' % number for number in range(first_number, first_number + count)]
+
+        self.insert(User, ['phone', 'password', 'is_active', 'is_staff', 'is_superuser'], (
+            (phone, make_password(None), True, False, False) for phone in phones
+        ))
+
+        user_ids = dict(User.objects.filter(phone__gte=phones[0], phone__lte=phones[-1]).values_list('phone', 'id')) if phones else {}
+        return [user_ids[phone] for phone in phones]
+
+    def new_person(self, cities_by_province):
+        self.person_counter += 1
+        province_id = self.random.choice(list(cities_by_province))
+
+        return {
+            'first_name': self.random.choice(self.first_names),
+            'last_name': self.random.choice(self.last_names),
+            'birth_date': date(1980, 1, 1) + timedelta(days=self.random.randint(0, 34 * 365)),
+            'national_code': '1%09d' % self.person_counter,
+            'email': f'user{self.person_counter}@gmail.com',
+            'gender': self.random.choice([Person.PERSON_GENDER_MALE, Person.PERSON_GENDER_FEMALE]),
+            'province_id': province_id,
+            'city_id': self.random.choice(cities_by_province[province_id])
+        }
+
+    def patient_row(self, user_id, person, insurance_ids):
+        created_datetime = self.random_datetime(datetime(2018, 1, 1, tzinfo=timezone.utc), datetime(2020, 1, 1, tzinfo=timezone.utc))
+        return (
+            user_id, person['first_name'], person['last_name'], person['birth_date'], person['national_code'],
+            person['email'], person['gender'], self.random.choice(insurance_ids), self.random.choice(self.sentences),
+            False, person['province_id'], person['city_id'], created_datetime
+        )
+
+    patient_fields = ['user_id', 'first_name', 'last_name', 'birth_date', 'national_code', 'email', 'gender',
+                      'insurance_id', 'case_history', 'is_foreign_national', 'province_id', 'city_id', 'created_datetime']
+
+    def create_patients(self, count, insurance_ids, cities_by_province):
+        user_ids = self.create_users(count)
+
+        self.insert(Patient, self.patient_fields, (
+            self.patient_row(user_id, self.new_person(cities_by_province), insurance_ids) for user_id in user_ids
+        ))
+        return list(Patient.objects.values_list('id', flat=True))
+
+    def create_doctors(self, count, insurance_ids, specialty_ids, cities_by_province):
+        if count > 90000:
+            raise ValueError('There can be at most 90000 doctors, medical council numbers have 5 digits.')
+
+        user_ids = self.create_users(count)
+        persons = [self.new_person(cities_by_province) for _ in user_ids]
+
+        self.insert(Doctor, ['user_id', 'first_name', 'last_name', 'birth_date', 'national_code', 'email', 'gender',
+                             'medical_council_number', 'status', 'bio', 'office_address', 'province_id', 'city_id', 'confirm_datetime'], (
+            (
+                user_id, person['first_name'], person['last_name'], person['birth_date'], person['national_code'],
+                person['email'], person['gender'], str(10000 + index), Doctor.DOCTOR_STATUS_ACCEPTED,
+                self.random.choice(self.sentences), self.random.choice(self.sentences), person['province_id'], person['city_id'],
+                self.random_datetime(datetime(2020, 1, 1, tzinfo=timezone.utc), datetime(2022, 1, 1, tzinfo=timezone.utc))
+            )
+            for index, (user_id, person) in enumerate(zip(user_ids, persons))
+        ))
+
+        # Every doctor is a patient too, with the same personal information
+        self.insert(Patient, self.patient_fields, (
+            self.patient_row(user_id, person, insurance_ids) for user_id, person in zip(user_ids, persons)
+        ))
+
+        doctor_ids = list(Doctor.objects.values_list('id', flat=True))
+
+        self.insert(DoctorSpecialty, ['doctor_id', 'specialty_id'], (
+            (doctor_id, specialty_id)
+            for doctor_id in doctor_ids
+            for specialty_id in self.random.sample(specialty_ids, k=min(self.random.randint(1, 3), len(specialty_ids)))
+        ))
+        self.insert(DoctorInsurance, ['doctor_id', 'insurance_id'], (
+            (doctor_id, insurance_id)
+            for doctor_id in doctor_ids if self.random.random() <= 0.7
+            for insurance_id in self.random.sample(insurance_ids, k=min(self.random.randint(1, 3), len(insurance_ids)))
+        ))
+
+        doctor_patient_ids = list(Patient.objects.filter(user__doctor__isnull=False).values_list('id', flat=True))
+        return doctor_ids, doctor_patient_ids
+
+    def reserve_rows(self, count, doctor_ids, patient_ids):
+        slots_per_day = 24 * 60 // RESERVE_SLOT_MINUTES
+        first_slot = self.anchor_datetime - timedelta(days=RESERVE_PAST_DAYS)
+        slot_count = (RESERVE_PAST_DAYS + RESERVE_FUTURE_DAYS) * slots_per_day
+        reserve_number = 0
+
+        for index, doctor_id in enumerate(doctor_ids):
+            doctor_reserve_count = count // len(doctor_ids) + (1 if index < count % len(doctor_ids) else 0)
+
+            for slot in self.random.sample(range(slot_count), k=min(doctor_reserve_count, slot_count)):
+                reserve_number += 1
+                reserve_datetime = first_slot + timedelta(minutes=slot * RESERVE_SLOT_MINUTES)
+                is_past = reserve_datetime < self.anchor_datetime
+                is_paid = self.random.random() < (0.7 if is_past else 0.2)
+
+                yield (
+                    doctor_id,
+                    self.random.choice(patient_ids) if is_paid else None,
+                    Reserve.RESERVE_STATUS_PAID if is_paid else Reserve.RESERVE_STATUS_UNPAID,
+                    round(self.random.randint(5000, 100000), -3),
+                    reserve_datetime,
+                    f'A{reserve_number:035d}' if is_paid else '',
+                    str(self.random.randint(10 ** 9, 10 ** 10)) if is_paid else '',
+                    '',
+                    None
+                )
+
+    def create_reserves(self, count, doctor_ids, patient_ids):
+        if not doctor_ids:
+            return
+
+        self.insert(Reserve, ['doctor_id', 'patient_id', 'status', 'price', 'reserve_datetime', 'zarinpal_authority',
+                              'zarinpal_ref_id', 'celery_task_id', 'celery_payment_expiration_datetime'],
+                    self.reserve_rows(count, doctor_ids, patient_ids))
+
+    def create_comments(self, count, doctor_ids, patient_ids):
+        if not doctor_ids or not patient_ids:
+            return
+
+        self.insert(Comment, ['patient_id', 'doctor_id', 'rating', 'is_suggest', 'waiting_time', 'is_anonymous', 'body', 'status', 'created_datetime'], (
+            (
+                self.random.choice(patient_ids),
+                self.random.choice(doctor_ids),
+                self.random.choice(Comment.COMMENT_RATING)[0],
+                self.random.random() < 0.7,
+                self.random.choice(Comment.COMMENT_WAITING_TIME)[0],
+                self.random.random() < 0.3,
+                self.random.choice(self.sentences),
+                Comment.COMMENT_STATUS_APPROVED if self.random.random() < 0.8 else Comment.COMMENT_STATUS_WAITING,
+                self.random_datetime(self.anchor_datetime - timedelta(days=RESERVE_PAST_DAYS), self.anchor_datetime)
+            )
+            for _ in range(count)
+        ))
@@ -0,0 +1,161 @@
+"""
+A local stand-in for the Zarinpal sandbox, for testing the payments offline.
+
+It answers the payment requests and verifications like the sandbox, and its payment page
+pays the authority and redirects to the callback. `latency` delays every answer and
+`failure_rate` answers that share of the requests with a 503, to test the timeouts and the
+retries of the client. Run it with the run_fake_zarinpal command, or in the tests with:
+
+    with FakeZarinpalServer(latency=0.2) as server:
+        ZarinpalSandbox(base_url=server.url).payment_request(...)
+"""
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlencode
+
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+
+
+STATUS_SUCCESS = 100
+STATUS_ALREADY_VERIFIED = 101
+STATUS_NOT_FOUND = -11
+STATUS_NOT_PAID = -21
+STATUS_AMOUNT_MISMATCH = -33
+
+
+class FakeZarinpalRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        # Read before failing, the rest of the body would be taken for the next request of the connection
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.server.delay_or_fail(self):
+            return
+
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return self.send_json({'Status': -1, 'errors': ['Invalid JSON.']}, HTTPStatus.BAD_REQUEST)
+
+        if self.path == '/pg/rest/WebGate/PaymentRequest.json':
+            self.send_json(self.server.payment_request(data))
+        elif self.path == '/pg/rest/WebGate/PaymentVerification.json':
+            self.send_json(self.server.payment_verify(data))
+        else:
+            self.send_json({'Status': -1, 'errors': ['Not found.']}, HTTPStatus.NOT_FOUND)
+
+    def do_GET(self):
+        authority = self.path.removeprefix('/pg/StartPay/')
+        callback_url = self.server.pay(authority)
+        if callback_url is None:
+            return self.send_json({'Status': STATUS_NOT_FOUND, 'errors': ['Authority not found.']}, HTTPStatus.NOT_FOUND)
+
+        self.send_response(HTTPStatus.FOUND)
+        self.send_header('Location', f"{callback_url}?{urlencode({'Authority': authority, 'Status': 'OK'})}")
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def send_json(self, data, status=HTTPStatus.OK):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class FakeZarinpalServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0, failure_rate=0, seed=None, verbose=False):
+        super().__init__((host, port), FakeZarinpalRequestHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        # authority: {'amount', 'callback_url', 'is_paid', 'ref_id'}
+        self.payments = {}
+        self.request_count = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # The client timed out and closed the connection before the delayed answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def delay_or_fail(self, handler):
+        """
+        Apply the latency and the failure injection, return False when the request failed.
+        """
+        with self.lock:
+            self.request_count += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            is_failed = self.random.random() < self.failure_rate
+
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+
+        if is_failed:
+            handler.send_json({'Status': -1, 'errors': ['Service unavailable.']}, HTTPStatus.SERVICE_UNAVAILABLE)
+            return False
+        return True
+
+    def payment_request(self, data):
+        authority = f'A{uuid.uuid4().int % 10 ** 35:035d}'
+        with self.lock:
+            self.payments[authority] = {'amount': data.get('Amount'), 'callback_url': data.get('CallbackURL'), 'is_paid': False, 'ref_id': None}
+        return {'Status': STATUS_SUCCESS, 'Authority': authority, 'errors': []}
+
+    def pay(self, authority):
+        with self.lock:
+            payment = self.payments.get(authority)
+            if payment is None:
+                return None
+            payment['is_paid'] = True
+            return payment['callback_url']
+
+    def payment_verify(self, data):
+        with self.lock:
+            payment = self.payments.get(data.get('Authority'))
+
+            if payment is None:
+                return {'Status': STATUS_NOT_FOUND, 'errors': ['Authority not found.']}
+            if not payment['is_paid']:
+                return {'Status': STATUS_NOT_PAID, 'errors': ['The payment was not done.']}
+            if payment['amount'] != data.get('Amount'):
+                return {'Status': STATUS_AMOUNT_MISMATCH, 'errors': ['The amount does not match the payment.']}
+            if payment['ref_id'] is not None:
+                return {'Status': STATUS_ALREADY_VERIFIED, 'RefID': payment['ref_id'], 'errors': []}
+
+            payment['ref_id'] = self.random.randrange(10 ** 9, 10 ** 10)
+            return {'Status': STATUS_SUCCESS, 'RefID': payment['ref_id'], 'errors': []}
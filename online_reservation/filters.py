@@ -7,6 +7,7 @@ import django_filters
 from datetime import date, timedelta, datetime, timezone
 
 from .models import Doctor, Patient, Province, City, Insurance, Specialty, Reserve
+from .search import search_doctors
 
 
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
@@ -82,6 +83,8 @@ class DoctorFilter(PersonFilter):
     specialty = django_filters.NumberFilter(field_name='specialties__specialty', method='filter_specialty', label='specialty')
     insurance = django_filters.NumberFilter(field_name='insurances__insurance', method='filter_insurance', label='insurance')
     has_free_reserve = django_filters.BooleanFilter(field_name='reserves__reserve_datetime', method='filter_has_free_reserve', label='has_free_reserve')
+    # Last, so that the order by relevance comes after the other filters' orders
+    search = django_filters.CharFilter(method='filter_search', label='search')
 
     def filter_specialty(self, queryset, field_name, value):
         specialty = get_object_or_404(Specialty, pk=value)
@@ -94,7 +97,12 @@ class DoctorFilter(PersonFilter):
         return queryset.filter(**filter_condition)
     
     def filter_has_free_reserve(self, queryset, field_name, value):
-        if value:
+        if value and 'closest_free_reserve' in queryset.query.annotations:
+            # Reuse the view's annotation so the filter and the ordering share one time reference
+            return queryset.filter(
+                closest_free_reserve__isnull=False
+            ).order_by('closest_free_reserve')
+        elif value:
             first_free_reserve_subquery = Reserve.objects.filter(
                 doctor=OuterRef('pk'),
                 reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ),
@@ -109,6 +117,9 @@ class DoctorFilter(PersonFilter):
 
         return queryset
 
+    def filter_search(self, queryset, field_name, value):
+        return search_doctors(queryset, value)
+
 
 class CommentListWaitingFilter(django_filters.FilterSet):
     patient = django_filters.NumberFilter(field_name='patient', method='filter_patient', label='patient')
@@ -0,0 +1,114 @@
+from django.core.cache import cache
+from django.http import HttpResponseRedirect
+from django.utils.translation import gettext as _
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+import hashlib
+import json
+
+from config.metrics import IDEMPOTENT_REQUESTS
+
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+# Longer than the clients retry a request
+IDEMPOTENCY_KEY_TIMEOUT = 60 * 60 * 24
+# Longer than a request takes, a crashed request doesn't lock its key for longer
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Client errors that a retry with the same request can get past, like the 5xx
+TRANSIENT_STATUS_CODES = {status.HTTP_408_REQUEST_TIMEOUT, status.HTTP_425_TOO_EARLY, status.HTTP_429_TOO_MANY_REQUESTS}
+
+
+class IdempotentResponseMixin:
+    """
+    Replay the stored response of a request sent again with the same Idempotency-Key header,
+    instead of running it again. It covers the create action of a viewset, and what a view
+    passes to `get_idempotent_response`. A key is scoped to the user and the view, is kept
+    `IDEMPOTENCY_KEY_TIMEOUT` seconds and is tied to the body it was first sent with.
+    Only the successful responses and the client errors a retry would get again are stored,
+    the 5xx, the transient client errors and the raised errors can be retried.
+    """
+
+    def create(self, request, *args, **kwargs):
+        return self.get_idempotent_response(super().create, request, *args, **kwargs)
+
+    def get_idempotent_response(self, get_response, request, *args, **kwargs):
+        idempotency_key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if not idempotency_key:
+            return get_response(request, *args, **kwargs)
+
+        if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValidationError({IDEMPOTENCY_KEY_HEADER: _('Ensure this value has at most %(max_length)d characters.') % {'max_length': IDEMPOTENCY_KEY_MAX_LENGTH}})
+
+        view_name = type(self).__name__
+        cache_key = self.get_idempotency_cache_key(request, idempotency_key)
+        fingerprint = self.get_request_fingerprint(request)
+
+        stored = cache.get(cache_key)
+        if stored is not None:
+            return self.get_stored_response(stored, fingerprint)
+
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, fingerprint, IDEMPOTENCY_LOCK_TIMEOUT):
+            IDEMPOTENT_REQUESTS.labels(view_name, 'in_progress').inc()
+            return Response({'detail': _('A request with this idempotency key is in progress.')}, status=status.HTTP_409_CONFLICT)
+
+        try:
+            # The first request may have finished between the lookup and the lock
+            stored = cache.get(cache_key)
+            if stored is not None:
+                return self.get_stored_response(stored, fingerprint)
+
+            response = get_response(request, *args, **kwargs)
+            if self.is_response_stored(response):
+                cache.set(cache_key, self.store_response(response, fingerprint), IDEMPOTENCY_KEY_TIMEOUT)
+                IDEMPOTENT_REQUESTS.labels(view_name, 'stored').inc()
+        finally:
+            cache.delete(lock_key)
+
+        return response
+
+    def is_response_stored(self, response):
+        return response.status_code < 500 and response.status_code not in TRANSIENT_STATUS_CODES
+
+    def get_stored_response(self, stored, fingerprint):
+        view_name = type(self).__name__
+
+        if stored['fingerprint'] != fingerprint:
+            IDEMPOTENT_REQUESTS.labels(view_name, 'mismatch').inc()
+            return Response({'detail': _('This idempotency key was already used with another request.')},
+                            status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        IDEMPOTENT_REQUESTS.labels(view_name, 'replayed').inc()
+        return self.replay_response(stored)
+
+    def get_idempotency_cache_key(self, request, idempotency_key):
+        digest = hashlib.md5(f'{request.user.pk}{request.path}{idempotency_key}'.encode()).hexdigest()
+        return f'idempotency:{type(self).__name__}:{digest}'
+
+    def get_request_fingerprint(self, request):
+        return hashlib.md5(json.dumps(request.data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def store_response(self, response, fingerprint):
+        return {
+            'fingerprint': fingerprint,
+            'status_code': response.status_code,
+            'data': getattr(response, 'data', None),
+            'location': response.get('Location')
+        }
+
+    def replay_response(self, stored):
+        if stored['status_code'] == status.HTTP_302_FOUND:
+            response = HttpResponseRedirect(stored['location'])
+        else:
+            response = Response(stored['data'], status=stored['status_code'])
+            if stored['location']:
+                response['Location'] = stored['location']
+
+        response[REPLAYED_HEADER] = 'true'
+        return response
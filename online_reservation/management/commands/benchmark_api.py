@@ -0,0 +1,73 @@
+from django.core.management import BaseCommand, CommandError
+from django.test.utils import modify_settings
+
+import json
+import os
+
+from online_reservation.benchmark import APIBenchmark, BenchmarkFixtures, get_benchmark_cases, get_route_names, \
+                                         compare_with_baseline, EXTERNAL_ROUTES, benchmark_database
+from online_reservation.fake_data import FakeDataGenerator, SIZES
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a fixed dataset in a test database and measure query count, rows fetched, p50/p95 latency and peak memory '
+        'of every API route. Fails when a route makes more queries or is slower than the baseline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES.keys(), default='benchmark', help='Size of the seeded dataset.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the dataset.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed requests per route.')
+        parser.add_argument('--warmup', type=int, default=2, help='Number of untimed requests per route before measuring.')
+        parser.add_argument('--output', default='benchmark_results.json', help='File the results are written to.')
+        parser.add_argument('--baseline', default='benchmark_baseline.json', help='Results to compare with, if the file exists.')
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results to the baseline file instead of comparing.')
+        parser.add_argument('--latency-threshold', type=float, default=0.25, help='Allowed p95 latency increase, as a fraction of the baseline.')
+        parser.add_argument('--latency-min-ms', type=float, default=2.0, help='Smaller p95 latency increases are never regressions.')
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['keepdb']):
+            # The debug toolbar shouldn't be part of the numbers
+            with modify_settings(MIDDLEWARE={'remove': ['debug_toolbar.middleware.DebugToolbarMiddleware']}):
+                results = self.run_benchmark(options)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+        self.stdout.write(f"Results were written to {options['output']}.")
+
+        if options['update_baseline']:
+            with open(options['baseline'], 'w') as file:
+                json.dump(results, file, indent=4, sort_keys=True)
+            self.stdout.write(self.style.SUCCESS(f"Baseline {options['baseline']} was updated."))
+        elif os.path.exists(options['baseline']):
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+            regressions = compare_with_baseline(
+                {name: result for name, result in results.items() if 'skipped' not in result},
+                {name: result for name, result in baseline.items() if 'skipped' not in result},
+                latency_threshold=options['latency_threshold'],
+                latency_min_ms=options['latency_min_ms']
+            )
+            if regressions:
+                raise CommandError('Performance regressions:\n' + '\n'.join(regressions))
+            self.stdout.write(self.style.SUCCESS('No performance regression.'))
+
+    def run_benchmark(self, options):
+        self.stdout.write(f"Seeding the {options['size']} dataset...")
+        FakeDataGenerator(seed=options['seed'], log=self.stdout.write).generate(**SIZES[options['size']])
+
+        cases = get_benchmark_cases(BenchmarkFixtures())
+
+        benchmarked_routes = {case.url_name for case in cases} | {url_name for _, url_name in EXTERNAL_ROUTES}
+        for url_name in sorted(get_route_names() - benchmarked_routes):
+            self.stdout.write(self.style.WARNING(f'{url_name} has no benchmark case.'))
+
+        benchmark = APIBenchmark(repeat=options['repeat'], warmup=options['warmup'])
+        results = benchmark.run(cases, log=self.stdout.write)
+
+        for (method, url_name), reason in EXTERNAL_ROUTES.items():
+            results[f'{method} {url_name}'] = {'skipped': reason}
+        return results
@@ -0,0 +1,42 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+import json
+
+from online_reservation.benchmark import SearchBenchmark, get_search_benchmark_queries, benchmark_database
+from online_reservation.fake_data import FakeDataGenerator
+from online_reservation.search import is_full_text_search_supported
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed doctors in a test database and compare the latency and the results of the doctor search '
+        '(full-text and trigram on PostgreSQL) with the icontains scan it replaces.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--doctors', type=int, default=50000, help='Number of seeded doctors.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the dataset.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed searches per text.')
+        parser.add_argument('--output', default='search_benchmark_results.json', help='File the results are written to.')
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['keepdb']):
+            if not is_full_text_search_supported():
+                self.stdout.write(self.style.WARNING(f'{connection.vendor} has no full-text search, both searches use icontains.'))
+
+            self.stdout.write(f"Seeding {options['doctors']} doctors...")
+            FakeDataGenerator(seed=options['seed'], log=self.stdout.write).generate(
+                insurances=20, specialties=50, patients=100, doctors=options['doctors'], reserves=0, comments=0
+            )
+
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    cursor.execute('ANALYZE')
+
+            results = SearchBenchmark(repeat=options['repeat']).run(get_search_benchmark_queries(), log=self.stdout.write)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True, ensure_ascii=False)
+        self.stdout.write(f"Results were written to {options['output']}.")
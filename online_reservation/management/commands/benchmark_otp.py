@@ -0,0 +1,54 @@
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+import json
+
+from core.models import OTP
+from core.otp_stores import DatabaseOTPStore, RedisOTPStore
+from online_reservation.benchmark import OTPVerifyBenchmark, benchmark_database
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the verification of one-time passwords from concurrent workers with the database '
+        'store, over a table filled with expired passwords, and with the Redis store when it is configured.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--passwords', type=int, default=2000, help='Number of passwords verified per store.')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent verifications.')
+        parser.add_argument('--expired', type=int, default=200000, help='Number of expired passwords left in the table, as before the purge.')
+        parser.add_argument('--redis-url', default=settings.OTP_REDIS_URL, help='Redis of the Redis store, it is skipped without one.')
+        parser.add_argument('--output', default='otp_benchmark_results.json', help='File the results are written to.')
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['keepdb']):
+            self.stdout.write(f"Filling the OTP table with {options['expired']} expired passwords...")
+            expired_datetime = timezone.now() - timezone.timedelta(days=1)
+            OTP.objects.bulk_create(
+                (OTP(phone=f'09{index:09d}', password='0000', expired_datetime=expired_datetime) for index in range(options['expired'])),
+                batch_size=5000
+            )
+
+            workers = options['workers']
+            if connection.vendor == 'sqlite' and workers > 1:
+                self.stdout.write(self.style.WARNING("SQLite locks its tables for concurrent writes, the passwords are verified by one worker."))
+                workers = 1
+
+            stores = {'database': DatabaseOTPStore()}
+            if options['redis_url']:
+                stores['redis'] = RedisOTPStore(options['redis_url'])
+            else:
+                self.stdout.write(self.style.WARNING('No Redis URL, the Redis store is skipped.'))
+
+            results = OTPVerifyBenchmark(passwords=options['passwords'], workers=workers).run(stores, log=self.stdout.write)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+        self.stdout.write(f"Results were written to {options['output']}.")
+
+        if not all(result['all_verified'] and result['none_verified_twice'] for result in results.values()):
+            self.stdout.write(self.style.WARNING('Some passwords were rejected or accepted twice.'))
@@ -0,0 +1,50 @@
+from django.core.management import BaseCommand
+from django.db import connection
+
+import json
+
+from config.celery_config import app
+from online_reservation.benchmark import PaymentCallbackBenchmark, benchmark_database
+from online_reservation.fake_data import FakeDataGenerator
+from online_reservation.fake_zarinpal import FakeZarinpalServer
+from online_reservation.models import Doctor, Patient
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the payment callback against a delayed Zarinpal stand-in, with the payment '
+        'verified in the request and with the verification left to a Celery task.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--callbacks', type=int, default=200, help='Number of callbacks per mode.')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent callbacks.')
+        parser.add_argument('--latency', type=float, default=0.2, help="Seconds the stand-in takes to answer.")
+        parser.add_argument('--broker', default='memory://', help='Broker the verification tasks are sent to, the in-memory one leaves out its round trip.')
+        parser.add_argument('--output', default='payment_callback_benchmark_results.json', help='File the results are written to.')
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        # The app reads the Django settings with the CELERY namespace
+        app.conf.CELERY_BROKER_URL = options['broker']
+
+        with benchmark_database(options['keepdb']):
+            workers = options['workers']
+            if connection.vendor == 'sqlite' and workers > 1:
+                self.stdout.write(self.style.WARNING("SQLite locks its tables for concurrent writes, the callbacks are sent by one client."))
+                workers = 1
+
+            FakeDataGenerator(seed=1, log=self.stdout.write).generate(insurances=1, specialties=1, patients=2, doctors=1, reserves=0, comments=0)
+            doctor = Doctor.objects.first()
+            patient = Patient.objects.exclude(user_id=doctor.user_id).first()
+
+            with FakeZarinpalServer(latency=options['latency'], seed=1) as gateway:
+                benchmark = PaymentCallbackBenchmark(gateway, callbacks=options['callbacks'], workers=workers)
+                results = benchmark.run(doctor, patient, log=self.stdout.write)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+        self.stdout.write(f"Results were written to {options['output']}.")
+
+        if any(result['paid'] != options['callbacks'] for result in results.values()):
+            self.stdout.write(self.style.WARNING('Some reserves were not paid in the end.'))
@@ -0,0 +1,35 @@
+from django.core.management import BaseCommand
+
+import json
+
+from online_reservation.benchmark import SerializerBenchmark, get_serializer_benchmark_instances, benchmark_database
+from online_reservation.fake_data import FakeDataGenerator, SIZES
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed a fixed dataset in a test database and compare the per-item cost of serializing the hot lists '
+        'through the serializer fields and through the fast read-only path.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES.keys(), default='benchmark', help='Size of the seeded dataset.')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the dataset.')
+        parser.add_argument('--count', type=int, default=500, help='Number of serialized items per list.')
+        parser.add_argument('--repeat', type=int, default=20, help='Number of timed serializations per list.')
+        parser.add_argument('--output', default='serializer_benchmark_results.json', help='File the results are written to.')
+        parser.add_argument('--keepdb', action='store_true', help="Keep the test database between runs.")
+
+    def handle(self, *args, **options):
+        with benchmark_database(options['keepdb']):
+            self.stdout.write(f"Seeding the {options['size']} dataset...")
+            FakeDataGenerator(seed=options['seed'], log=self.stdout.write).generate(**SIZES[options['size']])
+            # Instances are loaded first, only the serialization is measured
+            results = SerializerBenchmark(repeat=options['repeat']).run(get_serializer_benchmark_instances(options['count']), log=self.stdout.write)
+
+        with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+        self.stdout.write(f"Results were written to {options['output']}.")
+
+        if not all(result['same_output'] for result in results.values()):
+            self.stdout.write(self.style.WARNING('The fast path gave a different output for some lists.'))
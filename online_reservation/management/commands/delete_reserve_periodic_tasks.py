@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+from django_celery_beat.models import PeriodicTask, PeriodicTasks, ClockedSchedule
+
+
+class Command(BaseCommand):
+    help = 'Delete the one-off periodic tasks (and their clocked schedules) that used to be created for every reserve'
+
+    def handle(self, *args, **options):
+        deleted_count, _ = PeriodicTask.objects.filter(
+            name__startswith='task-for-object-',
+            task='online_reservation.tasks.remove_patient_from_reserve_after_expired'
+        ).delete()
+        ClockedSchedule.objects.filter(periodictask__isnull=True).delete()
+
+        # Bulk deletes don't send the signals that tell beat to reload its schedule
+        if deleted_count:
+            PeriodicTasks.update_changed()
+
+        self.stdout.write(self.style.SUCCESS(f'{deleted_count} periodic tasks were deleted.'))
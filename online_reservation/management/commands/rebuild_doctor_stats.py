@@ -0,0 +1,17 @@
+from django.core.management import BaseCommand
+
+from online_reservation.stats import rebuild_doctor_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the denormalized statistics of doctors from their comments and reserves'
+
+    def add_arguments(self, parser):
+        parser.add_argument('doctor_ids', nargs='*', type=int, help='Only rebuild the statistics of these doctors')
+
+    def handle(self, *args, **options):
+        doctor_ids = options['doctor_ids'] or None
+
+        self.stdout.write('Rebuilding doctor statistics...', ending='')
+        count = rebuild_doctor_stats(doctor_ids)
+        self.stdout.write(self.style.SUCCESS(f'DONE ({count} doctors)'))
@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from online_reservation.fake_zarinpal import FakeZarinpalServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local stand-in for the Zarinpal sandbox, with injected latency and failures. '
+        'Point DJANGO_ZARINPAL_SANDBOX_URL to it to make the payments offline.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1', help='Address the server listens on.')
+        parser.add_argument('--port', type=int, default=8001, help='Port the server listens on.')
+        parser.add_argument('--latency', type=float, default=0, help='Seconds added to every answer.')
+        parser.add_argument('--failure-rate', type=float, default=0, help='Share of the requests answered with a 503, between 0 and 1.')
+        parser.add_argument('--seed', type=int, default=None, help='Seed of the failures and the ref ids.')
+
+    def handle(self, *args, **options):
+        server = FakeZarinpalServer(options['host'], options['port'], latency=options['latency'],
+                                    failure_rate=options['failure_rate'], seed=options['seed'], verbose=True)
+        self.stdout.write(f'Fake Zarinpal is listening on {server.url}, set DJANGO_ZARINPAL_SANDBOX_URL={server.url}')
+
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
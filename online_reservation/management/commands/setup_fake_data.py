@@ -1,204 +1,30 @@
 from django.core.management import BaseCommand
 
-from faker import Faker
-import json
-import random
-from datetime import datetime, timezone
-
-from online_reservation.models import Province, City, Insurance, Patient, Doctor, \
-                                      Specialty, DoctorSpecialty, Comment, Reserve, DoctorInsurance
-from online_reservation.factories import (
-    InsuranceFactory,
-    PatientFactory,
-    DoctorFactory,
-    SpecialtyFactory,
-    CommentFactory,
-    ReserveFactory
-)
-
-fake = Faker(locale='fa_IR')
-
-list_of_models = [Reserve, Patient, Doctor, City, Province, Insurance, Specialty, Comment]
-
-NUM_INSURANCES = 20
-NUM_PATIENTS = 40
-NUM_DOCTORS = 15
-NUM_SPECIALTY = 30
+from online_reservation.fake_data import FakeDataGenerator, SIZES
 
 
 class Command(BaseCommand):
-    help = 'Generate fake data'
-
-    def handle(self, *args, **kwargs):
-        self.stdout.write('Deleting old data...')
-
-        for model in list_of_models:
-            model.objects.all().delete()
-        
-        self.stdout.write('Creating new data...\n')
-
-        # insurances data
-        print(f'Adding {NUM_INSURANCES} insurances...', end='')
-        all_insurances = [InsuranceFactory() for _ in range(NUM_INSURANCES)]
-        print('DONE')
-
-        # provinces & cities data
-        print(f'Adding provinces & cities...', end='')
-        with open('json/provinces.json') as file:
-            list_provinces = json.loads(file.read())
-
-        all_provinces = []
-        all_cities = []
-        all_provinces_with_cities_dict = {province.get('name'): [] for province in list_provinces}
-
-        for province_dict in list_provinces:
-            province = Province(
-                name=province_dict.get('name')
-            )
-            all_provinces.append(province)
-            
-            with open('json/cities.json') as file:
-                 list_cities = json.loads(file.read())
-                
-            list_citiesـof_province = [city for city in list_cities if city.get('province_id') == province_dict.get('id')]
-            for city_dict in list_citiesـof_province:
-                city = City(
-                    name=city_dict.get('name'),
-                    province=province
-                )
-                all_cities.append(city)
-                all_provinces_with_cities_dict[province.name].append(city)
-        
-        Province.objects.bulk_create(all_provinces)
-        City.objects.bulk_create(all_cities)
-        print('DONE')
-
-        # patients data
-        print(f'Adding {NUM_PATIENTS} patients...', end='')
-        all_patients = []
-
-        for _ in range(NUM_PATIENTS):
-            patient = PatientFactory(
-                province_id=random.choice(all_provinces).id,
-                insurance_id=random.choice(all_insurances).id
-            )
-            
-            patient.city = random.choice(
-                all_provinces_with_cities_dict[patient.province.name]
-            )
-            patient.created_datetime = datetime(year=random.randint(2018, 2019), month=random.randint(1,12),day=random.randint(1,28), tzinfo=timezone.utc)
-            patient.save()
-
-            all_patients.append(patient)
-
-        print('DONE')
-
-        # doctors data
-        print(f'Adding {NUM_DOCTORS} doctors...', end='')
-        all_doctors = []
-
-        for _ in range(NUM_DOCTORS):
-            doctor = DoctorFactory(
-                province_id=random.choice(all_provinces).id
-            )
-
-            doctor.city = random.choice(
-                all_provinces_with_cities_dict[doctor.province.name]
-            )
-            doctor.confirm_datetime = datetime(year=random.randint(2020, 2021), month=random.randint(1,12),day=random.randint(1,28), tzinfo=timezone.utc)
-            doctor.save()
-
-            patient = PatientFactory(
-                user=doctor.user,
-                first_name=doctor.first_name,
-                last_name=doctor.last_name,
-                birth_date=doctor.birth_date,
-                national_code=doctor.national_code,
-                email=doctor.email,
-                gender=doctor.gender,
-                province=doctor.province,
-                city=doctor.city,
-                insurance_id=random.choice(all_insurances).id
-            )
-            patient.created_datetime = datetime(year=random.randint(2018, 2019), month=random.randint(1,12),day=random.randint(1,28), tzinfo=timezone.utc)
-            patient.save()
-
-            all_doctors.append(doctor)
-            all_patients.append(patient)
-        
-        print('DONE')
-
-        # specialties data
-        print(f'Adding {NUM_SPECIALTY} specialties...', end='')
-        all_specialties = [SpecialtyFactory() for _ in range(NUM_SPECIALTY)]
-        print('DONE')
-
-        # doctor insurances data
-        print('Adding doctor insurances...', end='')
-        all_doctor_insurances = []
-
-        for doctor in all_doctors:
-            if random.random() <= 0.7:
-                insurances = random.sample(all_insurances, k=random.randint(1, 3))
-                for insurance in insurances:
-                    doctor_insurance = DoctorInsurance.objects.create(
-                        doctor_id=doctor.id,
-                        insurance_id=insurance.id
-                    )
-
-                    all_doctor_insurances.append(doctor_insurance)
-        
-        print('DONE')
-
-        # doctor specialties data
-        print('Adding doctor specialties...', end='')
-        all_doctor_specialties = []
-
-        for doctor in all_doctors:
-            specialties = random.sample(all_specialties, k=random.randint(1, 3))
-            for specialty in specialties:
-                doctor_specialty = DoctorSpecialty.objects.create(
-                    doctor_id=doctor.id,
-                    specialty_id=specialty.id
-                )
-
-                all_doctor_specialties.append(doctor_specialty)
-        
-        print('DONE')
-
-        # reserves data
-        print(f'Adding reserves...', end='')
-        all_reserves = []
-
-        for doctor in all_doctors:
-            num_of_reserves = random.randint(5, 10)
-            for _ in range(num_of_reserves):
-                reserve = ReserveFactory(
-                    doctor_id=doctor.id
-                )
-                
-                if reserve.status == Reserve.RESERVE_STATUS_PAID:
-                    reserve.patient = random.choice(all_patients)
-                    reserve.save()
-
-                all_reserves.append(reserve)
-        
-        print('DONE')
-
-        # comments data
-        print(f'Adding comments...', end='')
-        all_comments = []
-
-        for patient in all_patients:
-            doctors = random.sample(all_doctors, k=random.randint(0, 4))
-            for doctor in doctors:
-                comment = CommentFactory(
-                    patient_id=patient.id,
-                    doctor_id=doctor.id
-                )
-                comment.created_datetime = datetime(year=random.randint(2022, 2023), month=random.randint(1,12),day=random.randint(1,28), tzinfo=timezone.utc)
-                comment.save()
-
-                all_comments.append(comment)
-
-        print('DONE')
+    help = 'Generate fake data, any size and reproducible with --seed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', choices=SIZES.keys(), default='small', help='Preset for the number of rows of each model.')
+        for name in SIZES['small']:
+            parser.add_argument(f'--{name}', type=int, help=f'Number of {name}, overrides the --size preset.')
+
+        parser.add_argument('--seed', type=int, help='Seed of the random generators, the same seed gives the same data.')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows inserted per statement.')
+        parser.add_argument('--no-copy', action='store_true', help="Use bulk_create instead of COPY on PostgreSQL.")
+
+    def handle(self, *args, **options):
+        counts = {name: options[name] if options[name] is not None else count for name, count in SIZES[options['size']].items()}
+
+        generator = FakeDataGenerator(
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+            use_copy=not options['no_copy'],
+            log=self.stdout.write
+        )
+        self.stdout.write('Deleting old data & creating new data...\n')
+        generator.generate(**counts)
+
+        self.stdout.write(self.style.SUCCESS('Generating fake data...DONE'))
@@ -0,0 +1,73 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum, Min, Q
+from django.utils import timezone
+
+
+def populate_doctor_stats(apps, schema_editor):
+    Doctor = apps.get_model('online_reservation', 'Doctor')
+    DoctorStats = apps.get_model('online_reservation', 'DoctorStats')
+    Comment = apps.get_model('online_reservation', 'Comment')
+    Reserve = apps.get_model('online_reservation', 'Reserve')
+
+    waiting_time_fields = ['waiting_time_0_to_15_minutes_count', 'waiting_time_15_to_45_minutes_count',
+                           'waiting_time_45_to_90_minutes_count', 'waiting_time_more_than_90_minutes_count']
+
+    comment_stats = {
+        row.pop('doctor_id'): row
+        for row in Comment.objects.filter(status='a').order_by().values('doctor_id').annotate(
+            rating_sum=Sum('rating'),
+            comment_count=Count('id'),
+            suggest_count=Count('id', filter=Q(is_suggest=True)),
+            **{field: Count('id', filter=Q(waiting_time=waiting_time)) for waiting_time, field in enumerate(waiting_time_fields)}
+        )
+    }
+    reserve_stats = {
+        row.pop('doctor_id'): row
+        for row in Reserve.objects.order_by().values('doctor_id').annotate(
+            paid_reserve_count=Count('id', filter=Q(status='p')),
+            next_free_reserve_datetime=Min('reserve_datetime', filter=Q(reserve_datetime__gte=timezone.now(), patient__isnull=True))
+        )
+    }
+
+    DoctorStats.objects.bulk_create(
+        [
+            DoctorStats(doctor_id=doctor_id, **comment_stats.get(doctor_id, {}), **reserve_stats.get(doctor_id, {}))
+            for doctor_id in Doctor.objects.values_list('id', flat=True)
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0011_reserve_celery_payment_expiration_datetime_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating_sum', models.PositiveIntegerField(default=0, verbose_name='Rating sum')),
+                ('comment_count', models.PositiveIntegerField(default=0, verbose_name='Comment count')),
+                ('suggest_count', models.PositiveIntegerField(default=0, verbose_name='Suggest count')),
+                ('waiting_time_0_to_15_minutes_count', models.PositiveIntegerField(default=0, verbose_name='Waiting time 0 to 15 minutes count')),
+                ('waiting_time_15_to_45_minutes_count', models.PositiveIntegerField(default=0, verbose_name='Waiting time 15 to 45 minutes count')),
+                ('waiting_time_45_to_90_minutes_count', models.PositiveIntegerField(default=0, verbose_name='Waiting time 45 to 90 minutes count')),
+                ('waiting_time_more_than_90_minutes_count', models.PositiveIntegerField(default=0, verbose_name='Waiting time more than 90 minutes count')),
+                ('paid_reserve_count', models.PositiveIntegerField(default=0, verbose_name='Paid reserve count')),
+                ('next_free_reserve_datetime', models.DateTimeField(blank=True, null=True, verbose_name='Next free reserve datetime')),
+                ('updated_datetime', models.DateTimeField(auto_now=True, verbose_name='Updated datetime')),
+                ('doctor', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='online_reservation.doctor', verbose_name='Doctor')),
+            ],
+            options={
+                'verbose_name': 'Doctor statistics',
+                'verbose_name_plural': 'Doctors statistics',
+            },
+        ),
+        migrations.RunPython(populate_doctor_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0012_doctorstats'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(condition=models.Q(('patient__isnull', True)), fields=['doctor', 'reserve_datetime'], name='reserve_free_doctor_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['patient', 'reserve_datetime'], name='reserve_patient_dt_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(fields=['zarinpal_authority'], name='reserve_zarinpal_authority_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='reserve',
+            constraint=models.UniqueConstraint(fields=('doctor', 'reserve_datetime'), name='reserve_unique_doctor_reserve_datetime', violation_error_message="A doctor can't have two or more reserves at the same time."),
+        ),
+    ]
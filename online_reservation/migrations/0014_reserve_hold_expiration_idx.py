@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0013_reserve_indexes_and_unique_doctor_datetime'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reserve',
+            index=models.Index(condition=models.Q(('patient__isnull', False), ('status', 'u')), fields=['celery_payment_expiration_datetime'], name='reserve_hold_expiration_idx'),
+        ),
+    ]
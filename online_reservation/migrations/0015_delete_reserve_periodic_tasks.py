@@ -0,0 +1,30 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def delete_reserve_periodic_tasks(apps, schema_editor):
+    PeriodicTask = apps.get_model('django_celery_beat', 'PeriodicTask')
+    PeriodicTasks = apps.get_model('django_celery_beat', 'PeriodicTasks')
+    ClockedSchedule = apps.get_model('django_celery_beat', 'ClockedSchedule')
+
+    deleted_count, _ = PeriodicTask.objects.filter(
+        name__startswith='task-for-object-',
+        task='online_reservation.tasks.remove_patient_from_reserve_after_expired'
+    ).delete()
+    ClockedSchedule.objects.filter(periodictask__isnull=True).delete()
+
+    # Bulk deletes don't send the signals that tell beat to reload its schedule
+    if deleted_count:
+        PeriodicTasks.objects.update_or_create(ident=1, defaults={'last_update': timezone.now()})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0014_reserve_hold_expiration_idx'),
+        ('django_celery_beat', '0019_alter_periodictasks_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_reserve_periodic_tasks, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0015_delete_reserve_periodic_tasks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('weekdays', models.JSONField(default=list, help_text='Days of the week, 0 is Monday and 6 is Sunday.', verbose_name='Weekdays')),
+                ('start_time', models.TimeField(verbose_name='Start time')),
+                ('end_time', models.TimeField(verbose_name='End time')),
+                ('slot_minutes', models.PositiveSmallIntegerField(default=15, verbose_name='Slot minutes')),
+                ('price', models.PositiveIntegerField(verbose_name='Price')),
+                ('created_datetime', models.DateTimeField(auto_now_add=True, verbose_name='Created datetime')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_templates', to='online_reservation.doctor', verbose_name='Doctor')),
+            ],
+            options={
+                'verbose_name': 'Schedule template',
+                'verbose_name_plural': 'Schedule templates',
+            },
+        ),
+    ]
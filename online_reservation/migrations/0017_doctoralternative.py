@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0016_scheduletemplate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DoctorAlternative',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_free_reserve_datetime', models.DateTimeField(verbose_name='Next free reserve datetime')),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='online_reservation.city', verbose_name='City')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='online_reservation.doctor', verbose_name='Doctor')),
+                ('specialty', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='online_reservation.specialty', verbose_name='Specialty')),
+            ],
+            options={
+                'verbose_name': 'Doctor alternative',
+                'verbose_name_plural': 'Doctor alternatives',
+                'indexes': [models.Index(fields=['specialty', 'city', 'next_free_reserve_datetime'], name='doctor_alternative_lookup_idx')],
+                'unique_together': {('specialty', 'city', 'doctor')},
+            },
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:29
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+# The GIN indexes are PostgreSQL only, so they are created here instead of in Doctor.Meta.indexes
+SEARCH_INDEXES = {
+    'doctor_search_vector_idx': '(search_vector)',
+    'doctor_first_name_trgm_idx': '(first_name gin_trgm_ops)',
+    'doctor_last_name_trgm_idx': '(last_name gin_trgm_ops)',
+}
+
+
+def create_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    Doctor = apps.get_model('online_reservation', 'Doctor')
+    DoctorSpecialty = apps.get_model('online_reservation', 'DoctorSpecialty')
+    Specialty = apps.get_model('online_reservation', 'Specialty')
+    doctor_table = schema_editor.quote_name(Doctor._meta.db_table)
+
+    for name, columns in SEARCH_INDEXES.items():
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {doctor_table} USING gin {columns}')
+
+    # Same vector as online_reservation.search.doctor_search_vector
+    schema_editor.execute(f"""
+        UPDATE {doctor_table} AS doctor SET search_vector =
+            setweight(to_tsvector('simple', coalesce(doctor.first_name, '') || ' ' || coalesce(doctor.last_name, '')), 'A') ||
+            setweight(to_tsvector('simple', coalesce((
+                SELECT string_agg(specialty.name, ' ')
+                FROM {schema_editor.quote_name(DoctorSpecialty._meta.db_table)} AS doctor_specialty
+                JOIN {schema_editor.quote_name(Specialty._meta.db_table)} AS specialty ON specialty.id = doctor_specialty.specialty_id
+                WHERE doctor_specialty.doctor_id = doctor.id
+            ), '')), 'B') ||
+            setweight(to_tsvector('simple', coalesce(doctor.bio, '') || ' ' || coalesce(doctor.office_address, '')), 'C')
+    """)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for name in SEARCH_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0017_doctoralternative'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='doctor',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(blank=True, editable=False, null=True, verbose_name='Search vector'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-17 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0018_doctor_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reserve',
+            name='payment_verification_status',
+            field=models.CharField(blank=True, choices=[('p', 'Pending'), ('v', 'Verified'), ('f', 'Failed')], max_length=1, verbose_name='Payment verification status'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:02
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def populate_reserve_payments(apps, schema_editor):
+    Reserve = apps.get_model('online_reservation', 'Reserve')
+    ReservePayment = apps.get_model('online_reservation', 'ReservePayment')
+
+    payments = []
+    for reserve in Reserve.objects.exclude(zarinpal_authority='').iterator():
+        if reserve.status == 'p':
+            status = 'v'
+        elif reserve.payment_verification_status == 'f':
+            status = 'f'
+        else:
+            status = 'p'
+        payments.append(ReservePayment(
+            reserve_id=reserve.id,
+            patient_id=reserve.patient_id,
+            authority=reserve.zarinpal_authority,
+            amount=reserve.price,
+            ref_id=reserve.zarinpal_ref_id,
+            status=status
+        ))
+    ReservePayment.objects.bulk_create(payments, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0019_reserve_payment_verification_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservePayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('authority', models.CharField(max_length=255, unique=True, verbose_name='Zarinpal authority')),
+                ('amount', models.PositiveIntegerField(verbose_name='Amount')),
+                ('ref_id', models.CharField(blank=True, max_length=255, verbose_name='Zarinpal ref_id')),
+                ('status', models.CharField(choices=[('p', 'Pending'), ('v', 'Verified'), ('f', 'Failed'), ('r', 'Refund due')], default='p', max_length=1, verbose_name='Status')),
+                ('created_datetime', models.DateTimeField(auto_now_add=True, verbose_name='Created datetime')),
+                ('updated_datetime', models.DateTimeField(auto_now=True, verbose_name='Updated datetime')),
+                ('patient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='reserve_payments', to='online_reservation.patient', verbose_name='Patient')),
+                ('reserve', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='payments', to='online_reservation.reserve', verbose_name='Reserve')),
+            ],
+            options={
+                'verbose_name': 'Reserve payment',
+                'verbose_name_plural': 'Reserve payments',
+                'indexes': [models.Index(condition=models.Q(('status', 'p')), fields=['updated_datetime', 'id'], name='reserve_payment_pending_idx')],
+            },
+        ),
+        migrations.RunPython(populate_reserve_payments, migrations.RunPython.noop),
+    ]
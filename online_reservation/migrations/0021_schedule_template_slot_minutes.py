@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:25
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0020_reserve_payment'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='scheduletemplate',
+            name='slot_minutes',
+            field=models.PositiveSmallIntegerField(default=15, validators=[django.core.validators.MinValueValidator(5), django.core.validators.MaxValueValidator(240)], verbose_name='Slot minutes'),
+        ),
+        migrations.AddConstraint(
+            model_name='scheduletemplate',
+            constraint=models.CheckConstraint(check=models.Q(('slot_minutes__gte', 5), ('slot_minutes__lte', 240)), name='schedule_template_slot_minutes_range'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.6 on 2026-10-17 03:32
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('online_reservation', '0021_schedule_template_slot_minutes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='reserve',
+            name='reserve_zarinpal_authority_idx',
+        ),
+    ]
@@ -1,13 +1,34 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Q
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models import Q, Min
 from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator, MaxValueValidator
+
+from datetime import datetime, timezone, timedelta
 
 from .validators import NationalCodeValidator, MedicalCouncilNumberValidator
 
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
 User = get_user_model()
 
+MIN_SLOT_MINUTES = 5
+MAX_SLOT_MINUTES = 240
+
+
+class LoadedValuesMixin:
+    """
+    Keep the values an instance was loaded with, so that signals can tell what
+    changed on save without querying the database again.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
 
 class Province(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name=_('Name'))
@@ -150,6 +171,9 @@ class Doctor(Person):
 
     confirm_datetime = models.DateTimeField(blank=True, null=True, verbose_name=_('Confirm datetime')) # TODO: when status is accepted, this field be filled
 
+    # Kept up to date by online_reservation.search, its GIN index only exists on PostgreSQL (see migration 0018)
+    search_vector = SearchVectorField(blank=True, null=True, editable=False, verbose_name=_('Search vector'))
+
     def clean(self):
         super().clean()
 
@@ -219,7 +243,7 @@ class DoctorSpecialty(models.Model):
         verbose_name_plural = _('Doctor specialties')
 
 
-class Comment(models.Model):
+class Comment(LoadedValuesMixin, models.Model):
     COMMENT_RATING_VERY_BAD = 1
     COMMENT_RATING_BAD = 2
     COMMENT_RATING_NORMAL = 3
@@ -275,7 +299,7 @@ class Comment(models.Model):
         verbose_name_plural = _('Comments')
 
 
-class Reserve(models.Model):
+class Reserve(LoadedValuesMixin, models.Model):
     RESERVE_STATUS_PAID = 'p'
     RESERVE_STATUS_UNPAID = 'u'
 
@@ -284,6 +308,17 @@ class Reserve(models.Model):
         (RESERVE_STATUS_UNPAID, _('Unpaid'))
     ]
 
+    # Verification of the current holder's payment, the payments themselves are kept in ReservePayment
+    PAYMENT_VERIFICATION_PENDING = 'p'
+    PAYMENT_VERIFICATION_VERIFIED = 'v'
+    PAYMENT_VERIFICATION_FAILED = 'f'
+
+    PAYMENT_VERIFICATION_STATUS = [
+        (PAYMENT_VERIFICATION_PENDING, _('Pending')),
+        (PAYMENT_VERIFICATION_VERIFIED, _('Verified')),
+        (PAYMENT_VERIFICATION_FAILED, _('Failed'))
+    ]
+
     doctor = models.ForeignKey(Doctor, on_delete=models.PROTECT, related_name='reserves', verbose_name=_('Doctor'))
     patient = models.ForeignKey(Patient, blank=True, null=True, on_delete=models.PROTECT, related_name='reserves', verbose_name=_('Patient')) # TODO: patient can cancel reserve for 20 minutes
     status = models.CharField(max_length=1, choices=RESERVE_STATUS, default=RESERVE_STATUS_UNPAID, verbose_name=_('Status')) # TODO: after 20 minutes delete patient's reserve
@@ -292,18 +327,11 @@ class Reserve(models.Model):
 
     zarinpal_authority = models.CharField(max_length=255, blank=True, verbose_name=_('Zarinpal authority'))
     zarinpal_ref_id = models.CharField(max_length=255, blank=True, verbose_name=_('Zarinpal ref_id'))
+    payment_verification_status = models.CharField(max_length=1, choices=PAYMENT_VERIFICATION_STATUS, blank=True, verbose_name=_('Payment verification status'))
 
     celery_task_id = models.CharField(blank=True, max_length=255, verbose_name=_('Celery task_id'))
     celery_payment_expiration_datetime = models.DateTimeField(blank=True, null=True, verbose_name=_('Celery payment expiration datetime'))
 
-    def clean(self):
-        super().clean()
-        
-        if Reserve.objects.filter(doctor=self.doctor, reserve_datetime=self.reserve_datetime.replace(second=0, microsecond=0)).exclude(id=self.id).exists():
-            raise ValidationError(
-                _("A doctor can't have two or more reserves at the same time(%(reserve_datetime)s)." % {'reserve_datetime': self.reserve_datetime.strftime('%Y-%m-%d %H:%M')})
-            )
-    
     def save(self, *args, **kwargs):
         self.reserve_datetime = self.reserve_datetime.replace(second=0, microsecond=0)
         return super().save(*args, **kwargs)
@@ -314,3 +342,221 @@ class Reserve(models.Model):
     class Meta:
         verbose_name = _('Reserve')
         verbose_name_plural = _('Reserves')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'reserve_datetime'],
+                name='reserve_unique_doctor_reserve_datetime',
+                violation_error_message=_("A doctor can't have two or more reserves at the same time.")
+            )
+        ]
+        indexes = [
+            # Free slots of a doctor, reserve_datetime >= now can't be part of the condition since now isn't immutable
+            models.Index(
+                fields=['doctor', 'reserve_datetime'],
+                name='reserve_free_doctor_dt_idx',
+                condition=Q(patient__isnull=True)
+            ),
+            models.Index(fields=['patient', 'reserve_datetime'], name='reserve_patient_dt_idx'),
+            # Held reserves waiting for their payment, for the expired holds sweeper
+            models.Index(
+                fields=['celery_payment_expiration_datetime'],
+                name='reserve_hold_expiration_idx',
+                condition=Q(patient__isnull=False, status='u')
+            )
+        ]
+
+
+class ReservePayment(models.Model):
+    """
+    A payment requested at the gateway for a reserve, one per authority. It outlives the holds
+    of the reserve, so a late payment is credited only to the patient who requested it, and
+    the payments that must be refunded stay recorded when the reserve is held again.
+    """
+    PAYMENT_STATUS_PENDING = 'p'
+    PAYMENT_STATUS_VERIFIED = 'v'
+    PAYMENT_STATUS_FAILED = 'f'
+    # Paid at the gateway while the patient didn't hold the reserve anymore
+    PAYMENT_STATUS_REFUND_DUE = 'r'
+
+    PAYMENT_STATUS = [
+        (PAYMENT_STATUS_PENDING, _('Pending')),
+        (PAYMENT_STATUS_VERIFIED, _('Verified')),
+        (PAYMENT_STATUS_FAILED, _('Failed')),
+        (PAYMENT_STATUS_REFUND_DUE, _('Refund due'))
+    ]
+
+    reserve = models.ForeignKey(Reserve, on_delete=models.PROTECT, related_name='payments', verbose_name=_('Reserve'))
+    patient = models.ForeignKey(Patient, blank=True, null=True, on_delete=models.PROTECT, related_name='reserve_payments', verbose_name=_('Patient')) # null for the payments recorded before this table
+    authority = models.CharField(max_length=255, unique=True, verbose_name=_('Zarinpal authority'))
+    amount = models.PositiveIntegerField(verbose_name=_('Amount'))
+    ref_id = models.CharField(max_length=255, blank=True, verbose_name=_('Zarinpal ref_id'))
+    status = models.CharField(max_length=1, choices=PAYMENT_STATUS, default=PAYMENT_STATUS_PENDING, verbose_name=_('Status'))
+
+    created_datetime = models.DateTimeField(auto_now_add=True, verbose_name=_('Created datetime'))
+    updated_datetime = models.DateTimeField(auto_now=True, verbose_name=_('Updated datetime'))
+
+    def __str__(self):
+        return f'{self.authority} ({self.get_status_display()})'
+
+    class Meta:
+        verbose_name = _('Reserve payment')
+        verbose_name_plural = _('Reserve payments')
+        indexes = [
+            # Payments requested and never verified, least recently tried first, for the reconciliation
+            models.Index(fields=['updated_datetime', 'id'], name='reserve_payment_pending_idx', condition=Q(status='p'))
+        ]
+
+
+class DoctorStats(models.Model):
+    WAITING_TIME_FIELDS = {
+        Comment.COMMENT_WAITING_TIME_0_TO_15_MINUTES: 'waiting_time_0_to_15_minutes_count',
+        Comment.COMMENT_WAITING_TIME_15_TO_45_MINUTES: 'waiting_time_15_to_45_minutes_count',
+        Comment.COMMENT_WAITING_TIME_45_TO_90_MINUTES: 'waiting_time_45_to_90_minutes_count',
+        Comment.COMMENT_WAITING_TIME_MORE_THAN_90_MINUTES: 'waiting_time_more_than_90_minutes_count'
+    }
+
+    doctor = models.OneToOneField(Doctor, on_delete=models.CASCADE, related_name='stats', verbose_name=_('Doctor'))
+    rating_sum = models.PositiveIntegerField(default=0, verbose_name=_('Rating sum'))
+    comment_count = models.PositiveIntegerField(default=0, verbose_name=_('Comment count'))
+    suggest_count = models.PositiveIntegerField(default=0, verbose_name=_('Suggest count'))
+    waiting_time_0_to_15_minutes_count = models.PositiveIntegerField(default=0, verbose_name=_('Waiting time 0 to 15 minutes count'))
+    waiting_time_15_to_45_minutes_count = models.PositiveIntegerField(default=0, verbose_name=_('Waiting time 15 to 45 minutes count'))
+    waiting_time_45_to_90_minutes_count = models.PositiveIntegerField(default=0, verbose_name=_('Waiting time 45 to 90 minutes count'))
+    waiting_time_more_than_90_minutes_count = models.PositiveIntegerField(default=0, verbose_name=_('Waiting time more than 90 minutes count'))
+    paid_reserve_count = models.PositiveIntegerField(default=0, verbose_name=_('Paid reserve count'))
+    next_free_reserve_datetime = models.DateTimeField(blank=True, null=True, verbose_name=_('Next free reserve datetime'))
+
+    updated_datetime = models.DateTimeField(auto_now=True, verbose_name=_('Updated datetime'))
+
+    @property
+    def rating_average(self):
+        if not self.comment_count:
+            return None
+
+        rating_average = round(self.rating_sum / self.comment_count, 1)
+        if rating_average == int(rating_average):
+            return int(rating_average)
+        return rating_average
+
+    @property
+    def suggest_percentage(self):
+        if not self.comment_count:
+            return None
+        return round((self.suggest_count / self.comment_count) * 100)
+
+    @property
+    def average_waiting_time(self):
+        if not self.comment_count:
+            return None
+
+        waiting_time_sum = sum(waiting_time * getattr(self, field) for waiting_time, field in self.WAITING_TIME_FIELDS.items())
+        return dict(Comment.COMMENT_WAITING_TIME).get(round(waiting_time_sum / self.comment_count))
+
+    def get_next_free_reserve_datetime(self):
+        # The stored slot goes stale once its time passes without any reserve change, so look up the next one lazily.
+        # Only in memory: a read doesn't write, refresh_next_free_reserves (run by the beat tasks too) stores it
+        now = datetime.now(tz=TEHRAN_TZ)
+
+        if not self.next_free_reserve_datetime or self.next_free_reserve_datetime >= now:
+            return self.next_free_reserve_datetime
+
+        next_free_reserve_datetime = getattr(self, '_current_next_free_reserve_datetime', self.next_free_reserve_datetime)
+        if next_free_reserve_datetime and next_free_reserve_datetime < now:
+            next_free_reserve_datetime = Reserve.objects.filter(
+                doctor_id=self.doctor_id,
+                reserve_datetime__gte=now,
+                patient__isnull=True
+            ).aggregate(next_free_reserve_datetime=Min('reserve_datetime'))['next_free_reserve_datetime']
+            self._current_next_free_reserve_datetime = next_free_reserve_datetime
+
+        return next_free_reserve_datetime
+
+    def __str__(self):
+        return f'Statistics of {self.doctor.full_name}'
+
+    class Meta:
+        verbose_name = _('Doctor statistics')
+        verbose_name_plural = _('Doctors statistics')
+
+
+class DoctorAlternative(models.Model):
+    """
+    Accepted doctors of a specialty in a city that have the soonest free reserves,
+    kept up to date by refresh_doctor_alternatives.
+    """
+    specialty = models.ForeignKey(Specialty, on_delete=models.CASCADE, related_name='+', verbose_name=_('Specialty'))
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='+', verbose_name=_('City'))
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='+', verbose_name=_('Doctor'))
+    next_free_reserve_datetime = models.DateTimeField(verbose_name=_('Next free reserve datetime'))
+
+    def __str__(self):
+        return f'{self.doctor.full_name} for {self.specialty} in {self.city}'
+
+    class Meta:
+        unique_together = [['specialty', 'city', 'doctor']]
+        indexes = [
+            models.Index(fields=['specialty', 'city', 'next_free_reserve_datetime'], name='doctor_alternative_lookup_idx')
+        ]
+        verbose_name = _('Doctor alternative')
+        verbose_name_plural = _('Doctor alternatives')
+
+
+class ScheduleTemplate(models.Model):
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='schedule_templates', verbose_name=_('Doctor'))
+    weekdays = models.JSONField(default=list, verbose_name=_('Weekdays'), help_text=_('Days of the week, 0 is Monday and 6 is Sunday.'))
+    start_time = models.TimeField(verbose_name=_('Start time'))
+    end_time = models.TimeField(verbose_name=_('End time'))
+    slot_minutes = models.PositiveSmallIntegerField(
+        default=15,
+        validators=[MinValueValidator(MIN_SLOT_MINUTES), MaxValueValidator(MAX_SLOT_MINUTES)],
+        verbose_name=_('Slot minutes')
+    )
+    price = models.PositiveIntegerField(verbose_name=_('Price'))
+
+    created_datetime = models.DateTimeField(auto_now_add=True, verbose_name=_('Created datetime'))
+
+    def clean(self):
+        super().clean()
+
+        if not isinstance(self.weekdays, list) or not self.weekdays or \
+                any(type(weekday) is not int or not 0 <= weekday <= 6 for weekday in self.weekdays):
+            raise ValidationError({'weekdays': _('Weekdays must be a non-empty list of days between 0 and 6.')})
+        if self.start_time and self.end_time and self.slot_minutes and \
+                datetime.combine(datetime.min, self.start_time) + timedelta(minutes=self.slot_minutes) > datetime.combine(datetime.min, self.end_time):
+            raise ValidationError(_('There must be room for at least one slot between the start time and the end time.'))
+
+    def get_slot_datetimes(self, start_date, end_date):
+        """
+        Return the start datetime (Tehran time) of every slot of the template between
+        start_date and end_date, both included. A slot ends at end_time at the latest.
+        """
+        slot_datetimes = []
+        slot_length = timedelta(minutes=self.slot_minutes)
+        date = start_date
+
+        while date <= end_date:
+            if date.weekday() in self.weekdays:
+                slot_datetime = datetime.combine(date, self.start_time, tzinfo=TEHRAN_TZ)
+                end_datetime = datetime.combine(date, self.end_time, tzinfo=TEHRAN_TZ)
+
+                while slot_datetime + slot_length <= end_datetime:
+                    slot_datetimes.append(slot_datetime)
+                    slot_datetime += slot_length
+
+            date += timedelta(days=1)
+
+        return slot_datetimes
+
+    def __str__(self):
+        return f'{self.doctor.full_name}: {self.start_time}-{self.end_time}'
+
+    class Meta:
+        verbose_name = _('Schedule template')
+        verbose_name_plural = _('Schedule templates')
+        constraints = [
+            # A zero slot length would never reach the end time in get_slot_datetimes
+            models.CheckConstraint(
+                check=Q(slot_minutes__gte=MIN_SLOT_MINUTES, slot_minutes__lte=MAX_SLOT_MINUTES),
+                name='schedule_template_slot_minutes_range'
+            )
+        ]
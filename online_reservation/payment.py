@@ -1,47 +1,398 @@
+"""
+Client of the Zarinpal sandbox gateway.
+
+ZarinpalSandbox sends the requests through one httpx client per process, so the connections
+to the gateway are kept alive between payments. Both it and AsyncZarinpalSandbox time out
+after the ZARINPAL_*_TIMEOUT settings and retry the connection errors, the timeouts and the
+5xx of the gateway with an exponential backoff, then raise PaymentGatewayError.
+
+verify_reserve_payment verifies a payment and marks its reserve paid, for the callback and
+for the verify_pending_reserve_payment task when the verification is asynchronous.
+reconcile_reserve_payments verifies the payments whose callback never came, by batches.
+Each requested payment is a ReservePayment, a verified one is credited to its reserve only
+while the patient who requested it holds the reserve, otherwise it is marked refund due.
+"""
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
 
-import requests
-import json
+import asyncio
+import time
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 
-class ZarinpalSandbox:
-    _zarinpal_request_url = 'https://sandbox.zarinpal.com/pg/rest/WebGate/PaymentRequest.json'
-    _zarinpal_page_url = 'https://sandbox.zarinpal.com/pg/StartPay/'
-    _zarinpal_verify_url = 'https://sandbox.zarinpal.com/pg/rest/WebGate/PaymentVerification.json'
+import httpx
 
+from config.metrics import PAYMENT_GATEWAY_REQUEST_LATENCY
+from .models import Reserve, ReservePayment
+from .stats import rebuild_doctor_stats
 
-    def __init__(self, merchant_id=settings.ZARINPAL_MERCHANT_ID):
-        self.merchant_id = merchant_id
 
-    def payment_request(self, toman_total_price, description, callback_url):
-        request_header = {
-            "accept": "application/json",
-            "content-type": "application/json"
-        }
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+RETRIED_STATUS_CODES = {502, 503, 504}
+
+# The callback of a payment normally comes within it, a running hold's payment is reconciled only after it
+LOST_CALLBACK_DELAY = timedelta(minutes=5)
+
+ZARINPAL_STATUS_SUCCESS = 100
+ZARINPAL_STATUS_ALREADY_VERIFIED = 101
+
+VERIFICATION_PAID = 'paid'
+VERIFICATION_ALREADY_PAID = 'already_paid'
+VERIFICATION_FAILED = 'failed'
+VERIFICATION_REFUND_DUE = 'refund_due'
+
+PAYMENT_STATUS_PAID = 'paid'
+PAYMENT_STATUS_PENDING = 'pending'
+PAYMENT_STATUS_FAILED = 'failed'
+PAYMENT_STATUS_UNPAID = 'unpaid'
+PAYMENT_STATUS_REFUND_DUE = 'refund_due'
+
+# What a verification answers for a payment that was already settled
+SETTLED_PAYMENT_VERIFICATIONS = {
+    ReservePayment.PAYMENT_STATUS_VERIFIED: VERIFICATION_ALREADY_PAID,
+    ReservePayment.PAYMENT_STATUS_FAILED: VERIFICATION_FAILED,
+    ReservePayment.PAYMENT_STATUS_REFUND_DUE: VERIFICATION_REFUND_DUE
+}
+
+OUTCOME_RESPONSE = 'response'
+OUTCOME_RETRY = 'retry'
+OUTCOME_ERROR = 'error'
+
+
+class PaymentGatewayError(APIException):
+    status_code = status.HTTP_502_BAD_GATEWAY
+    default_detail = _('The payment gateway is not available, please try again later.')
+    default_code = 'payment_gateway_error'
+
+
+def get_zarinpal_client_options(base_url):
+    return {
+        'base_url': base_url,
+        'headers': {'accept': 'application/json'},
+        'timeout': httpx.Timeout(settings.ZARINPAL_TIMEOUT, connect=settings.ZARINPAL_CONNECT_TIMEOUT),
+        'limits': httpx.Limits(max_connections=settings.ZARINPAL_MAX_CONNECTIONS, max_keepalive_connections=settings.ZARINPAL_MAX_CONNECTIONS)
+    }
+
+
+# Created on first use, after the fork of the gunicorn workers and the Celery children
+@lru_cache
+def get_zarinpal_client(base_url):
+    return httpx.Client(**get_zarinpal_client_options(base_url))
+
+
+class BaseZarinpalSandbox:
+    _zarinpal_request_path = '/pg/rest/WebGate/PaymentRequest.json'
+    _zarinpal_page_path = '/pg/StartPay/'
+    _zarinpal_verify_path = '/pg/rest/WebGate/PaymentVerification.json'
+
+    def __init__(self, merchant_id=None, base_url=None, retries=None, retry_backoff=None):
+        self.merchant_id = merchant_id or settings.ZARINPAL_MERCHANT_ID
+        self.base_url = base_url or settings.ZARINPAL_SANDBOX_URL
+        self.retries = settings.ZARINPAL_RETRIES if retries is None else retries
+        self.retry_backoff = settings.ZARINPAL_RETRY_BACKOFF if retry_backoff is None else retry_backoff
 
-        request_data = {
+    def generate_payment_page_url(self, authority):
+        return f'{self.base_url}{self._zarinpal_page_path}{authority}'
+
+    def get_payment_request_data(self, toman_total_price, description, callback_url):
+        return {
             'MerchantID': self.merchant_id,
             'Amount': toman_total_price,
             'Description': description,
             'CallbackURL': callback_url,
         }
 
-        response = requests.post(url=self._zarinpal_request_url, data=json.dumps(request_data), headers=request_header)
-        return response.json()
-    
-    def generate_payment_page_url(self, authority):
-        return f'{self._zarinpal_page_url}{authority}'
-    
-    def payment_verify(self, toman_total_price, authority):
-        request_header = {
-            "accept": "application/json",
-            "content-type": "application/json"
-        }
-
-        request_data = {
+    def get_payment_verify_data(self, toman_total_price, authority):
+        return {
             'MerchantID': self.merchant_id,
             'Amount': toman_total_price,
             'Authority': authority,
         }
 
-        response = requests.post(url=self._zarinpal_verify_url, data=json.dumps(request_data), headers=request_header)
-        return response.json()
+    def get_retry_delay(self, attempt):
+        return self.retry_backoff * 2 ** attempt
+
+    def handle_attempt(self, operation, attempt, started_at, response=None, error=None):
+        """
+        Return the data of the response, None when the attempt should be retried, or raise
+        PaymentGatewayError after the last one. A retried payment request can leave an unused
+        authority behind, the gateway lets it expire.
+        """
+        duration = time.perf_counter() - started_at
+
+        if error is None and response.status_code not in RETRIED_STATUS_CODES:
+            try:
+                data = response.json()
+            except ValueError as json_error:
+                error = json_error
+            else:
+                PAYMENT_GATEWAY_REQUEST_LATENCY.labels(operation, OUTCOME_RESPONSE).observe(duration)
+                return data
+
+        if attempt < self.retries:
+            PAYMENT_GATEWAY_REQUEST_LATENCY.labels(operation, OUTCOME_RETRY).observe(duration)
+            return None
+
+        PAYMENT_GATEWAY_REQUEST_LATENCY.labels(operation, OUTCOME_ERROR).observe(duration)
+        raise PaymentGatewayError() from error
+
+
+class ZarinpalSandbox(BaseZarinpalSandbox):
+
+    def __init__(self, merchant_id=None, base_url=None, retries=None, retry_backoff=None, client=None):
+        super().__init__(merchant_id, base_url, retries, retry_backoff)
+        self.client = client or get_zarinpal_client(self.base_url)
+
+    def post(self, operation, path, data):
+        for attempt in range(self.retries + 1):
+            started_at = time.perf_counter()
+            try:
+                response = self.client.post(path, json=data)
+            except httpx.TransportError as error:
+                result = self.handle_attempt(operation, attempt, started_at, error=error)
+            else:
+                result = self.handle_attempt(operation, attempt, started_at, response=response)
+
+            if result is not None:
+                return result
+            time.sleep(self.get_retry_delay(attempt))
+
+    def payment_request(self, toman_total_price, description, callback_url):
+        return self.post('payment_request', self._zarinpal_request_path,
+                         self.get_payment_request_data(toman_total_price, description, callback_url))
+
+    def payment_verify(self, toman_total_price, authority):
+        return self.post('payment_verify', self._zarinpal_verify_path,
+                         self.get_payment_verify_data(toman_total_price, authority))
+
+
+class AsyncZarinpalSandbox(BaseZarinpalSandbox):
+    """
+    The same client for asyncio code, its connections are closed on leaving its context:
+
+        async with AsyncZarinpalSandbox() as zarinpal_sandbox:
+            data = await zarinpal_sandbox.payment_verify(toman_total_price, authority)
+    """
+
+    def __init__(self, merchant_id=None, base_url=None, retries=None, retry_backoff=None):
+        super().__init__(merchant_id, base_url, retries, retry_backoff)
+        self.client = httpx.AsyncClient(**get_zarinpal_client_options(self.base_url))
+
+    async def __aenter__(self):
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.client.__aexit__(*args)
+
+    async def post(self, operation, path, data):
+        for attempt in range(self.retries + 1):
+            started_at = time.perf_counter()
+            try:
+                response = await self.client.post(path, json=data)
+            except httpx.TransportError as error:
+                result = self.handle_attempt(operation, attempt, started_at, error=error)
+            else:
+                result = self.handle_attempt(operation, attempt, started_at, response=response)
+
+            if result is not None:
+                return result
+            await asyncio.sleep(self.get_retry_delay(attempt))
+
+    async def payment_request(self, toman_total_price, description, callback_url):
+        return await self.post('payment_request', self._zarinpal_request_path,
+                               self.get_payment_request_data(toman_total_price, description, callback_url))
+
+    async def payment_verify(self, toman_total_price, authority):
+        return await self.post('payment_verify', self._zarinpal_verify_path,
+                               self.get_payment_verify_data(toman_total_price, authority))
+
+
+def verify_reserve_payment(authority, zarinpal_sandbox=None):
+    """
+    Verify the payment of authority at the gateway and credit it to its reserve, or mark it
+    refund due when its patient doesn't hold the reserve anymore. It can be run again safely:
+    a settled payment isn't verified again, the gateway answers ZARINPAL_STATUS_ALREADY_VERIFIED
+    to a verified authority, and the payment and its reserve are updated under row locks,
+    taken after the gateway's answer so no transaction waits on it.
+    Raise PaymentGatewayError when the gateway doesn't answer, the payment is left pending.
+    """
+    payment = ReservePayment.objects.only('status', 'amount').get(authority=authority)
+    if payment.status != ReservePayment.PAYMENT_STATUS_PENDING:
+        return SETTLED_PAYMENT_VERIFICATIONS[payment.status]
+
+    data = (zarinpal_sandbox or ZarinpalSandbox()).payment_verify(toman_total_price=payment.amount, authority=authority)
+
+    with transaction.atomic():
+        payment = ReservePayment.objects.select_for_update().get(id=payment.id)
+        if payment.status != ReservePayment.PAYMENT_STATUS_PENDING:
+            return SETTLED_PAYMENT_VERIFICATIONS[payment.status]
+        reserve = Reserve.objects.select_for_update().get(id=payment.reserve_id)
+
+        if data.get('Status') in [ZARINPAL_STATUS_SUCCESS, ZARINPAL_STATUS_ALREADY_VERIFIED]:
+            if credit_payment(payment, reserve, data['RefID']):
+                # Saved for the doctor's statistics, which count the paid reserves
+                reserve.save(update_fields=['status', 'zarinpal_authority', 'zarinpal_ref_id', 'payment_verification_status'])
+                verification = VERIFICATION_PAID if data['Status'] == ZARINPAL_STATUS_SUCCESS else VERIFICATION_ALREADY_PAID
+            else:
+                verification = VERIFICATION_REFUND_DUE
+        else:
+            payment.status = ReservePayment.PAYMENT_STATUS_FAILED
+            if reserve.zarinpal_authority == authority:
+                reserve.payment_verification_status = Reserve.PAYMENT_VERIFICATION_FAILED
+                reserve.save(update_fields=['payment_verification_status'])
+            verification = VERIFICATION_FAILED
+
+        payment.save(update_fields=['status', 'ref_id', 'updated_datetime'])
+
+    return verification
+
+
+def get_payment_status(payment):
+    """
+    Status of payment for its patient, payment is loaded with its reserve.
+    """
+    if payment.status == ReservePayment.PAYMENT_STATUS_VERIFIED:
+        return PAYMENT_STATUS_PAID
+    elif payment.status == ReservePayment.PAYMENT_STATUS_REFUND_DUE:
+        return PAYMENT_STATUS_REFUND_DUE
+    elif payment.status == ReservePayment.PAYMENT_STATUS_FAILED:
+        return PAYMENT_STATUS_FAILED
+    # The callback came and the verification is queued
+    elif payment.reserve.zarinpal_authority == payment.authority and payment.reserve.payment_verification_status == Reserve.PAYMENT_VERIFICATION_PENDING:
+        return PAYMENT_STATUS_PENDING
+    return PAYMENT_STATUS_UNPAID
+
+
+def credit_payment(payment, reserve, ref_id):
+    """
+    Credit the verified payment to reserve while the patient who requested it still holds it
+    unpaid, otherwise mark the payment refund due. Both rows are locked by the caller, who
+    saves them. Return whether the reserve was paid.
+    """
+    payment.ref_id = str(ref_id)
+
+    if reserve.status == Reserve.RESERVE_STATUS_UNPAID and reserve.patient_id is not None and reserve.patient_id == payment.patient_id:
+        payment.status = ReservePayment.PAYMENT_STATUS_VERIFIED
+        reserve.status = Reserve.RESERVE_STATUS_PAID
+        reserve.zarinpal_authority = payment.authority
+        reserve.zarinpal_ref_id = payment.ref_id
+        reserve.payment_verification_status = Reserve.PAYMENT_VERIFICATION_VERIFIED
+        return True
+
+    payment.status = ReservePayment.PAYMENT_STATUS_REFUND_DUE
+    return False
+
+
+def get_unreconciled_payments(now=None):
+    """
+    Payments requested and never verified, the callback may have been lost. A recent
+    payment whose patient's hold is still running is left out, the patient may be paying.
+    """
+    now = now or datetime.now(tz=TEHRAN_TZ)
+    return ReservePayment.objects.filter(status=ReservePayment.PAYMENT_STATUS_PENDING).exclude(
+        reserve__patient_id=F('patient_id'),
+        reserve__celery_payment_expiration_datetime__gt=now,
+        created_datetime__gt=now - LOST_CALLBACK_DELAY
+    )
+
+
+async def verify_payment_authorities(payments, concurrency):
+    """
+    Verify the authorities of payments with at most `concurrency` requests at a time,
+    and return the gateway's answers in the same order, None for the unanswered ones.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with AsyncZarinpalSandbox() as zarinpal_sandbox:
+        async def verify(payment):
+            async with semaphore:
+                try:
+                    return await zarinpal_sandbox.payment_verify(toman_total_price=payment.amount, authority=payment.authority)
+                except PaymentGatewayError:
+                    return None
+
+        return await asyncio.gather(*(verify(payment) for payment in payments))
+
+
+def reconcile_reserve_payments(batch_size=200, concurrency=10):
+    """
+    Verify the next batch_size unreconciled payments at the gateway and write the outcomes in bulk:
+    - reconciled: paid while its patient still held the reserve, the reserve is marked paid.
+    - refunded: paid while its patient didn't hold the reserve anymore, the payment is marked
+      refund due. It stays recorded when the reserve is held by another patient.
+    - failed: not paid and its patient's hold is over, the payment is marked failed.
+    - gateway_errors: unanswered, the payment is tried again in a later run.
+    The least recently tried payments come first, and the ones left pending are touched, so
+    the next runs move on to the others. Return the counts of each outcome.
+    """
+    payments = list(get_unreconciled_payments().only('amount', 'authority').order_by('updated_datetime', 'id')[:batch_size])
+    counts = {'reconciled': 0, 'refunded': 0, 'failed': 0, 'gateway_errors': 0}
+    if not payments:
+        return counts
+
+    answers = asyncio.run(verify_payment_authorities(payments, concurrency))
+    # payment id: the gateway's answer
+    verifications = {}
+    for payment, data in zip(payments, answers):
+        if data is None:
+            counts['gateway_errors'] += 1
+        else:
+            verifications[payment.id] = data
+
+    now = datetime.now(tz=TEHRAN_TZ)
+    closed_payments, paid_reserves, failed_reserves = [], [], []
+
+    with transaction.atomic():
+        # The payments are locked before their reserves, in the same order as the callback
+        locked_payments = list(ReservePayment.objects.select_for_update().filter(
+            id__in=verifications, status=ReservePayment.PAYMENT_STATUS_PENDING
+        ).order_by('id'))
+        reserves = Reserve.objects.select_for_update().only(
+            'doctor_id', 'patient_id', 'status', 'zarinpal_authority', 'celery_payment_expiration_datetime'
+        ).in_bulk({payment.reserve_id for payment in locked_payments})
+
+        for payment in locked_payments:
+            reserve, data = reserves[payment.reserve_id], verifications[payment.id]
+
+            if data.get('Status') in [ZARINPAL_STATUS_SUCCESS, ZARINPAL_STATUS_ALREADY_VERIFIED]:
+                if credit_payment(payment, reserve, data['RefID']):
+                    paid_reserves.append(reserve)
+                    counts['reconciled'] += 1
+                else:
+                    counts['refunded'] += 1
+            else:
+                is_held = reserve.patient_id is not None and reserve.patient_id == payment.patient_id and \
+                    reserve.celery_payment_expiration_datetime is not None and reserve.celery_payment_expiration_datetime > now
+                if is_held:
+                    continue
+
+                payment.status = ReservePayment.PAYMENT_STATUS_FAILED
+                if reserve.zarinpal_authority == payment.authority:
+                    reserve.payment_verification_status = Reserve.PAYMENT_VERIFICATION_FAILED
+                    failed_reserves.append(reserve)
+                counts['failed'] += 1
+
+            payment.updated_datetime = now
+            closed_payments.append(payment)
+
+        ReservePayment.objects.bulk_update(closed_payments, ['status', 'ref_id', 'updated_datetime'])
+        # The unanswered and the skipped ones go to the end of the queue
+        closed_ids = {payment.id for payment in closed_payments}
+        ReservePayment.objects.filter(
+            id__in=[payment.id for payment in payments if payment.id not in closed_ids],
+            status=ReservePayment.PAYMENT_STATUS_PENDING
+        ).update(updated_datetime=now)
+        Reserve.objects.bulk_update(paid_reserves, ['status', 'zarinpal_authority', 'zarinpal_ref_id', 'payment_verification_status'])
+        Reserve.objects.bulk_update(failed_reserves, ['payment_verification_status'])
+
+    # bulk_update doesn't send post_save, the paid reserve counts are rebuilt here
+    if paid_reserves:
+        rebuild_doctor_stats({reserve.doctor_id for reserve in paid_reserves})
+
+    return counts
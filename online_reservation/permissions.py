@@ -16,7 +16,8 @@ class IsDoctor(BasePermission):
 class IsPatientInfoComplete(BasePermission):
 
     def has_permission(self, request, view):
-        fields = ['first_name', 'last_name', 'birth_date', 'gender', 'province', 'city']
+        # The ids of province and city, their rows aren't needed to know they are set
+        fields = ['first_name', 'last_name', 'birth_date', 'gender', 'province_id', 'city_id']
         patient = request.user.patient
         
         for field in fields:
@@ -32,7 +33,7 @@ class IsPatientInfoComplete(BasePermission):
 class IsDoctorOfficeAddressInfoComplete(BasePermission):
 
     def has_permission(self, request, view):
-        fields = ['province', 'city', 'office_address']
+        fields = ['province_id', 'city_id', 'office_address']
         doctor = request.user.doctor
 
         for field in fields:
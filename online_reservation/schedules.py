@@ -0,0 +1,87 @@
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.db.models.sql import InsertQuery
+
+from datetime import datetime, timezone, timedelta
+
+from .models import Reserve
+from .stats import refresh_next_free_reserves
+
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+SKIPPED_REASON_PAST = 'past'
+SKIPPED_REASON_EXISTS = 'exists'
+
+# Same limit as a single reserve created by ReserveDoctorCreateSerializer
+MIN_TIME_BEFORE_RESERVE = timedelta(minutes=10)
+
+
+def insert_reserves(reserves):
+    """
+    Insert reserves in batches, skipping those whose slot is already taken by the
+    unique constraint, and return the ids of the ones actually inserted.
+    """
+    fields = [field for field in Reserve._meta.concrete_fields if not field.primary_key]
+    batch_size = connection.ops.bulk_batch_size(fields, reserves) or len(reserves)
+
+    inserted_ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(reserves), batch_size):
+            # bulk_create(ignore_conflicts=True) doesn't tell which rows it skipped, RETURNING only lists the inserted ones
+            query = InsertQuery(Reserve, on_conflict=OnConflict.IGNORE)
+            query.insert_values(fields, reserves[start:start + batch_size])
+            compiler = query.get_compiler(connection=connection)
+            compiler.returning_fields = [Reserve._meta.pk]
+
+            for sql, params in compiler.as_sql():
+                cursor.execute(sql, params)
+                inserted_ids.extend(reserve_id for reserve_id, in cursor.fetchall())
+    return inserted_ids
+
+
+def create_reserves_from_schedule_template(template, start_date, end_date):
+    """
+    Create the reserves of every slot of template between start_date and end_date
+    with one query for the doctor's existing reserves, one bulk insert and one query to
+    re-select the slots it actually inserted.
+    Return (created datetimes, [(skipped datetime, reason), ...]).
+    """
+    slot_datetimes = template.get_slot_datetimes(start_date, end_date)
+    if not slot_datetimes:
+        return [], []
+
+    min_reserve_datetime = datetime.now(tz=TEHRAN_TZ) + MIN_TIME_BEFORE_RESERVE
+    existing_datetimes = set(Reserve.objects.filter(
+        doctor_id=template.doctor_id,
+        reserve_datetime__gte=slot_datetimes[0],
+        reserve_datetime__lte=slot_datetimes[-1]
+    ).values_list('reserve_datetime', flat=True))
+
+    new_datetimes = [
+        slot_datetime for slot_datetime in slot_datetimes
+        if slot_datetime >= min_reserve_datetime and slot_datetime not in existing_datetimes
+    ]
+
+    created_datetimes = set()
+    if new_datetimes:
+        with transaction.atomic():
+            # A reserve added since the lookup above is left alone by the unique constraint instead of failing the batch
+            inserted_ids = insert_reserves(
+                [Reserve(doctor_id=template.doctor_id, price=template.price, reserve_datetime=slot_datetime) for slot_datetime in new_datetimes]
+            )
+            if inserted_ids:
+                created_datetimes = set(Reserve.objects.filter(id__in=inserted_ids).values_list('reserve_datetime', flat=True))
+                # The raw insert doesn't send post_save, so the doctor's next free reserve is refreshed here
+                refresh_next_free_reserves([template.doctor_id])
+
+    created, skipped = [], []
+    for slot_datetime in slot_datetimes:
+        if slot_datetime < min_reserve_datetime:
+            skipped.append((slot_datetime, SKIPPED_REASON_PAST))
+        elif slot_datetime in created_datetimes:
+            created.append(slot_datetime)
+        else:
+            skipped.append((slot_datetime, SKIPPED_REASON_EXISTS))
+
+    return created, skipped
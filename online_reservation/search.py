@@ -0,0 +1,79 @@
+"""
+Doctor search on name, specialty name, bio and office address.
+
+On PostgreSQL it uses the doctors' stored search vector (GIN index) for the words
+and pg_trgm similarity on the names (trigram GIN indexes) for typos, ranked by both.
+The other databases, such as the SQLite of local runs, fall back to icontains.
+"""
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db import connection
+from django.db.models import F, Q, Value, Subquery, OuterRef
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Doctor, DoctorSpecialty
+
+
+# PostgreSQL has no Persian dictionary, the simple configuration only lowercases
+SEARCH_CONFIG = 'simple'
+
+ICONTAINS_SEARCH_FIELDS = ['first_name', 'last_name', 'bio', 'office_address']
+
+
+def is_full_text_search_supported():
+    return connection.vendor == 'postgresql'
+
+
+def doctor_search_vector():
+    specialty_names = DoctorSpecialty.objects.filter(
+        doctor=OuterRef('pk')
+    ).order_by().values('doctor').annotate(names=StringAgg('specialty__name', ' ')).values('names')
+
+    return (
+        SearchVector('first_name', 'last_name', weight='A', config=SEARCH_CONFIG) +
+        SearchVector(Coalesce(Subquery(specialty_names), Value('')), weight='B', config=SEARCH_CONFIG) +
+        SearchVector('bio', 'office_address', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+def update_doctor_search_vectors(doctor_ids=None):
+    """
+    Recompute the search vector of the given doctors (all doctors if None) in one statement.
+    """
+    if not is_full_text_search_supported():
+        return 0
+
+    queryset = Doctor.objects.all()
+    if doctor_ids is not None:
+        queryset = queryset.filter(id__in=doctor_ids)
+    return queryset.update(search_vector=doctor_search_vector())
+
+
+def search_doctors(queryset, text):
+    """
+    Filter queryset on text and order it by relevance, best match first.
+    """
+    text = text.strip()
+    if not text:
+        return queryset
+
+    if not is_full_text_search_supported():
+        return search_doctors_icontains(queryset, text)
+
+    search_query = SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+    name_similarity = Greatest(TrigramSimilarity('first_name', text), TrigramSimilarity('last_name', text))
+
+    return queryset.filter(
+        Q(search_vector=search_query) | Q(first_name__trigram_similar=text) | Q(last_name__trigram_similar=text)
+    ).annotate(
+        search_rank=SearchRank(F('search_vector'), search_query) + name_similarity
+    ).order_by('-search_rank', 'id')
+
+
+def search_doctors_icontains(queryset, text):
+    specialty_doctor_ids = DoctorSpecialty.objects.filter(specialty__name__icontains=text).values('doctor_id')
+
+    condition = Q(id__in=specialty_doctor_ids)
+    for field in ICONTAINS_SEARCH_FIELDS:
+        condition |= Q(**{f'{field}__icontains': text})
+    return queryset.filter(condition)
@@ -1,19 +1,71 @@
 from django.utils.translation import gettext as _
 from django.core.exceptions import ValidationError
-from django.db import transaction
+from django.db import transaction, IntegrityError
 from django.db.models import Prefetch
+from django.db.models.manager import BaseManager
+from django.utils.timezone import get_current_timezone
 from rest_framework import serializers
 from rest_framework.exceptions import NotFound
 
 from datetime import date, datetime, timezone, timedelta
+from functools import cached_property
 
-from .models import Doctor, DoctorSpecialty, Insurance, Patient, Province, City, Reserve, Specialty, DoctorInsurance, Comment
+from .models import Doctor, DoctorSpecialty, Insurance, Patient, Province, City, Reserve, Specialty, DoctorInsurance, Comment, DoctorStats, DoctorAlternative, ScheduleTemplate, \
+                    MIN_SLOT_MINUTES, MAX_SLOT_MINUTES
 from .validators import NationalCodeValidator
+from .booking import ReserveTakenError
+from .stats import ALTERNATIVE_DOCTORS_COUNT
 
 
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
 
 
+def get_doctor_stats(doctor):
+    # A doctor without a statistics row yet is reported as having no comments and reserves
+    return getattr(doctor, 'stats', None) or DoctorStats(doctor=doctor)
+
+
+class FastListSerializer(serializers.ListSerializer):
+    """
+    Read-only list serializer that builds every item with the child's `to_fast_representation`,
+    which returns the same data as its `to_representation` without going through the fields.
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, BaseManager) else data
+        return [self.child.to_fast_representation(item) for item in iterable]
+
+
+class FastRepresentationMixin:
+    """
+    Helpers of `to_fast_representation`, looked up once per serializer, so once per list.
+    """
+
+    @cached_property
+    def current_timezone(self):
+        return get_current_timezone()
+
+    @cached_property
+    def choice_labels(self):
+        return {}
+
+    def get_choice_label(self, instance, field_name):
+        # Same as instance.get_FOO_display(), with the labels translated once
+        labels = self.choice_labels.get(field_name)
+        if labels is None:
+            field = instance._meta.get_field(field_name)
+            labels = self.choice_labels[field_name] = {choice: str(label) for choice, label in field.flatchoices}
+
+        value = getattr(instance, field_name)
+        return labels.get(value, value)
+
+    def format_datetime(self, value, output_format):
+        # Same output as serializers.DateTimeField(format=output_format)
+        if not value:
+            return None
+        return value.astimezone(self.current_timezone).strftime(output_format)
+
+
 class ProvinceSerializer(serializers.ModelSerializer):
 
     class Meta:
@@ -204,7 +256,7 @@ class DoctorInsuranceSerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     name = serializers.SerializerMethodField()
     created_datetime = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S', read_only=True)
 
@@ -214,6 +266,7 @@ class CommentSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'is_anonymous': {'write_only': True}
         }
+        list_serializer_class = FastListSerializer
 
     def get_name(self, comment):
         if comment.is_anonymous:
@@ -224,6 +277,17 @@ class CommentSerializer(serializers.ModelSerializer):
         representation = super().to_representation(instance)
         representation['waiting_time'] = instance.get_waiting_time_display()
         return representation
+
+    def to_fast_representation(self, comment):
+        return {
+            'id': comment.id,
+            'name': self.get_name(comment),
+            'created_datetime': self.format_datetime(comment.created_datetime, '%Y-%m-%d %H:%M:%S'),
+            'rating': comment.rating,
+            'is_suggest': comment.is_suggest,
+            'waiting_time': self.get_choice_label(comment, 'waiting_time'),
+            'body': comment.body
+        }
     
     def create(self, validated_data):
         request = self.context.get('request')
@@ -248,7 +312,7 @@ class CommentDetailSerializer(serializers.ModelSerializer):
         return representation
     
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     age = serializers.SerializerMethodField()
     province = ProvinceSerializer()
     city = CitySerializer()
@@ -267,6 +331,7 @@ class DoctorSerializer(serializers.ModelSerializer):
                   'successful_reserve_count', 'medical_council_number', 'specialties',
                   'first_free_reserve_datetime', 'is_cover_insurance', 'province', 'city', 
                   'office_address']
+        list_serializer_class = FastListSerializer
         
     def get_age(self, doctor):
         if doctor.birth_date:
@@ -274,30 +339,23 @@ class DoctorSerializer(serializers.ModelSerializer):
         return None
     
     def get_rating_average(self, doctor):
-        try:
-            rating_average = round(sum([comment.rating for comment in doctor.comments.all()]) / doctor.comments.count(), 1)
-            
-            if rating_average == int(rating_average):
-                return int(rating_average)
-            return rating_average
-        except ZeroDivisionError:
-            return None
+        return get_doctor_stats(doctor).rating_average
 
     def get_comment_count(self, doctor):
-        return doctor.comments.count()
+        return get_doctor_stats(doctor).comment_count
     
     def get_successful_reserve_count(self, doctor):
-        return len(doctor.doctor_reserves)
+        return get_doctor_stats(doctor).paid_reserve_count
     
     def get_is_cover_insurance(self, doctor):
         return bool(doctor.insurances.count())
     
     def get_first_free_reserve_datetime(self, doctor):
-        free_reserves = doctor.doctor_free_reserves
+        first_free_reserve_datetime = get_doctor_stats(doctor).get_next_free_reserve_datetime()
 
-        if free_reserves:
+        if first_free_reserve_datetime:
             today_date = date.today()
-            first_free_reserve_date = free_reserves[0].reserve_datetime.date()
+            first_free_reserve_date = first_free_reserve_datetime.date()
 
             if today_date == first_free_reserve_date:
                 return _('Today')
@@ -311,6 +369,33 @@ class DoctorSerializer(serializers.ModelSerializer):
         representation['gender'] = instance.get_gender_display()
         representation['status'] = instance.get_status_display()
         return representation
+
+    def to_fast_representation(self, doctor):
+        stats = get_doctor_stats(doctor)
+        province, city = doctor.province, doctor.city
+
+        return {
+            'id': doctor.id,
+            'first_name': doctor.first_name,
+            'last_name': doctor.last_name,
+            'gender': self.get_choice_label(doctor, 'gender'),
+            'age': self.get_age(doctor),
+            'status': self.get_choice_label(doctor, 'status'),
+            'confirm_datetime': self.format_datetime(doctor.confirm_datetime, '%Y-%m-%d %H:%M:%S'),
+            'rating_average': stats.rating_average,
+            'comment_count': stats.comment_count,
+            'successful_reserve_count': stats.paid_reserve_count,
+            'medical_council_number': doctor.medical_council_number,
+            'specialties': [
+                {'id': doctor_specialty.specialty.id, 'name': doctor_specialty.specialty.name}
+                for doctor_specialty in doctor.specialties.all()
+            ],
+            'first_free_reserve_datetime': self.get_first_free_reserve_datetime(doctor),
+            'is_cover_insurance': self.get_is_cover_insurance(doctor),
+            'province': {'id': province.id, 'name': province.name} if province else None,
+            'city': {'id': city.id, 'name': city.name} if city else None,
+            'office_address': doctor.office_address
+        }
     
 
 class DoctorAlternativeSerializer(serializers.ModelSerializer):
@@ -327,25 +412,22 @@ class DoctorAlternativeSerializer(serializers.ModelSerializer):
                   'comment_rating_average', 'comment_count', 'successful_reserve_count', 'first_free_reserve_date']
     
     def get_comment_rating_average(self, doctor):
-        try:
-            rating_average = round(sum([comment.rating for comment in doctor.comments.all()]) / doctor.comments.count(), 1)
-            
-            if rating_average == int(rating_average):
-                return int(rating_average)
-            return rating_average
-        except ZeroDivisionError:
-            return None
+        return get_doctor_stats(doctor).rating_average
 
     def get_comment_count(self, doctor):
-        return doctor.comments.count()
+        return get_doctor_stats(doctor).comment_count
     
     def get_successful_reserve_count(self, doctor):
-        return len(doctor.doctor_reserves)
+        return get_doctor_stats(doctor).paid_reserve_count
     
     def get_first_free_reserve_date(self, doctor):
-        first_free_reserve = doctor.doctor_free_reserves[0]
+        first_free_reserve_datetime = get_doctor_stats(doctor).get_next_free_reserve_datetime()
+
+        if not first_free_reserve_datetime:
+            return None
+
         today_date = date.today()
-        first_free_reserve_date = first_free_reserve.reserve_datetime.date()
+        first_free_reserve_date = first_free_reserve_datetime.date()
 
         if today_date == first_free_reserve_date:
             return _('Today')
@@ -388,43 +470,28 @@ class DoctorDetailSerializer(serializers.ModelSerializer):
         return None
 
     def get_comment_rating_average(self, doctor):
-        try:
-            rating_average = round(sum([comment.rating for comment in doctor.comments.all()]) / doctor.comments.count(), 1)
-            
-            if rating_average == int(rating_average):
-                return int(rating_average)
-            return rating_average
-        except ZeroDivisionError:
-            return None
+        return get_doctor_stats(doctor).rating_average
 
     def get_comment_count(self, doctor):
-        return doctor.comments.count()
+        return get_doctor_stats(doctor).comment_count
 
     def get_successful_reserve_count(self, doctor):
-        return len(doctor.doctor_reserves)
+        return get_doctor_stats(doctor).paid_reserve_count
     
     def get_suggest_percentage(self, doctor):
-        try:
-            return round((sum([1 for comment in doctor.comments.all() if comment.is_suggest]) / doctor.comments.count()) * 100)
-        except ZeroDivisionError:
-            return None
+        return get_doctor_stats(doctor).suggest_percentage
     
     def get_average_waiting_time(self, doctor):
-        waiting_times = [comment.waiting_time for comment in doctor.comments.all()]
-
-        if waiting_times:
-            average_waiting_time = round(sum(waiting_times) / len(waiting_times))
-            return dict(Comment.COMMENT_WAITING_TIME).get(average_waiting_time)
-        return None
+        return get_doctor_stats(doctor).average_waiting_time
     
     def get_has_free_reserve(self, doctor):
-        return bool(doctor.doctor_free_reserves)
+        return bool(get_doctor_stats(doctor).get_next_free_reserve_datetime())
     
     def get_first_free_reserve_datetime(self, doctor):
-        if doctor.doctor_free_reserves:
-            first_free_reserve = doctor.doctor_free_reserves[0]
+        first_free_reserve_datetime = get_doctor_stats(doctor).get_next_free_reserve_datetime()
+
+        if first_free_reserve_datetime:
             today_date = date.today()
-            first_free_reserve_datetime = first_free_reserve.reserve_datetime
 
             if today_date == first_free_reserve_datetime.date():
                 return _('Today') + ' ' + str(first_free_reserve_datetime.astimezone(TEHRAN_TZ).strftime('%m-%d %H:%M'))
@@ -434,31 +501,26 @@ class DoctorDetailSerializer(serializers.ModelSerializer):
         return None
     
     def get_alternative_doctors(self, doctor):
-        if bool(doctor.doctor_free_reserves):
+        if self.get_has_free_reserve(doctor):
             return []
-        
-        queryset = Doctor.objects.select_related('city').prefetch_related(
-                Prefetch('specialties',
-                             queryset=DoctorSpecialty.objects.select_related('specialty'))
-                ).prefetch_related(
-                   Prefetch('reserves',
-                            queryset=Reserve.objects.filter(status=Reserve.RESERVE_STATUS_PAID),
-                            to_attr='doctor_reserves')
-                ).prefetch_related(
-                    Prefetch('comments',
-                             queryset=Comment.objects.filter(status=Comment.COMMENT_STATUS_APPROVED).select_related('patient').order_by('-created_datetime'))
-                ).prefetch_related(
-                    Prefetch('reserves',
-                             queryset=Reserve.objects.filter(reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ), patient__isnull=True).order_by('reserve_datetime'),
-                             to_attr='doctor_free_reserves')
+
+        # The doctor's specialties are prefetched by the views, the alternatives come from their precomputed index
+        specialty_ids = [doctor_specialty.specialty_id for doctor_specialty in doctor.specialties.all()]
+        if not specialty_ids or not doctor.city_id:
+            return []
+
+        alternatives = DoctorAlternative.objects.select_related('doctor__city', 'doctor__stats').prefetch_related(
+                Prefetch('doctor__specialties',
+                         queryset=DoctorSpecialty.objects.select_related('specialty'))
                 ).filter(
-                    specialties__specialty_id__in=doctor.specialties.values_list('specialty__id', flat=True), 
-                    city=doctor.city,
-                    reserves__reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ),
-                    reserves__status=Reserve.RESERVE_STATUS_UNPAID).\
-                exclude(id=doctor.id).distinct()[:5]
-        
-        return DoctorAlternativeSerializer(queryset, many=True).data
+                    specialty_id__in=specialty_ids,
+                    city_id=doctor.city_id,
+                    next_free_reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ)
+                ).exclude(doctor_id=doctor.id).order_by('next_free_reserve_datetime', 'doctor_id')[:ALTERNATIVE_DOCTORS_COUNT * len(specialty_ids)]
+
+        # A doctor with several of the specialties is listed once
+        doctors = list({alternative.doctor_id: alternative.doctor for alternative in alternatives}.values())
+        return DoctorAlternativeSerializer(doctors[:ALTERNATIVE_DOCTORS_COUNT], many=True).data
     
     def to_representation(self, instance):
         representation = super().to_representation(instance)
@@ -629,7 +691,7 @@ class DoctorUpdateSerializer(serializers.ModelSerializer):
         return representation
 
 
-class ReservePatientSerializer(serializers.ModelSerializer):
+class ReservePatientSerializer(FastRepresentationMixin, serializers.ModelSerializer):
     doctor = serializers.CharField(source='doctor.full_name')
     reserve_datetime = serializers.DateTimeField(format='%Y-%m-%d %H:%M:%S')
     is_expired = serializers.SerializerMethodField()
@@ -637,6 +699,7 @@ class ReservePatientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Reserve
         fields = ['id', 'doctor', 'status', 'price', 'reserve_datetime', 'is_expired']
+        list_serializer_class = FastListSerializer
     
     def get_is_expired(self, reserve):
         return True if reserve.reserve_datetime < datetime.now(tz=TEHRAN_TZ) else False
@@ -646,6 +709,16 @@ class ReservePatientSerializer(serializers.ModelSerializer):
         representation['status'] = instance.get_status_display()
         return representation
 
+    def to_fast_representation(self, reserve):
+        return {
+            'id': reserve.id,
+            'doctor': reserve.doctor.full_name,
+            'status': self.get_choice_label(reserve, 'status'),
+            'price': reserve.price,
+            'reserve_datetime': self.format_datetime(reserve.reserve_datetime, '%Y-%m-%d %H:%M:%S'),
+            'is_expired': self.get_is_expired(reserve)
+        }
+
 
 class ReservePatientDetailSerializer(serializers.ModelSerializer):
     doctor = DoctorSerializer()
@@ -800,8 +873,79 @@ class ReserveDoctorCreateSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError({'detail': e.messages})
 
         return super().validate(attrs)
+
+    def create(self, validated_data):
+        # The unique constraint on (doctor, reserve_datetime) is checked by the insert itself instead of a query before it
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({'detail': [
+                _("A doctor can't have two or more reserves at the same time(%(reserve_datetime)s).") % {'reserve_datetime': validated_data['reserve_datetime'].strftime('%Y-%m-%d %H:%M')}
+            ]})
         
 
+class ScheduleTemplateSerializer(serializers.ModelSerializer):
+    weekdays = serializers.ListField(child=serializers.IntegerField(min_value=0, max_value=6), allow_empty=False)
+    start_time = serializers.TimeField(format='%H:%M')
+    end_time = serializers.TimeField(format='%H:%M')
+    slot_minutes = serializers.IntegerField(min_value=MIN_SLOT_MINUTES, max_value=MAX_SLOT_MINUTES, default=15)
+
+    class Meta:
+        model = ScheduleTemplate
+        fields = ['id', 'weekdays', 'start_time', 'end_time', 'slot_minutes', 'price']
+
+    def validate_weekdays(self, weekdays):
+        return sorted(set(weekdays))
+
+    def validate(self, attrs):
+        start_datetime = datetime.combine(date.today(), attrs['start_time'])
+        end_datetime = datetime.combine(date.today(), attrs['end_time'])
+
+        if start_datetime + timedelta(minutes=attrs['slot_minutes']) > end_datetime:
+            raise serializers.ValidationError({'detail': _('There must be room for at least one slot between the start time and the end time.')})
+        return super().validate(attrs)
+
+    def create(self, validated_data):
+        validated_data['doctor'] = self.context.get('doctor')
+        return super().create(validated_data)
+
+
+class ScheduleTemplateCreateReservesSerializer(serializers.Serializer):
+    MAX_DAYS = 92
+
+    start_date = serializers.DateField()
+    end_date = serializers.DateField()
+
+    def validate(self, attrs):
+        if attrs['start_date'] > attrs['end_date']:
+            raise serializers.ValidationError({'detail': _('The start date cannot be after the end date.')})
+        elif (attrs['end_date'] - attrs['start_date']).days >= self.MAX_DAYS:
+            raise serializers.ValidationError({'detail': _('Reserves can be created for at most %(max_days)d days at once.') % {'max_days': self.MAX_DAYS}})
+        return attrs
+
+
+class AppointmentCalendarQueryParamSerializer(serializers.Serializer):
+    DEFAULT_DAYS = 30
+    MAX_DAYS = 92
+
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+
+    def validate(self, attrs):
+        today = datetime.now(tz=TEHRAN_TZ).date()
+        start_date = attrs.setdefault('start_date', today)
+        end_date = attrs.setdefault('end_date', start_date + timedelta(days=self.DEFAULT_DAYS - 1))
+
+        if start_date < today:
+            raise serializers.ValidationError({'start_date': _('Cannot select a date before today.')})
+        elif start_date > end_date:
+            raise serializers.ValidationError({'detail': _('The start date cannot be after the end date.')})
+        elif (end_date - start_date).days >= self.MAX_DAYS:
+            raise serializers.ValidationError({'detail': _('The calendar can be fetched for at most %(max_days)d days at once.') % {'max_days': self.MAX_DAYS}})
+        return attrs
+
+
 class ReservePaymentQueryParamSerializer(serializers.Serializer):
     reserve_id = serializers.IntegerField(error_messages={
         'required': _('This query param is required.')
@@ -820,7 +964,7 @@ class ReservePaymentQueryParamSerializer(serializers.Serializer):
             if reserve.reserve_datetime < datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=5):
                 raise serializers.ValidationError({'detail': _('This reserve has expired.')})
             elif reserve.patient and reserve.patient != patient:
-                raise serializers.ValidationError({'detail': _('This reserve has been taken by another patient.')})
+                raise ReserveTakenError()
             elif reserve.patient and reserve.patient == patient and reserve.status == Reserve.RESERVE_STATUS_PAID:
                 raise serializers.ValidationError({'detail': _('You have already taken and paid for this reserve.')})
 
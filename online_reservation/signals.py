@@ -1,16 +1,14 @@
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
 from django.contrib.auth import get_user_model
 
-from datetime import timezone, timedelta, datetime
-from django_celery_beat.models import ClockedSchedule, PeriodicTask
-import json
+from .models import Patient, Doctor, DoctorStats, DoctorSpecialty, DoctorInsurance, Specialty, Comment, Reserve
+from .stats import COMMENT_STATS_FIELDS, RESERVE_STATS_FIELDS, get_comment_stats_state, get_reserve_stats_state, \
+                   get_previous_stats_state, get_current_stats_state, apply_comment_stats_change, apply_reserve_stats_change
+from .caching import invalidate_doctor_responses
+from .search import update_doctor_search_vectors
 
-from .models import Patient, Doctor, Comment, Reserve
-from .tasks import remove_patient_from_reserve_after_expired
 
-
-TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
 User = get_user_model()
 
 
@@ -32,17 +30,85 @@ def remove_doctor_for_change_status_to_rejected(sender, instance, **kwargs):
         instance.delete()
 
 
+@receiver(post_save, sender=Doctor)
+def create_stats_for_newly_created_doctor(sender, instance, created, **kwargs):
+    if created:
+        DoctorStats.objects.get_or_create(doctor=instance)
+
+
+@receiver(pre_save, sender=Comment)
+@receiver(pre_delete, sender=Comment)
+def remember_comment_stats_state(sender, instance, **kwargs):
+    instance._stats_state = get_previous_stats_state(instance, COMMENT_STATS_FIELDS, get_comment_stats_state)
+
+
+@receiver(post_save, sender=Comment)
+def update_doctor_stats_for_saved_comment(sender, instance, **kwargs):
+    # If another receiver has already deleted the comment, post_delete has reset _stats_state to None
+    new_state = get_current_stats_state(instance, COMMENT_STATS_FIELDS, get_comment_stats_state)
+    apply_comment_stats_change(instance._stats_state, new_state)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=Comment)
+def update_doctor_stats_for_deleted_comment(sender, instance, **kwargs):
+    apply_comment_stats_change(getattr(instance, '_stats_state', None), None)
+    instance._stats_state = None
+
+
+@receiver(pre_save, sender=Reserve)
+@receiver(pre_delete, sender=Reserve)
+def remember_reserve_stats_state(sender, instance, **kwargs):
+    instance._stats_state = get_previous_stats_state(instance, RESERVE_STATS_FIELDS, get_reserve_stats_state)
+
+
 @receiver(post_save, sender=Reserve)
-def manage_patient_for_newly_reserve(sender, instance, created, **kwargs):
-    if created and instance.reserve_datetime > datetime.now(tz=TEHRAN_TZ):
-        clocked_schedule, created = ClockedSchedule.objects.get_or_create(
-            clocked_time=instance.reserve_datetime
-        )
-
-        task = PeriodicTask.objects.create(
-            name=f'task-for-object-{instance.id}',
-            task='online_reservation.tasks.remove_patient_from_reserve_after_expired',
-            clocked=clocked_schedule,
-            args=json.dumps([instance.id]),
-            one_off=True
-        )
+def update_doctor_stats_for_saved_reserve(sender, instance, **kwargs):
+    new_state = get_current_stats_state(instance, RESERVE_STATS_FIELDS, get_reserve_stats_state)
+    apply_reserve_stats_change(instance._stats_state, new_state)
+    instance._stats_state = new_state
+
+
+@receiver(post_delete, sender=Reserve)
+def update_doctor_stats_for_deleted_reserve(sender, instance, **kwargs):
+    apply_reserve_stats_change(getattr(instance, '_stats_state', None), None)
+    instance._stats_state = None
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidate_cached_responses_of_changed_doctor(sender, instance, **kwargs):
+    invalidate_doctor_responses([instance.id])
+
+
+@receiver(post_save, sender=DoctorSpecialty)
+@receiver(post_delete, sender=DoctorSpecialty)
+@receiver(post_save, sender=DoctorInsurance)
+@receiver(post_delete, sender=DoctorInsurance)
+def invalidate_cached_responses_for_changed_doctor_relations(sender, instance, **kwargs):
+    invalidate_doctor_responses([instance.doctor_id])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def invalidate_cached_responses_for_changed_approved_comment(sender, instance, **kwargs):
+    # The details show the approved comments, a change of the statistics (and the lists) is invalidated with them
+    if instance.status == Comment.COMMENT_STATUS_APPROVED:
+        invalidate_doctor_responses([instance.doctor_id], is_list_changed=False)
+
+
+@receiver(post_save, sender=Doctor)
+def update_search_vector_of_saved_doctor(sender, instance, **kwargs):
+    update_doctor_search_vectors([instance.id])
+
+
+@receiver(post_save, sender=DoctorSpecialty)
+@receiver(post_delete, sender=DoctorSpecialty)
+def update_search_vector_for_changed_specialties(sender, instance, **kwargs):
+    update_doctor_search_vectors([instance.doctor_id])
+
+
+@receiver(post_save, sender=Specialty)
+def update_search_vectors_for_renamed_specialty(sender, instance, created, **kwargs):
+    if not created:
+        update_doctor_search_vectors(DoctorSpecialty.objects.filter(specialty=instance).values('doctor_id'))
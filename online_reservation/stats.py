@@ -0,0 +1,298 @@
+from django.db import transaction
+from django.db.models import F, Min, Count, Sum, Q, Subquery, OuterRef, Window, Value, DateTimeField
+from django.db.models.functions import RowNumber, Coalesce
+from django.db.models.lookups import Exact
+
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+
+from .models import Doctor, DoctorStats, DoctorSpecialty, DoctorAlternative, Comment, Reserve
+from .caching import invalidate_doctor_responses
+
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+BULK_BATCH_SIZE = 1000
+
+ALTERNATIVE_DOCTORS_COUNT = 5
+
+
+COMMENT_STATS_FIELDS = ('doctor_id', 'status', 'rating', 'is_suggest', 'waiting_time')
+RESERVE_STATS_FIELDS = ('doctor_id', 'status', 'patient_id', 'reserve_datetime')
+
+# The statistics shown in the doctor lists (with the next free reserve), the others are only shown in the details
+LISTED_STATS_FIELDS = ('rating_sum', 'comment_count', 'paid_reserve_count')
+
+# Compares a missing next free reserve as equal to another missing one
+NO_NEXT_FREE_RESERVE = Value(datetime(1970, 1, 1, tzinfo=timezone.utc), output_field=DateTimeField())
+
+
+def get_comment_stats_state(values):
+    """
+    Return the part of a comment that is counted in its doctor's statistics,
+    None if the comment isn't counted (only approved comments are).
+    """
+    if values['status'] != Comment.COMMENT_STATUS_APPROVED:
+        return None
+    return (values['doctor_id'], values['rating'], values['is_suggest'], values['waiting_time'])
+
+
+def get_reserve_stats_state(values):
+    """
+    Return the part of a reserve that affects its doctor's statistics:
+    (doctor_id, is paid, is free, reserve_datetime).
+    """
+    return (
+        values['doctor_id'],
+        values['status'] == Reserve.RESERVE_STATUS_PAID,
+        values['patient_id'] is None,
+        values['reserve_datetime']
+    )
+
+
+def get_previous_stats_state(instance, fields, get_state):
+    """
+    Return the state that the statistics currently hold for instance, using the
+    values loaded from the database when possible instead of querying it again.
+    """
+    if hasattr(instance, '_stats_state'):
+        return instance._stats_state
+    if instance._state.adding:
+        return None
+
+    loaded_values = getattr(instance, '_loaded_values', {})
+    if all(field in loaded_values for field in fields):
+        return get_state(loaded_values)
+
+    values = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+    return get_state(values) if values else None
+
+
+def get_current_stats_state(instance, fields, get_state):
+    return get_state({field: getattr(instance, field) for field in fields})
+
+
+def next_free_reserve_subquery(now=None):
+    return Subquery(
+        Reserve.objects.filter(
+            doctor_id=OuterRef('doctor_id'),
+            reserve_datetime__gte=now or datetime.now(tz=TEHRAN_TZ),
+            patient__isnull=True
+        ).order_by('reserve_datetime').values('reserve_datetime')[:1]
+    )
+
+
+def _add_comment_delta(deltas, state, sign):
+    doctor_id, rating, is_suggest, waiting_time = state
+    delta = deltas[doctor_id]
+    delta['rating_sum'] += sign * rating
+    delta['comment_count'] += sign
+    delta['suggest_count'] += sign * int(is_suggest)
+    delta[DoctorStats.WAITING_TIME_FIELDS[waiting_time]] += sign
+
+
+def _update_stats(doctor_id, delta, refresh_next_free_reserve=False):
+    changes = {field: F(field) + value for field, value in delta.items() if value}
+
+    if not changes:
+        # Only invalidates the cached doctor if the next free reserve actually moved
+        if refresh_next_free_reserve:
+            refresh_next_free_reserves([doctor_id])
+        return
+
+    is_list_changed = refresh_next_free_reserve or any(field in changes for field in LISTED_STATS_FIELDS)
+    if refresh_next_free_reserve:
+        changes['next_free_reserve_datetime'] = next_free_reserve_subquery()
+
+    changes['updated_datetime'] = datetime.now(tz=TEHRAN_TZ)
+    DoctorStats.objects.filter(doctor_id=doctor_id).update(**changes)
+    invalidate_doctor_responses([doctor_id], is_list_changed=is_list_changed)
+
+
+def apply_comment_stats_change(old_state, new_state):
+    if old_state == new_state:
+        return
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    if old_state:
+        _add_comment_delta(deltas, old_state, -1)
+    if new_state:
+        _add_comment_delta(deltas, new_state, 1)
+
+    for doctor_id, delta in deltas.items():
+        _update_stats(doctor_id, delta)
+
+
+def apply_reserve_stats_change(old_state, new_state):
+    if old_state == new_state:
+        return
+
+    deltas = defaultdict(lambda: defaultdict(int))
+    for state, sign in [(old_state, -1), (new_state, 1)]:
+        if state:
+            doctor_id, is_paid, *_ = state
+            deltas[doctor_id]['paid_reserve_count'] += sign * int(is_paid)
+
+    # Only a slot that is (or was) free can move the doctor's next free slot
+    free_slot_changed = bool((old_state and old_state[2]) or (new_state and new_state[2]))
+
+    for doctor_id, delta in deltas.items():
+        _update_stats(doctor_id, delta, refresh_next_free_reserve=free_slot_changed)
+
+
+def refresh_next_free_reserves(doctor_ids=None):
+    """
+    Recompute the next free slot of the given doctors (all doctors if None) in one statement,
+    writing only the rows whose slot moved, and return the number of them.
+    """
+    next_free_reserve_datetime = next_free_reserve_subquery()
+    queryset = DoctorStats.objects.exclude(
+        Exact(Coalesce('next_free_reserve_datetime', NO_NEXT_FREE_RESERVE), Coalesce(next_free_reserve_datetime, NO_NEXT_FREE_RESERVE))
+    )
+
+    if doctor_ids is not None:
+        queryset = queryset.filter(doctor_id__in=doctor_ids)
+    else:
+        # Find the moved ones first, so only their cached responses are invalidated
+        doctor_ids = list(queryset.values_list('doctor_id', flat=True))
+        if not doctor_ids:
+            return 0
+        queryset = queryset.filter(doctor_id__in=doctor_ids)
+
+    count = queryset.update(
+        next_free_reserve_datetime=next_free_reserve_datetime,
+        updated_datetime=datetime.now(tz=TEHRAN_TZ)
+    )
+    # The bulk changes of reserves that end here don't send the signals that invalidate the cached doctors
+    if count:
+        invalidate_doctor_responses(doctor_ids)
+    return count
+
+
+def rebuild_doctor_stats(doctor_ids=None):
+    """
+    Rebuild the statistics of the given doctors (all doctors if None) from scratch
+    with one grouped query per source table, and return the number of rows written.
+    """
+    now = datetime.now(tz=TEHRAN_TZ)
+
+    doctors = Doctor.objects.all()
+    comments = Comment.objects.filter(status=Comment.COMMENT_STATUS_APPROVED)
+    reserves = Reserve.objects.all()
+
+    if doctor_ids is not None:
+        doctors = doctors.filter(id__in=doctor_ids)
+        comments = comments.filter(doctor_id__in=doctor_ids)
+        reserves = reserves.filter(doctor_id__in=doctor_ids)
+
+    waiting_time_aggregates = {
+        field: Count('id', filter=Q(waiting_time=waiting_time))
+        for waiting_time, field in DoctorStats.WAITING_TIME_FIELDS.items()
+    }
+    comment_stats = {
+        row.pop('doctor_id'): row
+        for row in comments.order_by().values('doctor_id').annotate(
+            rating_sum=Sum('rating'),
+            comment_count=Count('id'),
+            suggest_count=Count('id', filter=Q(is_suggest=True)),
+            **waiting_time_aggregates
+        )
+    }
+    reserve_stats = {
+        row.pop('doctor_id'): row
+        for row in reserves.order_by().values('doctor_id').annotate(
+            paid_reserve_count=Count('id', filter=Q(status=Reserve.RESERVE_STATUS_PAID)),
+            next_free_reserve_datetime=Min('reserve_datetime', filter=Q(reserve_datetime__gte=now, patient__isnull=True))
+        )
+    }
+
+    all_stats = [
+        DoctorStats(
+            doctor_id=doctor_id,
+            updated_datetime=now,
+            **comment_stats.get(doctor_id, {}),
+            **reserve_stats.get(doctor_id, {})
+        )
+        for doctor_id in doctors.values_list('id', flat=True).iterator()
+    ]
+
+    update_fields = ['rating_sum', 'comment_count', 'suggest_count', 'paid_reserve_count',
+                     'next_free_reserve_datetime', 'updated_datetime', *DoctorStats.WAITING_TIME_FIELDS.values()]
+    DoctorStats.objects.bulk_create(
+        all_stats,
+        batch_size=BULK_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['doctor'],
+        update_fields=update_fields
+    )
+    invalidate_doctor_responses(doctor_ids)
+
+    return len(all_stats)
+
+
+def refresh_doctor_alternatives():
+    """
+    Refresh the alternatives of every (specialty, city): the accepted doctors with the
+    soonest free reserves, ranked by one window query over the doctors' statistics.
+    Only the rows that differ from the index are written, return the number of them.
+    """
+    # One more than shown, a doctor is never its own alternative
+    size = ALTERNATIVE_DOCTORS_COUNT + 1
+    next_free_reserve_datetime = F('doctor__stats__next_free_reserve_datetime')
+
+    rows = DoctorSpecialty.objects.filter(
+        doctor__status=Doctor.DOCTOR_STATUS_ACCEPTED,
+        doctor__city__isnull=False,
+        doctor__stats__next_free_reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ)
+    ).annotate(
+        rank=Window(
+            RowNumber(),
+            partition_by=[F('specialty_id'), F('doctor__city_id')],
+            order_by=[next_free_reserve_datetime.asc(), F('doctor_id').asc()]
+        )
+    ).filter(rank__lte=size).values_list('specialty_id', 'doctor__city_id', 'doctor_id', 'doctor__stats__next_free_reserve_datetime')
+
+    new_alternatives = {(specialty_id, city_id, doctor_id): next_free_reserve_datetime
+                        for specialty_id, city_id, doctor_id, next_free_reserve_datetime in rows}
+
+    with transaction.atomic():
+        alternatives = {
+            (alternative.specialty_id, alternative.city_id, alternative.doctor_id): alternative
+            for alternative in DoctorAlternative.objects.select_for_update()
+        }
+
+        removed_ids = [alternative.id for key, alternative in alternatives.items() if key not in new_alternatives]
+        added_alternatives = []
+        moved_alternatives = []
+        for key, next_free_reserve_datetime in new_alternatives.items():
+            alternative = alternatives.get(key)
+            if alternative is None:
+                specialty_id, city_id, doctor_id = key
+                added_alternatives.append(DoctorAlternative(
+                    specialty_id=specialty_id, city_id=city_id, doctor_id=doctor_id, next_free_reserve_datetime=next_free_reserve_datetime
+                ))
+            elif alternative.next_free_reserve_datetime != next_free_reserve_datetime:
+                alternative.next_free_reserve_datetime = next_free_reserve_datetime
+                moved_alternatives.append(alternative)
+
+        if removed_ids:
+            DoctorAlternative.objects.filter(id__in=removed_ids).delete()
+        DoctorAlternative.objects.bulk_create(added_alternatives, batch_size=BULK_BATCH_SIZE)
+        DoctorAlternative.objects.bulk_update(moved_alternatives, ['next_free_reserve_datetime'], batch_size=BULK_BATCH_SIZE)
+
+    changed_groups = {
+        (alternative.specialty_id, alternative.city_id)
+        for alternative in [*(alternatives[key] for key in alternatives if key not in new_alternatives), *added_alternatives, *moved_alternatives]
+    }
+    if changed_groups:
+        # The detail of the doctors without free reserves shows the alternatives of their specialties in their city
+        doctor_groups = DoctorSpecialty.objects.filter(
+            specialty_id__in={specialty_id for specialty_id, city_id in changed_groups},
+            doctor__city_id__in={city_id for specialty_id, city_id in changed_groups}
+        ).values_list('doctor_id', 'specialty_id', 'doctor__city_id')
+        invalidate_doctor_responses(
+            [doctor_id for doctor_id, specialty_id, city_id in doctor_groups if (specialty_id, city_id) in changed_groups],
+            is_list_changed=False
+        )
+
+    return len(removed_ids) + len(added_alternatives) + len(moved_alternatives)
@@ -1,9 +1,18 @@
 from django.utils.translation import gettext as _
 
+from datetime import datetime, timezone, timedelta
+
 from config.celery_config import app
-from .models import Reserve
+from .models import Reserve, ReservePayment, DoctorStats
+from .booking import CLEARED_PAYMENT_FIELDS
+from .payment import verify_reserve_payment, reconcile_reserve_payments, PaymentGatewayError
+from .stats import refresh_next_free_reserves, refresh_doctor_alternatives
+
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
 
 
+# Replaced by release_unpaid_past_reserves, this one only runs the tasks that were already sent by beat
 @app.task(queue='tasks')
 def remove_patient_from_reserve_after_expired(reserve_id):
     try:
@@ -12,6 +21,8 @@ def remove_patient_from_reserve_after_expired(reserve_id):
         if reserve.status == Reserve.RESERVE_STATUS_UNPAID:
             if reserve.patient:
                 reserve.patient = None
+                for field, value in CLEARED_PAYMENT_FIELDS.items():
+                    setattr(reserve, field, value)
                 reserve.save()
                 return _('%(patient_fullname)s was successfully removed from the reserve.' % {'patient_fullname': patient.full_name})
             return _('No patient had this reserve.')
@@ -20,6 +31,7 @@ def remove_patient_from_reserve_after_expired(reserve_id):
         return _("There isn't any reserve with id=%(reserve_id)d." % {'reserve_id': reserve_id})
 
 
+# Holds are released by release_expired_reserve_holds now, this one only runs the ETA tasks that were already queued
 @app.task(queue='tasks')
 def manage_patient_after_end_of_reserve_purchase_time(reserve_id):
     try:
@@ -29,8 +41,84 @@ def manage_patient_after_end_of_reserve_purchase_time(reserve_id):
             reserve.patient = None
             reserve.celery_task_id = ''
             reserve.celery_payment_expiration_datetime = None
-            reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime'])
+            for field, value in CLEARED_PAYMENT_FIELDS.items():
+                setattr(reserve, field, value)
+            reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime', *CLEARED_PAYMENT_FIELDS])
             return _('Purchase time is finish, %(patient_fullname)s was successfully removed from the reserve.' % {'patient_fullname': patient.full_name})
         return _('%(patient_fullname)s has successfully taken the reserve.' % {'patient_fullname': patient.full_name})
     except Reserve.DoesNotExist:
         return _("There isn't any reserve with id=%(reserve_id)d." % {'reserve_id': reserve_id})
+
+
+@app.task(queue='tasks')
+def release_expired_reserve_holds():
+    now = datetime.now(tz=TEHRAN_TZ)
+    # A hold whose payment is being verified is kept, the patient may have paid it
+    expired_holds = Reserve.objects.filter(
+        status=Reserve.RESERVE_STATUS_UNPAID,
+        patient__isnull=False,
+        celery_payment_expiration_datetime__lte=now
+    ).exclude(payment_verification_status=Reserve.PAYMENT_VERIFICATION_PENDING)
+
+    # The update bypasses the signals, so the doctors' next free reserve is refreshed here
+    doctor_ids = list(expired_holds.order_by().values_list('doctor_id', flat=True).distinct())
+    count = expired_holds.update(patient=None, celery_task_id='', celery_payment_expiration_datetime=None, **CLEARED_PAYMENT_FIELDS)
+    if count:
+        refresh_next_free_reserves(doctor_ids)
+
+    return _('%(count)d expired holds were released.') % {'count': count}
+
+
+@app.task(queue='tasks')
+def release_unpaid_past_reserves():
+    # Only reserves in the past, which are never a doctor's next free reserve, so the stats don't change
+    count = Reserve.objects.filter(
+        status=Reserve.RESERVE_STATUS_UNPAID,
+        patient__isnull=False,
+        reserve_datetime__lte=datetime.now(tz=TEHRAN_TZ)
+    ).exclude(payment_verification_status=Reserve.PAYMENT_VERIFICATION_PENDING).update(
+        patient=None, celery_task_id='', celery_payment_expiration_datetime=None, **CLEARED_PAYMENT_FIELDS
+    )
+
+    return _('%(count)d unpaid past reserves were released.') % {'count': count}
+
+
+@app.task(queue='tasks')
+def refresh_alternative_doctors():
+    # A next free reserve whose time has passed isn't refreshed until it is read, do it first so these doctors aren't left out
+    stale_doctor_ids = list(DoctorStats.objects.filter(
+        next_free_reserve_datetime__lt=datetime.now(tz=TEHRAN_TZ)
+    ).values_list('doctor_id', flat=True))
+    if stale_doctor_ids:
+        refresh_next_free_reserves(stale_doctor_ids)
+
+    count = refresh_doctor_alternatives()
+    return _('%(count)d alternative doctors were changed in the index.') % {'count': count}
+
+
+@app.task(queue='tasks', bind=True, max_retries=5, ignore_result=True)
+def verify_pending_reserve_payment(self, authority):
+    """
+    Verify the payment recorded by the callback, it can run several times for the same payment.
+    """
+    # The tasks queued before the payments were recorded by authority pass the reserve's id
+    if isinstance(authority, int):
+        authority = Reserve.objects.filter(id=authority).values_list('zarinpal_authority', flat=True).first()
+
+    try:
+        verification = verify_reserve_payment(authority)
+    except PaymentGatewayError as error:
+        raise self.retry(exc=error, countdown=10 * 2 ** self.request.retries)
+    except ReservePayment.DoesNotExist:
+        return _("There isn't any payment with authority=%(authority)s.") % {'authority': authority}
+
+    return _('Payment verification of authority %(authority)s: %(verification)s.') % {'authority': authority, 'verification': verification}
+
+
+@app.task(queue='tasks')
+def reconcile_payments(batch_size=200, concurrency=10):
+    counts = reconcile_reserve_payments(batch_size, concurrency)
+    return _(
+        '%(reconciled)d payments were reconciled, %(refunded)d must be refunded, %(failed)d failed '
+        'and %(gateway_errors)d were not answered by the gateway.'
+    ) % counts
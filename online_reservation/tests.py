@@ -1,3 +1,1347 @@
-from django.test import TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Count
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.translation import gettext_lazy
+from rest_framework.exceptions import AuthenticationFailed, ParseError, PermissionDenied
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.tokens import AccessToken
+from prometheus_client import REGISTRY
+from django_celery_beat.models import PeriodicTask, ClockedSchedule
 
-# Create your tests here.
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from unittest import mock
+
+import httpx
+
+from config.parsers import ORJSONParser
+from config.renderers import ORJSONRenderer
+from core.authentication import CustomJWTAuthentication
+from core.models import OTP
+from core.otp_stores import DatabaseOTPStore, RedisOTPStore
+from core.serializers import UserDetailSerializer
+from .booking import hold_reserve, hold_reserve_or_raise, HOLD_CLAIMED, HOLD_ALREADY_HELD, HOLD_CONFLICT, ReserveTakenError
+from .benchmark import QueryStats, compare_with_baseline
+from .fake_data import FakeDataGenerator
+from .fake_zarinpal import FakeZarinpalServer, STATUS_SUCCESS, STATUS_ALREADY_VERIFIED, STATUS_NOT_PAID, STATUS_AMOUNT_MISMATCH
+from .factories import PatientFactory, DoctorFactory, CommentFactory, ReserveFactory
+from .models import Comment, Reserve, ReservePayment, DoctorStats, Province, City, Patient, Doctor, ScheduleTemplate, Specialty, DoctorSpecialty, DoctorAlternative
+from .payment import ZarinpalSandbox, AsyncZarinpalSandbox, PaymentGatewayError, get_zarinpal_client_options, verify_reserve_payment, \
+                     reconcile_reserve_payments, get_unreconciled_payments, LOST_CALLBACK_DELAY, VERIFICATION_PAID, VERIFICATION_ALREADY_PAID
+from .permissions import IsDoctor, IsDoctorOrPatient, IsPatientInfoComplete
+from .schedules import insert_reserves
+from .serializers import DoctorDetailSerializer, DoctorSerializer, ReservePatientSerializer, CommentSerializer
+from .stats import rebuild_doctor_stats, refresh_doctor_alternatives, refresh_next_free_reserves, ALTERNATIVE_DOCTORS_COUNT
+from .tasks import manage_patient_after_end_of_reserve_purchase_time, release_expired_reserve_holds, release_unpaid_past_reserves, \
+                   refresh_alternative_doctors, verify_pending_reserve_payment
+
+
+TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
+
+
+class DoctorStatsTests(TestCase):
+    stats_fields = ['rating_sum', 'comment_count', 'suggest_count', 'paid_reserve_count',
+                    'next_free_reserve_datetime', *DoctorStats.WAITING_TIME_FIELDS.values()]
+
+    def setUp(self):
+        self.patient = PatientFactory()
+        self.doctor = DoctorFactory()
+
+    def get_stats(self):
+        return DoctorStats.objects.filter(doctor=self.doctor).values(*self.stats_fields).get()
+
+    def assertStatsMatchRebuild(self):
+        incremental_stats = self.get_stats()
+        rebuild_doctor_stats([self.doctor.id])
+        self.assertEqual(incremental_stats, self.get_stats())
+
+    def test_stats_follow_comment_changes(self):
+        comment = CommentFactory(patient=self.patient, doctor=self.doctor, rating=4, status=Comment.COMMENT_STATUS_WAITING)
+        CommentFactory(patient=self.patient, doctor=self.doctor, rating=2, is_suggest=True, status=Comment.COMMENT_STATUS_APPROVED)
+        self.assertEqual(self.get_stats()['comment_count'], 1)
+
+        comment.status = Comment.COMMENT_STATUS_APPROVED
+        comment.save()
+        stats = DoctorStats.objects.get(doctor=self.doctor)
+        self.assertEqual(stats.comment_count, 2)
+        self.assertEqual(stats.rating_average, 3)
+        self.assertStatsMatchRebuild()
+
+        comment = Comment.objects.get(id=comment.id)
+        comment.status = Comment.COMMENT_STATUS_NOT_APPROVED
+        comment.save()
+        self.assertFalse(Comment.objects.filter(id=comment.id).exists())
+        self.assertEqual(self.get_stats()['comment_count'], 1)
+        self.assertStatsMatchRebuild()
+
+        Comment.objects.filter(doctor=self.doctor).delete()
+        self.assertEqual(self.get_stats()['rating_sum'], 0)
+        self.assertStatsMatchRebuild()
+
+    def test_stats_follow_reserve_changes(self):
+        now = datetime.now(tz=TEHRAN_TZ)
+        later_reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=2))
+        sooner_reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=1))
+        self.assertEqual(self.get_stats()['next_free_reserve_datetime'], sooner_reserve.reserve_datetime)
+
+        sooner_reserve.patient = self.patient
+        sooner_reserve.status = Reserve.RESERVE_STATUS_PAID
+        sooner_reserve.save()
+        stats = self.get_stats()
+        self.assertEqual(stats['paid_reserve_count'], 1)
+        self.assertEqual(stats['next_free_reserve_datetime'], later_reserve.reserve_datetime)
+        self.assertStatsMatchRebuild()
+
+        later_reserve.delete()
+        self.assertIsNone(self.get_stats()['next_free_reserve_datetime'])
+        self.assertStatsMatchRebuild()
+
+    def test_stale_next_free_reserve_is_looked_up_without_writing(self):
+        now = datetime.now(tz=TEHRAN_TZ)
+        next_reserve = ReserveFactory(doctor=self.doctor, patient=None, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=1))
+        DoctorStats.objects.filter(doctor=self.doctor).update(next_free_reserve_datetime=now - timedelta(hours=1))
+        stats = DoctorStats.objects.get(doctor=self.doctor)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(stats.get_next_free_reserve_datetime(), next_reserve.reserve_datetime)
+            self.assertEqual(stats.get_next_free_reserve_datetime(), next_reserve.reserve_datetime)
+        self.assertEqual([query['sql'].split()[0] for query in context.captured_queries], ['SELECT'])
+        self.assertEqual(self.get_stats()['next_free_reserve_datetime'], now - timedelta(hours=1))
+
+        refresh_next_free_reserves([self.doctor.id])
+        self.assertEqual(self.get_stats()['next_free_reserve_datetime'], next_reserve.reserve_datetime)
+
+
+class DoctorViewSetClockTests(TestCase):
+
+    def setUp(self):
+        PatientFactory()
+        self.doctor = DoctorFactory()
+        self.now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+        self.first_reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=self.now + timedelta(hours=1))
+        self.second_reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=self.now + timedelta(hours=3))
+
+    def get_closest_free_reserves(self, now):
+        frozen_datetime = mock.Mock(wraps=datetime)
+        frozen_datetime.now.return_value = now
+
+        with mock.patch('online_reservation.views.datetime', frozen_datetime):
+            response = self.client.get(reverse('online_reservation:doctor-list'), {'has_free_reserve': True})
+            view = response.renderer_context['view']
+            queryset = view.filter_queryset(view.get_queryset())
+
+        self.assertEqual(response.status_code, 200)
+        return [doctor.closest_free_reserve for doctor in queryset]
+
+    def test_closest_free_reserve_follows_the_clock(self):
+        self.assertEqual(self.get_closest_free_reserves(self.now), [self.first_reserve.reserve_datetime])
+        self.assertEqual(self.get_closest_free_reserves(self.now + timedelta(hours=2)), [self.second_reserve.reserve_datetime])
+        self.assertEqual(self.get_closest_free_reserves(self.now + timedelta(hours=4)), [])
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.patient = PatientFactory()
+        doctors = [DoctorFactory(), DoctorFactory()]
+        admin = get_user_model().objects.create_superuser(phone='09999999999', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+        reserve_datetime = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0) + timedelta(days=1)
+        for index in range(12):
+            # Pairs of reserves of two doctors share a datetime so ties must be broken by id
+            ReserveFactory(doctor=doctors[index % 2], patient=self.patient, reserve_datetime=reserve_datetime + timedelta(minutes=index // 2))
+        self.url = reverse('online_reservation:patient-reserves-list', kwargs={'patient_pk': self.patient.id})
+
+    def test_cursor_pages_follow_keyset_ordering(self):
+        expected_ids = list(Reserve.objects.filter(patient=self.patient).order_by('-reserve_datetime', '-id').values_list('id', flat=True))
+
+        response = self.client.get(self.url, {'pagination': 'cursor', 'limit': 5}).json()
+        self.assertEqual(response['total_items'], 12)
+        self.assertIsNone(response['previous'])
+
+        pages = [response]
+        while pages[-1]['next']:
+            pages.append(self.client.get(pages[-1]['next']).json())
+
+        self.assertEqual([len(page['results']) for page in pages], [5, 5, 2])
+        self.assertEqual([reserve['id'] for page in pages for reserve in page['results']], expected_ids)
+
+        previous_page = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(previous_page['results'], pages[1]['results'])
+
+    def test_pages_without_count(self):
+        response = self.client.get(self.url, {'count': 'false', 'limit': 10}).json()
+        self.assertNotIn('total_items', response)
+        self.assertEqual(response['count_items_current_page'], 10)
+        self.assertIsNotNone(response['next'])
+
+        response = self.client.get(response['next']).json()
+        self.assertEqual(response['count_items_current_page'], 2)
+        self.assertIsNone(response['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, 404)
+
+
+class CachedCountPaginationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        PatientFactory()
+        self.doctor = DoctorFactory()
+        admin = get_user_model().objects.create_superuser(phone='09999999999', password='password')
+        self.client = APIClient()
+        self.client.force_authenticate(admin)
+
+        for _ in range(3):
+            ReserveFactory(doctor=self.doctor)
+        self.url = reverse('online_reservation:doctor-reserves-list', kwargs={'doctor_pk': self.doctor.id})
+
+    def test_count_is_cached_per_filters(self):
+        response = self.client.get(self.url).json()
+        self.assertEqual(response['total_items'], 3)
+        self.assertTrue(response['is_count_exact'])
+
+        ReserveFactory(doctor=self.doctor)
+        self.assertEqual(self.client.get(self.url, {'offset': 2}).json()['total_items'], 3)
+        self.assertEqual(self.client.get(self.url, {'status': Reserve.RESERVE_STATUS_PAID}).json()['total_items'],
+                         Reserve.objects.filter(doctor=self.doctor, status=Reserve.RESERVE_STATUS_PAID).count())
+
+        cache.clear()
+        self.assertEqual(self.client.get(self.url).json()['total_items'], 4)
+
+
+class ReserveIndexUsageTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = PatientFactory()
+        cls.doctor = DoctorFactory()
+        cls.now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+
+        reserves = []
+        for doctor in [cls.doctor, *[DoctorFactory() for _ in range(4)]]:
+            for index in range(200):
+                is_taken = index % 3 == 0
+                reserves.append(Reserve(
+                    doctor=doctor,
+                    patient=cls.patient if is_taken else None,
+                    status=Reserve.RESERVE_STATUS_PAID if is_taken else Reserve.RESERVE_STATUS_UNPAID,
+                    price=10000,
+                    reserve_datetime=cls.now + timedelta(minutes=15 * (index - 100)),
+                    zarinpal_authority=f'A{doctor.id:05d}{index:05d}' if is_taken else ''
+                ))
+        Reserve.objects.bulk_create(reserves)
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('ANALYZE online_reservation_reserve')
+                # The seeded table is small enough for a sequential scan to win, only index usability is asserted here
+                cursor.execute('SET LOCAL enable_seqscan = off')
+            else:
+                cursor.execute('ANALYZE')
+
+    def assertUsesIndex(self, queryset, index_name):
+        self.assertIn(index_name, queryset.explain())
+
+    def test_free_reserves_of_doctor(self):
+        queryset = Reserve.objects.filter(doctor=self.doctor, reserve_datetime__gte=self.now, patient__isnull=True).order_by('reserve_datetime')
+        self.assertUsesIndex(queryset, 'reserve_free_doctor_dt_idx')
+
+    def test_reserves_of_patient(self):
+        queryset = Reserve.objects.filter(patient=self.patient, reserve_datetime__gte=self.now)
+        self.assertUsesIndex(queryset, 'reserve_patient_dt_idx')
+
+    def test_reserve_of_doctor_at_datetime(self):
+        queryset = Reserve.objects.filter(doctor=self.doctor, reserve_datetime=self.now)
+        # SQLite backs unique constraints with an automatically named index
+        index_name = 'reserve_unique_doctor_reserve_datetime' if connection.vendor == 'postgresql' else 'sqlite_autoindex_online_reservation_reserve'
+        self.assertUsesIndex(queryset, index_name)
+
+    def test_duplicate_reserve_is_rejected(self):
+        province = Province.objects.create(name='Tehran')
+        self.doctor.province = province
+        self.doctor.city = City.objects.create(name='Tehran', province=province)
+        self.doctor.save()
+
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.create_superuser(phone='09999999999', password='password'))
+        url = reverse('online_reservation:doctor-reserves-list', kwargs={'doctor_pk': self.doctor.id})
+        response = client.post(url, {'price': 10000, 'reserve_datetime': (self.now + timedelta(minutes=15 * 50)).strftime('%Y-%m-%d %H:%M')})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("A doctor can't have two or more reserves at the same time", response.json()['detail'][0])
+
+
+class FakeDataGeneratorTests(TestCase):
+    counts = {'insurances': 3, 'specialties': 4, 'patients': 10, 'doctors': 5, 'reserves': 60, 'comments': 30}
+
+    def generate(self, seed):
+        FakeDataGenerator(seed=seed, log=lambda message: None).generate(**self.counts)
+        return (
+            list(Patient.objects.order_by('national_code').values_list('national_code', 'first_name', 'last_name', 'birth_date')),
+            list(Reserve.objects.order_by('doctor__national_code', 'reserve_datetime').values_list('doctor__national_code', 'reserve_datetime', 'status', 'price')),
+            list(Comment.objects.order_by('id').values_list('doctor__national_code', 'patient__national_code', 'rating', 'status'))
+        )
+
+    def test_same_seed_gives_same_data(self):
+        data = self.generate(seed=7)
+        self.assertEqual(data, self.generate(seed=7))
+        self.assertNotEqual(data, self.generate(seed=8))
+
+        self.assertEqual(Patient.objects.count(), self.counts['patients'] + self.counts['doctors'])
+        self.assertEqual(DoctorStats.objects.count(), self.counts['doctors'])
+        self.assertEqual(Reserve.objects.count(), self.counts['reserves'])
+
+    def test_generating_again_deletes_the_rows_added_meanwhile(self):
+        self.generate(seed=7)
+        ScheduleTemplate.objects.create(doctor=Doctor.objects.first(), weekdays=[0], start_time=time(9), end_time=time(10), price=10000)
+        reserve = Reserve.objects.first()
+        ReservePayment.objects.create(reserve=reserve, patient=Patient.objects.first(), authority='A1', amount=reserve.price)
+
+        self.generate(seed=7)
+        self.assertFalse(ScheduleTemplate.objects.exists())
+        self.assertFalse(ReservePayment.objects.exists())
+        connection.check_constraints()
+
+
+class BenchmarkTests(TestCase):
+
+    def test_query_stats_count_queries_and_rows(self):
+        PatientFactory()
+        for _ in range(3):
+            DoctorFactory()
+
+        with QueryStats() as query_stats:
+            list(get_user_model().objects.all())
+            get_user_model().objects.count()
+
+        self.assertEqual(query_stats.queries, 2)
+        self.assertEqual(query_stats.rows, 4 + 1)
+
+    def test_regressions_against_baseline(self):
+        baseline = {'GET route': {'status_code': 200, 'queries': 3, 'p95_ms': 10}}
+
+        self.assertEqual(compare_with_baseline({'GET route': {'status_code': 200, 'queries': 3, 'p95_ms': 11.5}}, baseline), [])
+        self.assertEqual(compare_with_baseline({'GET new route': {'status_code': 200, 'queries': 30, 'p95_ms': 100}}, baseline), [])
+        self.assertEqual(
+            compare_with_baseline({'GET route': {'status_code': 403, 'queries': 4, 'p95_ms': 20}}, baseline),
+            ['GET route: status code 200 -> 403', 'GET route: queries 3 -> 4', 'GET route: p95 latency 10ms -> 20ms']
+        )
+
+
+class MetricsTests(TestCase):
+
+    def get_sample_value(self, name, labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_request_metrics_by_route(self):
+        labels = {'view': 'online_reservation:doctor-list', 'method': 'GET'}
+        requests_count = self.get_sample_value('django_http_request_db_queries_count', labels)
+        queries_sum = self.get_sample_value('django_http_request_db_queries_sum', labels)
+
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('online_reservation:doctor-list'))
+
+        self.assertEqual(self.get_sample_value('django_http_request_db_queries_count', labels), requests_count + 1)
+        self.assertEqual(self.get_sample_value('django_http_request_db_queries_sum', labels), queries_sum + len(context.captured_queries))
+        self.assertEqual(self.get_sample_value('django_http_requests_in_flight', {}), 0)
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('django_http_request_duration_seconds_bucket{le="0.01",method="GET",status="200",view="online_reservation:doctor-list"}',
+                      response.content.decode())
+
+    def test_metrics_are_served_only_to_scrapers(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 404)
+
+        with self.settings(METRICS_BEARER_TOKEN='scraper-token'):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', headers={'Authorization': 'Bearer wrong'}).status_code, 404)
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7', headers={'Authorization': 'Bearer scraper-token'}).status_code, 200)
+
+    def test_task_duration(self):
+        labels = {'task': manage_patient_after_end_of_reserve_purchase_time.name, 'state': 'SUCCESS'}
+        tasks_count = self.get_sample_value('celery_task_duration_seconds_count', labels)
+
+        manage_patient_after_end_of_reserve_purchase_time.apply(args=(0, ))
+
+        self.assertEqual(self.get_sample_value('celery_task_duration_seconds_count', labels), tasks_count + 1)
+
+
+class ReleaseExpiredReserveHoldsTests(TestCase):
+
+    def test_only_expired_unpaid_holds_are_released(self):
+        patient = PatientFactory()
+        doctor = DoctorFactory()
+        now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+
+        def hold(minutes, status=Reserve.RESERVE_STATUS_UNPAID, expires_in=-1):
+            return ReserveFactory(doctor=doctor, patient=patient, status=status, reserve_datetime=now + timedelta(minutes=minutes),
+                                  celery_payment_expiration_datetime=now + timedelta(minutes=expires_in))
+
+        expired_holds = [hold(60), hold(75)]
+        active_hold = hold(90, expires_in=10)
+        paid_reserve = hold(105, status=Reserve.RESERVE_STATUS_PAID)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(release_expired_reserve_holds(), '2 expired holds were released.')
+
+        self.assertFalse(Reserve.objects.filter(id__in=[reserve.id for reserve in expired_holds], patient__isnull=False).exists())
+        self.assertEqual(Reserve.objects.filter(id__in=[active_hold.id, paid_reserve.id], patient=patient).count(), 2)
+        self.assertEqual(DoctorStats.objects.get(doctor=doctor).next_free_reserve_datetime, expired_holds[0].reserve_datetime)
+        self.assertEqual(release_expired_reserve_holds(), '0 expired holds were released.')
+
+    def test_unpaid_past_reserves_are_released(self):
+        patient = PatientFactory()
+        doctor = DoctorFactory()
+        now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+
+        past_reserve = ReserveFactory(doctor=doctor, patient=patient, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now - timedelta(hours=1))
+        paid_past_reserve = ReserveFactory(doctor=doctor, patient=patient, status=Reserve.RESERVE_STATUS_PAID, reserve_datetime=now - timedelta(hours=2))
+        future_reserve = ReserveFactory(doctor=doctor, patient=patient, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(hours=1))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(release_unpaid_past_reserves(), '1 unpaid past reserves were released.')
+
+        self.assertEqual(list(Reserve.objects.filter(patient=patient).order_by('id')), [paid_past_reserve, future_reserve])
+        self.assertEqual(PeriodicTask.objects.count(), 0)
+
+    def test_delete_reserve_periodic_tasks(self):
+        clocked_schedule = ClockedSchedule.objects.create(clocked_time=datetime.now(tz=TEHRAN_TZ))
+        for reserve_id in range(3):
+            PeriodicTask.objects.create(name=f'task-for-object-{reserve_id}', task='online_reservation.tasks.remove_patient_from_reserve_after_expired',
+                                        clocked=clocked_schedule, args=f'[{reserve_id}]', one_off=True)
+        PeriodicTask.objects.create(name='other', task='other', clocked=ClockedSchedule.objects.create(clocked_time=datetime.now(tz=TEHRAN_TZ)), one_off=True)
+
+        out = StringIO()
+        call_command('delete_reserve_periodic_tasks', stdout=out)
+
+        self.assertIn('3 periodic tasks were deleted.', out.getvalue())
+        self.assertEqual(list(PeriodicTask.objects.values_list('name', flat=True)), ['other'])
+        self.assertEqual(ClockedSchedule.objects.count(), 1)
+
+
+class HoldReserveTests(TestCase):
+
+    def setUp(self):
+        self.patient = PatientFactory()
+        self.other_patient = PatientFactory()
+        self.doctor = DoctorFactory()
+        now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+        self.reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=1))
+        self.next_reserve = ReserveFactory(doctor=self.doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=2))
+
+    def test_hold_releases_previous_hold(self):
+        self.assertEqual(hold_reserve(Reserve.objects.get(id=self.reserve.id), self.patient), HOLD_CLAIMED)
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).next_free_reserve_datetime, self.next_reserve.reserve_datetime)
+        self.assertEqual(hold_reserve(Reserve.objects.get(id=self.reserve.id), self.patient), HOLD_ALREADY_HELD)
+        self.assertEqual(hold_reserve(Reserve.objects.get(id=self.reserve.id), self.other_patient), HOLD_CONFLICT)
+
+        self.assertEqual(hold_reserve(Reserve.objects.get(id=self.next_reserve.id), self.patient), HOLD_CLAIMED)
+        self.assertEqual(list(Reserve.objects.filter(patient=self.patient)), [self.next_reserve])
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).next_free_reserve_datetime, self.reserve.reserve_datetime)
+
+    def capture_statements(self, function, *args):
+        with CaptureQueriesContext(connection) as context:
+            result = function(*args)
+        # The savepoints of the transaction aren't statements of the hold
+        return result, [query['sql'] for query in context.captured_queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE SAVEPOINT'))]
+
+    def test_hold_statements(self):
+        other_doctor = DoctorFactory()
+        other_reserve = ReserveFactory(doctor=other_doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=self.reserve.reserve_datetime)
+        hold_reserve(Reserve.objects.get(id=other_reserve.id), self.patient)
+        self.assertIsNone(DoctorStats.objects.get(doctor=other_doctor).next_free_reserve_datetime)
+
+        # Claim with the release, and refresh of the stats
+        result, statements = self.capture_statements(hold_reserve, Reserve.objects.get(id=self.reserve.id), self.patient)
+        self.assertEqual(result, HOLD_CLAIMED)
+        self.assertEqual([statement.split()[0] for statement in statements], ['UPDATE', 'UPDATE'])
+
+        self.assertEqual(list(Reserve.objects.filter(patient=self.patient)), [self.reserve])
+        self.assertEqual(DoctorStats.objects.get(doctor=other_doctor).next_free_reserve_datetime, other_reserve.reserve_datetime)
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).next_free_reserve_datetime, self.next_reserve.reserve_datetime)
+
+        # Failed claim and read of the holder
+        result, statements = self.capture_statements(hold_reserve, Reserve.objects.get(id=self.reserve.id), self.other_patient)
+        self.assertEqual(result, HOLD_CONFLICT)
+        self.assertEqual([statement.split()[0] for statement in statements], ['UPDATE', 'SELECT'])
+
+    def test_release_is_undone_when_the_claim_fails(self):
+        hold_reserve(self.next_reserve, self.patient)
+        hold_reserve(Reserve.objects.get(id=self.reserve.id), self.other_patient)
+
+        def release_without_claim(reserve, patient, *args):
+            # What another patient claiming the reserve during the update leads to
+            Reserve.objects.filter(id=self.next_reserve.id).update(patient=None)
+            return {self.next_reserve.id: self.doctor.id}
+
+        with mock.patch('online_reservation.booking.claim_and_release_reserves', release_without_claim):
+            self.assertEqual(hold_reserve(Reserve.objects.get(id=self.reserve.id), self.patient), HOLD_CONFLICT)
+        self.assertEqual(Reserve.objects.get(id=self.next_reserve.id).patient_id, self.patient.id)
+
+    def test_hold_or_raise(self):
+        self.assertEqual(hold_reserve_or_raise(self.reserve, self.patient), HOLD_CLAIMED)
+        with self.assertRaises(ReserveTakenError):
+            hold_reserve_or_raise(Reserve.objects.get(id=self.reserve.id), self.other_patient)
+
+    def test_payment_of_reserve_held_by_another_patient_is_a_conflict(self):
+        hold_reserve(self.reserve, self.other_patient)
+
+        province = Province.objects.create(name='Tehran')
+        Patient.objects.filter(id=self.patient.id).update(
+            province=province, city=City.objects.create(name='Tehran', province=province), gender=Patient.PERSON_GENDER_MALE
+        )
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.get(id=self.patient.user_id))
+        response = client.get(reverse('online_reservation:payment-process-sandbox'), {'reserve_id': self.reserve.id})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Reserve.objects.get(id=self.reserve.id).patient_id, self.other_patient.id)
+
+
+class HoldReserveConcurrencyTests(TransactionTestCase):
+    thread_count = 8
+    round_count = 10
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite's shared in-memory database fails concurrent writes instead of waiting for them")
+
+    def hold_concurrently(self, reserve_id, patients):
+        barrier = threading.Barrier(len(patients))
+
+        def hold(patient):
+            try:
+                barrier.wait()
+                return hold_reserve(Reserve.objects.get(id=reserve_id), patient)
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=len(patients)) as executor:
+            return list(executor.map(hold, patients))
+
+    def test_reserve_is_never_held_twice(self):
+        PatientFactory()
+        doctor = DoctorFactory()
+        patients = [PatientFactory() for _ in range(self.thread_count)]
+        now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+
+        for round_number in range(self.round_count):
+            reserve = ReserveFactory(doctor=doctor, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=1, minutes=15 * round_number))
+            results = self.hold_concurrently(reserve.id, patients)
+
+            self.assertEqual(results.count(HOLD_CLAIMED), 1)
+            self.assertEqual(results.count(HOLD_CONFLICT), self.thread_count - 1)
+            winner = patients[results.index(HOLD_CLAIMED)]
+            self.assertEqual(Reserve.objects.get(id=reserve.id).patient_id, winner.id)
+            # Winning a new reserve releases the previous one, so each patient holds at most one
+            self.assertFalse(Reserve.objects.values('patient').filter(patient__isnull=False).annotate(count=Count('id')).filter(count__gt=1).exists())
+
+
+class ScheduleTemplateTests(TestCase):
+
+    def setUp(self):
+        PatientFactory()
+        self.doctor = DoctorFactory(office_address='Tehran')
+        province = Province.objects.create(name='Tehran')
+        Doctor.objects.filter(id=self.doctor.id).update(province=province, city=City.objects.create(name='Tehran', province=province))
+
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.get(id=self.doctor.user_id))
+        self.start_date = date.today() + timedelta(days=7)
+
+    def test_slots_of_template(self):
+        template = ScheduleTemplate(weekdays=[self.start_date.weekday()], start_time=time(9), end_time=time(10, 10), slot_minutes=20, price=10000)
+        slot_datetimes = template.get_slot_datetimes(self.start_date, self.start_date + timedelta(days=7))
+
+        self.assertEqual([slot_datetime.strftime('%Y-%m-%d %H:%M') for slot_datetime in slot_datetimes], [
+            f'{day} {slot_time}'
+            for day in [self.start_date, self.start_date + timedelta(days=7)]
+            for slot_time in ['09:00', '09:20', '09:40']
+        ])
+
+    def test_template_model_rejects_what_the_api_rejects(self):
+        template = ScheduleTemplate(doctor=self.doctor, weekdays=[0, 7], start_time=time(9), end_time=time(10), slot_minutes=0, price=10000)
+        with self.assertRaises(ValidationError) as context:
+            template.full_clean()
+        self.assertEqual(set(context.exception.message_dict), {'weekdays', 'slot_minutes'})
+
+        template.weekdays, template.slot_minutes, template.end_time = [0], 15, time(9)
+        with self.assertRaises(ValidationError):
+            template.full_clean()
+
+        # Saved without the validation, as bulk writes do
+        template.slot_minutes = 0
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            template.save()
+
+    def test_create_reserves_from_template(self):
+        response = self.client.post(reverse('online_reservation:doctor-schedule-templates-list', kwargs={'doctor_pk': 'me'}),
+                                    {'weekdays': [0, 1, 2, 3, 4, 5, 6], 'start_time': '09:00', 'end_time': '10:00', 'price': 10000}, format='json')
+        self.assertEqual(response.status_code, 201)
+        template_id = response.json()['id']
+
+        ReserveFactory(doctor=self.doctor, reserve_datetime=datetime.combine(self.start_date, time(9, 15), tzinfo=TEHRAN_TZ))
+        url = reverse('online_reservation:doctor-schedule-templates-create-reserves', kwargs={'doctor_pk': 'me', 'pk': template_id})
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url, {'start_date': self.start_date, 'end_date': self.start_date + timedelta(days=6)}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created_count'], 7 * 4 - 1)
+        self.assertEqual(response.json()['skipped'], [{'reserve_datetime': f'{self.start_date} 09:15', 'reason': 'exists'}])
+        reserve_table = Reserve._meta.db_table
+        self.assertEqual(len([query for query in context.captured_queries if query['sql'].startswith('INSERT') and f'"{reserve_table}"' in query['sql'].split('(')[0]]), 1)
+
+        self.assertEqual(Reserve.objects.filter(doctor=self.doctor).count(), 7 * 4)
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).next_free_reserve_datetime,
+                         datetime.combine(self.start_date, time(9), tzinfo=TEHRAN_TZ))
+
+        response = self.client.post(url, {'start_date': self.start_date, 'end_date': self.start_date}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['skipped_count'], 4)
+
+    def test_reserves_added_during_the_insert_are_reported_as_skipped(self):
+        template = ScheduleTemplate.objects.create(doctor=self.doctor, weekdays=[self.start_date.weekday()],
+                                                   start_time=time(9), end_time=time(9, 30), slot_minutes=15, price=10000)
+        url = reverse('online_reservation:doctor-schedule-templates-create-reserves', kwargs={'doctor_pk': 'me', 'pk': template.id})
+
+        def insert_reserves_after_others(reserves):
+            # The slots are taken after the lookup of the existing reserves, the insert skips them
+            ReserveFactory(doctor=self.doctor, reserve_datetime=reserves[0].reserve_datetime)
+            return insert_reserves(reserves)
+
+        with mock.patch('online_reservation.schedules.insert_reserves', side_effect=insert_reserves_after_others):
+            response = self.client.post(url, {'start_date': self.start_date, 'end_date': self.start_date}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], [f'{self.start_date} 09:15'])
+        self.assertEqual(response.json()['skipped'], [{'reserve_datetime': f'{self.start_date} 09:00', 'reason': 'exists'}])
+        self.assertEqual(Reserve.objects.filter(doctor=self.doctor).count(), 2)
+
+
+class AppointmentCalendarTests(TestCase):
+
+    def setUp(self):
+        self.patient = PatientFactory()
+        self.doctor = DoctorFactory()
+        self.client = APIClient()
+        self.first_date = datetime.now(tz=TEHRAN_TZ).date() + timedelta(days=2)
+
+        for day, slot_times, taken_count in [(0, [time(0, 15), time(9), time(23, 45)], 1), (3, [time(10), time(10, 30)], 2)]:
+            for index, slot_time in enumerate(slot_times):
+                ReserveFactory(
+                    doctor=self.doctor,
+                    patient=self.patient if index < taken_count else None,
+                    reserve_datetime=datetime.combine(self.first_date + timedelta(days=day), slot_time, tzinfo=TEHRAN_TZ)
+                )
+
+    def test_calendar_counts_slots_per_tehran_day(self):
+        url = reverse('online_reservation:appointment-calendar', kwargs={'pk': self.doctor.id})
+
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'start_date': self.first_date, 'end_date': self.first_date + timedelta(days=6)})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['days'], [
+            {'date': str(self.first_date), 'free_count': 2, 'taken_count': 1},
+            {'date': str(self.first_date + timedelta(days=3)), 'free_count': 0, 'taken_count': 2}
+        ])
+
+        response = self.client.get(url, {'start_date': self.first_date + timedelta(days=1), 'end_date': self.first_date + timedelta(days=2)})
+        self.assertEqual(response.json()['days'], [])
+
+    def test_calendar_range_is_validated(self):
+        url = reverse('online_reservation:appointment-calendar', kwargs={'pk': self.doctor.id})
+
+        self.assertEqual(self.client.get(url, {'start_date': self.first_date - timedelta(days=3)}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start_date': self.first_date, 'end_date': self.first_date - timedelta(days=1)}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'start_date': self.first_date, 'end_date': self.first_date + timedelta(days=100)}).status_code, 400)
+
+
+class DoctorResponseCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        PatientFactory()
+        self.doctor = DoctorFactory(status=Doctor.DOCTOR_STATUS_ACCEPTED)
+        self.client = APIClient()
+        self.list_url = reverse('online_reservation:doctor-list')
+
+    def get_cache_requests(self, result):
+        return REGISTRY.get_sample_value('django_response_cache_requests_total', {'view': 'DoctorViewSet', 'action': 'list', 'result': result}) or 0
+
+    def test_list_is_cached_per_normalized_query_params(self):
+        hits, misses = self.get_cache_requests('hit'), self.get_cache_requests('miss')
+
+        response = self.client.get(self.list_url, {'limit': 5, 'offset': 0})
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(f'{self.list_url}?offset=0&limit=5')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(response.json()['results'][0]['id'], self.doctor.id)
+
+        self.assertEqual(self.client.get(self.list_url, {'limit': 6})['X-Cache'], 'MISS')
+        self.assertEqual((self.get_cache_requests('hit') - hits, self.get_cache_requests('miss') - misses), (1, 2))
+
+    def test_saves_invalidate_cached_responses(self):
+        detail_url = reverse('online_reservation:doctor-detail', kwargs={'pk': self.doctor.id})
+        self.client.get(detail_url)
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'HIT')
+
+        reserve = ReserveFactory(doctor=self.doctor, patient=None, reserve_datetime=datetime.now(tz=TEHRAN_TZ) + timedelta(days=1))
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'MISS')
+
+        # Bulk changes don't send signals, they invalidate through the stats refresh
+        hold_reserve(reserve, Patient.objects.first())
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'MISS')
+
+    def test_changes_invalidate_only_the_responses_that_show_them(self):
+        other_doctor = DoctorFactory(status=Doctor.DOCTOR_STATUS_ACCEPTED)
+        now = datetime.now(tz=TEHRAN_TZ)
+        ReserveFactory(doctor=self.doctor, patient=None, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=1))
+        urls = [self.list_url] + [reverse('online_reservation:doctor-detail', kwargs={'pk': doctor.id}) for doctor in [self.doctor, other_doctor]]
+
+        def get_cache_results():
+            return [self.client.get(url)['X-Cache'] for url in urls]
+
+        get_cache_results()
+        # A slot after the next free one and a comment waiting for approval aren't shown
+        ReserveFactory(doctor=self.doctor, patient=None, status=Reserve.RESERVE_STATUS_UNPAID, reserve_datetime=now + timedelta(days=2))
+        comment = CommentFactory(doctor=self.doctor, patient=Patient.objects.first(), status=Comment.COMMENT_STATUS_WAITING)
+        self.assertEqual(get_cache_results(), ['HIT', 'HIT', 'HIT'])
+
+        comment.status = Comment.COMMENT_STATUS_APPROVED
+        comment.save()
+        self.assertEqual(get_cache_results(), ['MISS', 'MISS', 'HIT'])
+
+        # The body of a comment is only shown in the detail
+        comment.body = 'Edited'
+        comment.save()
+        self.assertEqual(get_cache_results(), ['HIT', 'MISS', 'HIT'])
+
+
+class DoctorAlternativeTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        PatientFactory()
+        province = Province.objects.create(name='Tehran')
+        self.city = City.objects.create(name='Tehran', province=province)
+        other_city = City.objects.create(name='Karaj', province=province)
+        self.specialty, other_specialty = Specialty.objects.create(name='Heart'), Specialty.objects.create(name='Skin')
+        now = datetime.now(tz=TEHRAN_TZ).replace(second=0, microsecond=0)
+
+        self.doctor = self.create_doctor(self.city, [self.specialty, other_specialty])
+        self.alternative_doctors = []
+        for hours in range(1, 8):
+            alternative_doctor = self.create_doctor(self.city, [self.specialty, other_specialty] if hours == 1 else [self.specialty])
+            ReserveFactory(doctor=alternative_doctor, patient=None, reserve_datetime=now + timedelta(hours=hours))
+            self.alternative_doctors.append(alternative_doctor)
+
+        far_doctor = self.create_doctor(other_city, [self.specialty])
+        ReserveFactory(doctor=far_doctor, patient=None, reserve_datetime=now + timedelta(minutes=30))
+
+    def create_doctor(self, city, specialties):
+        doctor = DoctorFactory(city=city, province=city.province)
+        for specialty in specialties:
+            DoctorSpecialty.objects.create(doctor=doctor, specialty=specialty)
+        return doctor
+
+    def test_alternatives_come_from_the_index(self):
+        refresh_alternative_doctors()
+        self.assertEqual(DoctorAlternative.objects.filter(specialty=self.specialty, city=self.city).count(), ALTERNATIVE_DOCTORS_COUNT + 1)
+
+        doctor = Doctor.objects.select_related('stats', 'city').prefetch_related('specialties').get(id=self.doctor.id)
+        with self.assertNumQueries(2):
+            alternatives = DoctorDetailSerializer().get_alternative_doctors(doctor)
+
+        self.assertEqual([alternative['id'] for alternative in alternatives], [doctor.id for doctor in self.alternative_doctors[:ALTERNATIVE_DOCTORS_COUNT]])
+
+    def test_doctor_with_free_reserve_has_no_alternatives(self):
+        refresh_alternative_doctors()
+        response = self.client.get(reverse('online_reservation:doctor-detail', kwargs={'pk': self.alternative_doctors[0].id}))
+        self.assertEqual(response.json()['alternative_doctors'], [])
+
+        response = self.client.get(reverse('online_reservation:doctor-detail', kwargs={'pk': self.doctor.id}))
+        self.assertEqual(len(response.json()['alternative_doctors']), ALTERNATIVE_DOCTORS_COUNT)
+
+    def test_refresh_writes_and_invalidates_only_changed_alternatives(self):
+        detail_url = reverse('online_reservation:doctor-detail', kwargs={'pk': self.doctor.id})
+        self.assertGreater(refresh_doctor_alternatives(), 0)
+        alternative_ids = set(DoctorAlternative.objects.values_list('id', flat=True))
+        self.client.get(detail_url)
+
+        self.assertEqual(refresh_doctor_alternatives(), 0)
+        self.assertEqual(set(DoctorAlternative.objects.values_list('id', flat=True)), alternative_ids)
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'HIT')
+
+        # The first alternative has no free reserve left
+        hold_reserve(Reserve.objects.get(doctor=self.alternative_doctors[0]), Patient.objects.first())
+        self.assertEqual(self.client.get(detail_url)['X-Cache'], 'HIT')
+        # It leaves both of its specialties and the next doctor joins the first one
+        self.assertEqual(refresh_doctor_alternatives(), 3)
+
+        response = self.client.get(detail_url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([alternative['id'] for alternative in response.json()['alternative_doctors']],
+                         [doctor.id for doctor in self.alternative_doctors[1:ALTERNATIVE_DOCTORS_COUNT + 1]])
+
+
+class DoctorSearchTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        PatientFactory()
+        self.cardiologist = DoctorFactory(last_name='Rostami', bio='Heart surgeon')
+        DoctorSpecialty.objects.create(doctor=self.cardiologist, specialty=Specialty.objects.create(name='Cardiology'))
+        self.dermatologist = DoctorFactory(last_name='Karimi', office_address='Valiasr street')
+        DoctorSpecialty.objects.create(doctor=self.dermatologist, specialty=Specialty.objects.create(name='Dermatology'))
+        self.url = reverse('online_reservation:doctor-list')
+
+    def search(self, text):
+        response = self.client.get(self.url, {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [doctor['id'] for doctor in response.json()['results']]
+
+    def test_search_covers_name_specialty_bio_and_address(self):
+        self.assertEqual(self.search('Rostami'), [self.cardiologist.id])
+        self.assertEqual(self.search('Cardiology'), [self.cardiologist.id])
+        self.assertEqual(self.search('surgeon'), [self.cardiologist.id])
+        self.assertEqual(self.search('Valiasr'), [self.dermatologist.id])
+        self.assertEqual(self.search('Neurology'), [])
+
+    def test_search_follows_specialty_changes(self):
+        DoctorSpecialty.objects.create(doctor=self.dermatologist, specialty=Specialty.objects.create(name='Neurology'))
+        self.assertEqual(self.search('Neurology'), [self.dermatologist.id])
+
+        specialty = Specialty.objects.get(name='Neurology')
+        specialty.name = 'Psychiatry'
+        specialty.save()
+        self.assertEqual(self.search('Psychiatry'), [self.dermatologist.id])
+
+
+class ORJSONRendererTests(TestCase):
+
+    def test_output_is_the_same_as_json_renderer(self):
+        data = {
+            'datetime': datetime(2024, 5, 1, 10, 30, 15, 123456, tzinfo=timezone.utc),
+            'tehran_datetime': datetime(2024, 5, 1, 14, 0, tzinfo=TEHRAN_TZ),
+            'date': date(2024, 5, 1),
+            'time': time(9, 15, 0, 500000),
+            'price': Decimal('12.50'),
+            'lazy': gettext_lazy('Today'),
+            'uuid': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+            'persian': 'دکتر رستمی\u2028',
+            1: [None, True, 1.5, (1, 2)],
+        }
+
+        self.assertEqual(ORJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(ORJSONRenderer().render(data, 'application/json; indent=4'), JSONRenderer().render(data, 'application/json; indent=4'))
+
+    def test_parser_rejects_invalid_json(self):
+        self.assertEqual(ORJSONParser().parse(BytesIO('{"name": "رستمی", "ids": [1, 2]}'.encode())), {'name': 'رستمی', 'ids': [1, 2]})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(BytesIO(b'{"price": NaN}'))
+
+
+class FastListSerializerTests(TestCase):
+
+    def setUp(self):
+        patient = PatientFactory()
+        province = Province.objects.create(name='Tehran')
+        now = datetime.now(tz=TEHRAN_TZ)
+
+        doctor = DoctorFactory(province=province, city=City.objects.create(name='Tehran', province=province), confirm_datetime=now)
+        DoctorSpecialty.objects.create(doctor=doctor, specialty=Specialty.objects.create(name='Cardiology'))
+        DoctorFactory(gender=Doctor.PERSON_GENDER_NOT_DEFINED)
+        ReserveFactory(doctor=doctor, patient=None, reserve_datetime=now + timedelta(hours=5))
+        ReserveFactory(doctor=doctor, patient=patient, status=Reserve.RESERVE_STATUS_PAID, reserve_datetime=now - timedelta(days=3))
+        CommentFactory(doctor=doctor, patient=patient, is_anonymous=True)
+        CommentFactory(doctor=doctor, patient=patient, is_anonymous=False)
+
+    def assertSameOutput(self, serializer_class, instances):
+        instances = list(instances)
+        fields_output = JSONRenderer().render(ListSerializer(instances, child=serializer_class()).data)
+        self.assertEqual(JSONRenderer().render(serializer_class(instances, many=True).data), fields_output)
+
+    def test_fast_path_output_is_the_same_as_the_fields(self):
+        self.assertSameOutput(DoctorSerializer, Doctor.objects.select_related('province', 'city', 'stats').prefetch_related('specialties__specialty', 'insurances'))
+        self.assertSameOutput(ReservePatientSerializer, Reserve.objects.select_related('doctor'))
+        self.assertSameOutput(CommentSerializer, Comment.objects.select_related('patient'))
+
+
+class CustomJWTAuthenticationTests(TestCase):
+
+    def setUp(self):
+        province = Province.objects.create(name='Tehran')
+        city = City.objects.create(name='Tehran', province=province)
+        self.patient = PatientFactory(gender=Patient.PERSON_GENDER_MALE, province=province, city=city)
+        self.doctor = DoctorFactory(status=Doctor.DOCTOR_STATUS_ACCEPTED)
+
+    def authenticate(self, user):
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return CustomJWTAuthentication().authenticate(request)
+
+    def test_patient_roles_are_checked_without_further_queries(self):
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(self.patient.user)
+
+        request = mock.Mock(user=user)
+        with self.assertNumQueries(0):
+            self.assertFalse(IsDoctor().has_permission(request, None))
+            self.assertTrue(IsDoctorOrPatient().has_permission(request, None))
+            self.assertTrue(IsPatientInfoComplete().has_permission(request, None))
+            self.assertEqual(UserDetailSerializer(user).data['role'], 'patient')
+
+    def test_doctor_roles_are_checked_without_further_queries(self):
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate(self.doctor.user)
+
+        request = mock.Mock(user=user)
+        with self.assertNumQueries(0):
+            self.assertTrue(IsDoctor().has_permission(request, None))
+            with self.assertRaises(PermissionDenied):
+                IsDoctorOrPatient().has_permission(request, None)
+            self.assertEqual(UserDetailSerializer(user).data['role'], 'doctor')
+
+    def test_inactive_user_is_rejected(self):
+        self.patient.user.is_active = False
+        self.patient.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(self.patient.user)
+
+
+class OTPStoreTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def assertVerifiedOnce(self, store):
+        otp = store.create('09123456789')
+
+        self.assertFalse(store.verify(otp.id, otp.phone, '0000' if otp.password != '0000' else '1111'))
+        self.assertFalse(store.verify(otp.id, '09123456788', otp.password))
+        self.assertTrue(store.verify(otp.id, otp.phone, otp.password))
+        self.assertFalse(store.verify(otp.id, otp.phone, otp.password))
+
+    def test_database_store_verifies_a_password_once(self):
+        self.assertVerifiedOnce(DatabaseOTPStore())
+        self.assertFalse(OTP.objects.exists())
+
+    def test_database_store_rejects_expired_password(self):
+        store = DatabaseOTPStore()
+        otp = store.create('09123456789')
+        OTP.objects.filter(id=otp.id).update(expired_datetime=datetime.now(tz=TEHRAN_TZ) - timedelta(seconds=1))
+
+        self.assertFalse(store.verify(otp.id, otp.phone, otp.password))
+
+    def test_redis_store_verifies_a_password_once(self):
+        if not settings.OTP_REDIS_URL:
+            self.skipTest('DJANGO_OTP_REDIS_URL is not set')
+
+        self.assertVerifiedOnce(RedisOTPStore())
+
+    def test_request_and_verify_otp(self):
+        client = APIClient()
+        request_id = client.post(reverse('core:otp'), {'phone': '09123456789'}, format='json').json()['request_id']
+        password = OTP.objects.get(id=request_id).password
+        data = {'request_id': request_id, 'phone': '09123456789', 'password': password}
+
+        response = client.post(reverse('core:otp-verify'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user_id'], get_user_model().objects.get(phone='09123456789').id)
+
+        response = client.post(reverse('core:otp-verify'), data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_purge_otps_command(self):
+        now = datetime.now(tz=TEHRAN_TZ)
+        OTP.objects.bulk_create([OTP(phone='09123456789', password='1234', expired_datetime=now - timedelta(minutes=index + 1)) for index in range(5)])
+        valid_otp = OTP.objects.create(phone='09123456789', password='1234')
+
+        call_command('purge_otps', batch_size=2, stdout=StringIO())
+        self.assertEqual(list(OTP.objects.all()), [valid_otp])
+
+        call_command('purge_otps', all=True, stdout=StringIO())
+        self.assertFalse(OTP.objects.exists())
+
+
+class ZarinpalClientTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeZarinpalServer(seed=1)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+    def pay(self, authority):
+        response = httpx.get(ZarinpalSandbox(base_url=self.server.url).generate_payment_page_url(authority))
+        self.assertEqual(response.status_code, 302)
+        return response.headers['Location']
+
+    def test_request_and_verify_payment(self):
+        zarinpal_sandbox = ZarinpalSandbox(base_url=self.server.url)
+        authority = zarinpal_sandbox.payment_request(10000, 'Reserve', 'http://testserver/callback/')['Authority']
+
+        self.assertEqual(zarinpal_sandbox.payment_verify(10000, authority)['Status'], STATUS_NOT_PAID)
+        self.pay(authority)
+        self.assertEqual(zarinpal_sandbox.payment_verify(5000, authority)['Status'], STATUS_AMOUNT_MISMATCH)
+        self.assertEqual(zarinpal_sandbox.payment_verify(10000, authority)['Status'], STATUS_SUCCESS)
+        self.assertEqual(zarinpal_sandbox.payment_verify(10000, authority)['Status'], STATUS_ALREADY_VERIFIED)
+
+    def test_failures_are_retried_then_raised(self):
+        self.server.failure_rate = 1
+
+        with self.assertRaises(PaymentGatewayError):
+            ZarinpalSandbox(base_url=self.server.url, retries=2, retry_backoff=0).payment_request(10000, 'Reserve', 'http://testserver/callback/')
+        self.assertEqual(self.server.request_count, 3)
+
+    def test_slow_gateway_times_out(self):
+        self.server.latency = 0.5
+
+        with self.settings(ZARINPAL_TIMEOUT=0.1):
+            client = httpx.Client(**get_zarinpal_client_options(self.server.url))
+        self.addCleanup(client.close)
+
+        with self.assertRaises(PaymentGatewayError):
+            ZarinpalSandbox(base_url=self.server.url, retries=0, client=client).payment_request(10000, 'Reserve', 'http://testserver/callback/')
+
+    def test_async_client(self):
+        authorities = [ZarinpalSandbox(base_url=self.server.url).payment_request(10000, 'Reserve', 'http://testserver/callback/')['Authority'] for _ in range(3)]
+        for authority in authorities:
+            self.pay(authority)
+
+        async def verify_all():
+            async with AsyncZarinpalSandbox(base_url=self.server.url) as zarinpal_sandbox:
+                return await asyncio.gather(*(zarinpal_sandbox.payment_verify(10000, authority) for authority in authorities))
+
+        self.assertEqual([data['Status'] for data in asyncio.run(verify_all())], [STATUS_SUCCESS] * 3)
+
+    def test_payment_through_the_views(self):
+        province = Province.objects.create(name='Tehran')
+        patient = PatientFactory(gender=Patient.PERSON_GENDER_MALE, province=province, city=City.objects.create(name='Tehran', province=province))
+        reserve = ReserveFactory(doctor=DoctorFactory(), patient=None, status=Reserve.RESERVE_STATUS_UNPAID, price=10000,
+                                 reserve_datetime=datetime.now(tz=TEHRAN_TZ) + timedelta(days=1))
+        client = APIClient()
+        client.force_authenticate(get_user_model().objects.get(id=patient.user_id))
+
+        with self.settings(ZARINPAL_SANDBOX_URL=self.server.url):
+            response = client.post(reverse('online_reservation:payment-process-sandbox'), {'reserve_id': reserve.id}, format='json')
+            self.assertEqual(response.status_code, 302)
+
+            callback_url = self.pay(Reserve.objects.get(id=reserve.id).zarinpal_authority)
+            response = client.get(callback_url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Reserve.objects.get(id=reserve.id).status, Reserve.RESERVE_STATUS_PAID)
+
+
+class PaymentVerificationTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeZarinpalServer(seed=1)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+        self.patient = PatientFactory()
+        self.doctor = DoctorFactory()
+        self.reserve = ReserveFactory(doctor=self.doctor, patient=self.patient, status=Reserve.RESERVE_STATUS_UNPAID, price=10000,
+                                      reserve_datetime=datetime.now(tz=TEHRAN_TZ) + timedelta(days=1))
+        self.zarinpal_sandbox = ZarinpalSandbox(base_url=self.server.url, retries=0)
+        self.authority = self.zarinpal_sandbox.payment_request(10000, 'Reserve', 'http://testserver/callback/')['Authority']
+        self.server.pay(self.authority)
+        Reserve.objects.filter(id=self.reserve.id).update(zarinpal_authority=self.authority)
+        self.payment = ReservePayment.objects.create(reserve=self.reserve, patient=self.patient, authority=self.authority, amount=10000)
+
+        settings_override = self.settings(ZARINPAL_SANDBOX_URL=self.server.url, PAYMENT_VERIFICATION_ASYNC=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def get_payment_status(self, patient=None):
+        client = APIClient()
+        if patient:
+            client.force_authenticate(get_user_model().objects.get(id=patient.user_id))
+        return client.get(reverse('online_reservation:payment-status-sandbox'), {'Authority': self.authority}).json()
+
+    def test_callback_leaves_the_verification_to_a_task(self):
+        with mock.patch.object(verify_pending_reserve_payment, 'delay') as delay, self.captureOnCommitCallbacks(execute=True):
+            response = APIClient().get(reverse('online_reservation:payment-callback-sandbox'), {'Status': 'OK', 'Authority': self.authority})
+
+        self.assertEqual(response.status_code, 202)
+        delay.assert_called_once_with(self.authority)
+        self.assertEqual(self.get_payment_status()['status'], 'pending')
+
+        verify_pending_reserve_payment(self.authority)
+        payment_status = self.get_payment_status(self.patient)
+        self.assertEqual(payment_status['status'], 'paid')
+        self.assertEqual(payment_status['ref_id'], Reserve.objects.get(id=self.reserve.id).zarinpal_ref_id)
+
+        # Whoever else knows the authority only gets its status
+        self.assertEqual(self.get_payment_status(), {'status': 'paid'})
+        self.assertEqual(self.get_payment_status(PatientFactory()), {'status': 'paid'})
+
+    def test_verification_is_idempotent(self):
+        self.assertEqual(verify_reserve_payment(self.authority, self.zarinpal_sandbox), VERIFICATION_PAID)
+        self.assertEqual(verify_reserve_payment(self.authority, self.zarinpal_sandbox), VERIFICATION_ALREADY_PAID)
+
+        # The second verification was answered from the database
+        self.assertEqual(self.server.request_count, 2)
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).paid_reserve_count, 1)
+
+    def test_gateway_error_leaves_the_reserve_pending(self):
+        Reserve.objects.filter(id=self.reserve.id).update(payment_verification_status=Reserve.PAYMENT_VERIFICATION_PENDING)
+        self.server.failure_rate = 1
+
+        with self.assertRaises(PaymentGatewayError):
+            verify_reserve_payment(self.authority, self.zarinpal_sandbox)
+        self.assertEqual(self.get_payment_status()['status'], 'pending')
+
+    def test_late_callback_of_a_released_hold_held_again_by_another_patient(self):
+        other_patient = PatientFactory()
+        Reserve.objects.filter(id=self.reserve.id).update(celery_payment_expiration_datetime=datetime.now(tz=TEHRAN_TZ) - timedelta(minutes=1))
+        release_expired_reserve_holds()
+        hold_reserve(Reserve.objects.get(id=self.reserve.id), other_patient)
+
+        with self.settings(PAYMENT_VERIFICATION_ASYNC=False):
+            response = APIClient().get(reverse('online_reservation:payment-callback-sandbox'), {'Status': 'OK', 'Authority': self.authority})
+
+        self.assertEqual(response.status_code, 409)
+        reserve = Reserve.objects.get(id=self.reserve.id)
+        self.assertEqual((reserve.status, reserve.patient_id), (Reserve.RESERVE_STATUS_UNPAID, other_patient.id))
+        self.assertEqual(self.get_payment_status()['status'], 'refund_due')
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).paid_reserve_count, 0)
+
+    def test_pending_hold_is_not_released(self):
+        Reserve.objects.filter(id=self.reserve.id).update(
+            payment_verification_status=Reserve.PAYMENT_VERIFICATION_PENDING,
+            celery_payment_expiration_datetime=datetime.now(tz=TEHRAN_TZ) - timedelta(minutes=1)
+        )
+
+        release_expired_reserve_holds()
+        self.assertIsNotNone(Reserve.objects.get(id=self.reserve.id).patient_id)
+
+
+class PaymentReconciliationTests(TestCase):
+
+    def setUp(self):
+        self.server = FakeZarinpalServer(seed=1)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+        settings_override = self.settings(ZARINPAL_SANDBOX_URL=self.server.url, ZARINPAL_RETRIES=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.patient = PatientFactory()
+        self.doctor = DoctorFactory()
+        self.now = datetime.now(tz=TEHRAN_TZ)
+
+    def create_reserve(self, index, is_paid, is_held, hold_minutes=10):
+        reserve = ReserveFactory(
+            doctor=self.doctor, patient=self.patient if is_held else None, status=Reserve.RESERVE_STATUS_UNPAID, price=10000,
+            reserve_datetime=self.now + timedelta(days=1, hours=index),
+            celery_payment_expiration_datetime=self.now + timedelta(minutes=hold_minutes) if is_held else None
+        )
+        self.request_payment(reserve, self.patient, is_paid)
+        return reserve
+
+    def request_payment(self, reserve, patient, is_paid):
+        authority = self.server.payment_request({'Amount': reserve.price})['Authority']
+        if is_paid:
+            self.server.pay(authority)
+
+        Reserve.objects.filter(id=reserve.id).update(zarinpal_authority=authority)
+        payment = ReservePayment.objects.create(reserve=reserve, patient=patient, authority=authority, amount=reserve.price)
+        # Long enough ago for the callback to be lost
+        ReservePayment.objects.filter(id=payment.id).update(created_datetime=self.now - LOST_CALLBACK_DELAY, updated_datetime=self.now - LOST_CALLBACK_DELAY)
+        return payment
+
+    def test_reconcile_reserve_payments(self):
+        paid_reserve = self.create_reserve(1, is_paid=True, is_held=True)
+        released_paid_reserve = self.create_reserve(2, is_paid=True, is_held=False)
+        running_hold = self.create_reserve(3, is_paid=False, is_held=True)
+        expired_hold = self.create_reserve(4, is_paid=False, is_held=True, hold_minutes=-1)
+
+        self.assertEqual(reconcile_reserve_payments(), {'reconciled': 1, 'refunded': 1, 'failed': 1, 'gateway_errors': 0})
+
+        self.assertEqual(Reserve.objects.get(id=paid_reserve.id).status, Reserve.RESERVE_STATUS_PAID)
+        self.assertEqual(paid_reserve.payments.get().status, ReservePayment.PAYMENT_STATUS_VERIFIED)
+        self.assertEqual(DoctorStats.objects.get(doctor=self.doctor).paid_reserve_count, 1)
+        refund = released_paid_reserve.payments.get()
+        self.assertEqual(refund.status, ReservePayment.PAYMENT_STATUS_REFUND_DUE)
+        self.assertNotEqual(refund.ref_id, '')
+        self.assertEqual(Reserve.objects.get(id=running_hold.id).payment_verification_status, '')
+        self.assertEqual(Reserve.objects.get(id=expired_hold.id).payment_verification_status, Reserve.PAYMENT_VERIFICATION_FAILED)
+        self.assertEqual(expired_hold.payments.get().status, ReservePayment.PAYMENT_STATUS_FAILED)
+
+        # Only the running hold is verified again, after the other unreconciled payments
+        self.assertEqual(list(get_unreconciled_payments()), list(running_hold.payments.all()))
+        self.assertGreater(ReservePayment.objects.get(reserve=running_hold).updated_datetime, self.now)
+
+    def test_recent_payments_of_running_holds_are_left_out(self):
+        running_hold = self.create_reserve(1, is_paid=False, is_held=True)
+        released_hold = self.create_reserve(2, is_paid=False, is_held=False)
+        ReservePayment.objects.update(created_datetime=self.now)
+
+        self.assertEqual(list(get_unreconciled_payments()), list(released_hold.payments.all()))
+        self.assertEqual(get_unreconciled_payments(now=self.now + LOST_CALLBACK_DELAY + timedelta(seconds=1)).count(), 2)
+
+    def test_late_payment_of_a_released_hold_held_again_by_another_patient(self):
+        other_patient = PatientFactory()
+        reserve = self.create_reserve(1, is_paid=False, is_held=True)
+        payment = reserve.payments.get()
+
+        Reserve.objects.filter(id=reserve.id).update(celery_payment_expiration_datetime=self.now - timedelta(minutes=1))
+        release_expired_reserve_holds()
+        self.server.pay(payment.authority)
+        self.assertEqual(hold_reserve(Reserve.objects.get(id=reserve.id), other_patient), HOLD_CLAIMED)
+
+        self.assertEqual(reconcile_reserve_payments(), {'reconciled': 0, 'refunded': 1, 'failed': 0, 'gateway_errors': 0})
+        reserve = Reserve.objects.get(id=reserve.id)
+        self.assertEqual((reserve.status, reserve.patient_id), (Reserve.RESERVE_STATUS_UNPAID, other_patient.id))
+        self.assertEqual(ReservePayment.objects.get(id=payment.id).status, ReservePayment.PAYMENT_STATUS_REFUND_DUE)
+
+    def test_refund_is_kept_when_the_reserve_is_paid_again(self):
+        other_patient = PatientFactory()
+        reserve = self.create_reserve(1, is_paid=True, is_held=False)
+        self.assertEqual(reconcile_reserve_payments()['refunded'], 1)
+
+        hold_reserve(Reserve.objects.get(id=reserve.id), other_patient)
+        self.request_payment(reserve, other_patient, is_paid=True)
+        self.assertEqual(reconcile_reserve_payments()['reconciled'], 1)
+
+        self.assertEqual(Reserve.objects.get(id=reserve.id).status, Reserve.RESERVE_STATUS_PAID)
+        self.assertEqual(
+            sorted(reserve.payments.values_list('patient_id', 'status')),
+            sorted([(self.patient.id, ReservePayment.PAYMENT_STATUS_REFUND_DUE), (other_patient.id, ReservePayment.PAYMENT_STATUS_VERIFIED)])
+        )
+
+    def test_verifications_are_bounded(self):
+        self.server.latency = 0.05
+        for index in range(8):
+            self.create_reserve(index, is_paid=True, is_held=True)
+
+        self.assertEqual(reconcile_reserve_payments(concurrency=3)['reconciled'], 8)
+        self.assertEqual(self.server.max_in_flight, 3)
+
+    def test_unanswered_verifications_are_tried_again_after_the_others(self):
+        first_reserve = self.create_reserve(1, is_paid=True, is_held=False)
+        second_reserve = self.create_reserve(2, is_paid=True, is_held=False)
+        self.server.failure_rate = 1
+
+        self.assertEqual(reconcile_reserve_payments(batch_size=1)['gateway_errors'], 1)
+        self.assertEqual(get_unreconciled_payments().count(), 2)
+
+        self.server.failure_rate = 0
+        self.assertEqual(reconcile_reserve_payments(batch_size=1)['refunded'], 1)
+        self.assertEqual(second_reserve.payments.get().status, ReservePayment.PAYMENT_STATUS_REFUND_DUE)
+        self.assertEqual(list(get_unreconciled_payments()), list(first_reserve.payments.all()))
+
+
+class IdempotencyKeyTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.server = FakeZarinpalServer(seed=1)
+        self.server.__enter__()
+        self.addCleanup(self.server.__exit__)
+
+        province = Province.objects.create(name='Tehran')
+        self.patient = PatientFactory(gender=Patient.PERSON_GENDER_MALE, province=province, city=City.objects.create(name='Tehran', province=province))
+        self.doctor = DoctorFactory()
+        self.reserve = ReserveFactory(doctor=self.doctor, patient=None, status=Reserve.RESERVE_STATUS_UNPAID, price=10000,
+                                      reserve_datetime=datetime.now(tz=TEHRAN_TZ) + timedelta(days=1))
+        self.client = APIClient()
+        self.client.force_authenticate(get_user_model().objects.get(id=self.patient.user_id))
+
+        settings_override = self.settings(ZARINPAL_SANDBOX_URL=self.server.url)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def request_payment(self, idempotency_key=None, reserve_id=None):
+        headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+        return self.client.post(reverse('online_reservation:payment-process-sandbox'), {'reserve_id': reserve_id or self.reserve.id},
+                                format='json', headers=headers)
+
+    def create_comment(self, idempotency_key, body='Good doctor'):
+        return self.client.post(reverse('online_reservation:doctor-comments-list', kwargs={'doctor_pk': self.doctor.id}), {
+            'rating': Comment.COMMENT_RATING_GOOD,
+            'is_suggest': True,
+            'waiting_time': Comment.COMMENT_WAITING_TIME_0_TO_15_MINUTES,
+            'body': body
+        }, format='json', headers={'Idempotency-Key': idempotency_key})
+
+    def test_retried_payment_is_replayed(self):
+        response = self.request_payment('payment-1')
+        self.assertEqual(response.status_code, 302)
+        authority = Reserve.objects.get(id=self.reserve.id).zarinpal_authority
+
+        replayed_response = self.request_payment('payment-1')
+        self.assertEqual(replayed_response.status_code, 302)
+        self.assertEqual(replayed_response['Location'], response['Location'])
+        self.assertEqual(replayed_response['Idempotent-Replayed'], 'true')
+
+        # The gateway was asked for one authority only
+        self.assertEqual(self.server.request_count, 1)
+        self.assertEqual(Reserve.objects.get(id=self.reserve.id).zarinpal_authority, authority)
+
+    def test_gateway_error_is_not_replayed(self):
+        with mock.patch.object(ZarinpalSandbox, 'payment_request', return_value={'Status': -9, 'errors': ['Merchant is busy.']}):
+            self.assertEqual(self.request_payment('payment-1').status_code, 502)
+
+        response = self.request_payment('payment-1')
+        self.assertEqual(response.status_code, 302)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_payment_without_key_is_not_replayed(self):
+        self.assertEqual(self.request_payment().status_code, 302)
+        self.assertEqual(self.request_payment().status_code, 302)
+        self.assertEqual(self.server.request_count, 2)
+
+    def test_key_reused_with_another_body(self):
+        other_reserve = ReserveFactory(doctor=self.doctor, patient=None, status=Reserve.RESERVE_STATUS_UNPAID, price=10000,
+                                       reserve_datetime=datetime.now(tz=TEHRAN_TZ) + timedelta(days=2))
+
+        self.assertEqual(self.request_payment('payment-1').status_code, 302)
+        self.assertEqual(self.request_payment('payment-1', other_reserve.id).status_code, 422)
+        self.assertEqual(Reserve.objects.get(id=other_reserve.id).zarinpal_authority, '')
+
+    def test_retried_comment_is_created_once(self):
+        response = self.create_comment('comment-1')
+        self.assertEqual(response.status_code, 201)
+
+        replayed_response = self.create_comment('comment-1')
+        self.assertEqual(replayed_response.status_code, 201)
+        self.assertEqual(replayed_response.json(), response.json())
+        self.assertEqual(Comment.objects.filter(doctor=self.doctor).count(), 1)
+
+        self.assertEqual(self.create_comment('comment-2').status_code, 201)
+        self.assertEqual(Comment.objects.filter(doctor=self.doctor).count(), 2)
+
+    def test_key_in_progress(self):
+        # Another request holds the lock of the key
+        with mock.patch.object(cache, 'add', return_value=False):
+            response = self.create_comment('comment-1')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(Comment.objects.filter(doctor=self.doctor).exists())
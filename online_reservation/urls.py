@@ -27,10 +27,13 @@ patients_router.register('reserves', views.ReservePatientViewSet, basename='pati
 doctors_router = routers.NestedDefaultRouter(router, 'doctors', lookup='doctor')
 doctors_router.register('comments', views.CommentViewSet, basename='doctor-comments')
 doctors_router.register('reserves', views.ReserveDoctorViewSet, basename='doctor-reserves')
+doctors_router.register('schedule-templates', views.ScheduleTemplateViewSet, basename='doctor-schedule-templates')
 
 urlpatterns = router.urls + provinces_router.urls + patients_router.urls + doctors_router.urls + [
     path('payment/', views.PaymentProcessSandboxGenericAPIView.as_view(), name='payment-process-sandbox'),
     path('payment/callback/', views.PaymentCallbackSandboxAPIView.as_view(), name='payment-callback-sandbox'),
+    path('payment/status/', views.PaymentStatusSandboxAPIView.as_view(), name='payment-status-sandbox'),
     path('request-doctor/', views.RequestDoctorGenericAPIView.as_view(), name='request-doctor'),
-    path('doctors/<int:pk>/appointments/', views.AppointmentDoctorGenericAPIView.as_view(), name='appointment')
+    path('doctors/<int:pk>/appointments/', views.AppointmentDoctorGenericAPIView.as_view(), name='appointment'),
+    path('doctors/<int:pk>/appointments/calendar/', views.AppointmentCalendarDoctorGenericAPIView.as_view(), name='appointment-calendar')
 ]
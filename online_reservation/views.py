@@ -2,31 +2,38 @@ from rest_framework import status as status_code
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.decorators import action
 from rest_framework.exceptions import PermissionDenied
 from rest_framework.views import APIView
 from django.utils.translation import gettext as _
 from django.http import Http404
+from django.db import transaction
 from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404, redirect
 from django.conf import settings
 from django.urls import reverse
-from django.db.models import Min, Count, Q
+from django.db.models import F, Subquery, OuterRef, Count, Q
+from django.db.models.functions import TruncDate
 
 from django_filters.rest_framework import DjangoFilterBackend
 from functools import cached_property
 from datetime import datetime, timedelta, timezone
-from celery.result import AsyncResult
+from urllib.parse import urlencode
 
-from .models import Doctor, DoctorInsurance, DoctorSpecialty, Insurance, Patient, Province, City, Reserve, Comment, Specialty
+from .models import Doctor, DoctorInsurance, DoctorSpecialty, Insurance, Patient, Province, City, Reserve, ReservePayment, Comment, Specialty, ScheduleTemplate
 from . import serializers
-from .paginations import CustomLimitOffsetPagination
+from core.paginations import CustomLimitOffsetPagination, CachedCountLimitOffsetPagination
 from .filters import PatientFilter, DoctorFilter, CommentListWaitingFilter, ReserveDoctorFilter, AppointmentDoctorFilter
 from .permissions import IsDoctor, IsPatientInfoComplete, IsDoctorOfficeAddressInfoComplete, IsDoctorOfficeAddressInfoCompleteForAdmin, IsDoctorOrPatient
-from .payment import ZarinpalSandbox
+from .payment import ZarinpalSandbox, verify_reserve_payment, get_payment_status, VERIFICATION_PAID, VERIFICATION_ALREADY_PAID, VERIFICATION_REFUND_DUE, \
+                     PAYMENT_STATUS_PENDING
+from .tasks import verify_pending_reserve_payment
 from .ordering import DoctorOrderingFilter
-from .tasks import manage_patient_after_end_of_reserve_purchase_time
+from .booking import hold_reserve_or_raise
+from .schedules import create_reserves_from_schedule_template
+from .caching import CachedResponseMixin, DOCTOR_RESPONSES_NAMESPACE
+from .idempotency import IdempotentResponseMixin
 
 
 TEHRAN_TZ = timezone(timedelta(hours=3, minutes=30))
@@ -110,7 +117,7 @@ class SpecialtyViewSet(ModelViewSet):
 class PatientViewSet(ModelViewSet):
     http_method_names = ['get', 'head', 'options', 'put']
     queryset = Patient.objects.select_related('insurance', 'user', 'province', 'city').order_by('-created_datetime')
-    pagination_class = CustomLimitOffsetPagination
+    pagination_class = CachedCountLimitOffsetPagination
     permission_classes = [IsAdminUser]
     filter_backends = [DjangoFilterBackend]
     filterset_class = PatientFilter
@@ -140,13 +147,14 @@ class PatientViewSet(ModelViewSet):
 class ReservePatientViewSet(ModelViewSet):
     http_method_names = ['get', 'head', 'options', 'patch', 'delete']
     pagination_class = CustomLimitOffsetPagination
+    keyset_ordering = ('-reserve_datetime', '-id')
 
     @cached_property
     def patient(self):
         patient_pk = self.kwargs.get('patient_pk')
 
         if patient_pk == 'me':
-            patient = Patient.objects.get(user=self.request.user)
+            patient = self.request.user.patient
         else:
             try:
                 patient = Patient.objects.get(id=patient_pk)
@@ -166,11 +174,7 @@ class ReservePatientViewSet(ModelViewSet):
     def get_queryset(self):
         queryset = Reserve.objects.select_related('doctor').filter(patient=self.patient).order_by('-reserve_datetime')
         if self.action == 'retrieve':
-            return queryset.select_related('doctor__province', 'doctor__city').prefetch_related('doctor__comments').prefetch_related(
-                   Prefetch('doctor__reserves',
-                            queryset=Reserve.objects.filter(status=Reserve.RESERVE_STATUS_PAID),
-                            to_attr='doctor_reserves')
-                ).prefetch_related(
+            return queryset.select_related('doctor__province', 'doctor__city', 'doctor__stats').prefetch_related(
                     Prefetch('doctor__specialties',
                              queryset=DoctorSpecialty.objects.select_related('specialty'))
                 )
@@ -184,33 +188,44 @@ class ReservePatientViewSet(ModelViewSet):
         return serializers.ReservePatientSerializer
 
 
-class DoctorViewSet(ModelViewSet):
-    queryset = Doctor.objects.filter(status=Doctor.DOCTOR_STATUS_ACCEPTED).annotate(
-                    max_successful_reserve=Count('reserves', filter=Q(reserves__status=Reserve.RESERVE_STATUS_PAID)),
-                    closest_free_reserve=Min('reserves__reserve_datetime', filter=Q(reserves__reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ), reserves__patient__isnull=True))
-                ).select_related('province', 'city')\
+class DoctorViewSet(CachedResponseMixin, ModelViewSet):
+    pagination_class = CustomLimitOffsetPagination
+    response_cache_namespace = DOCTOR_RESPONSES_NAMESPACE
+    filter_backends = [DjangoFilterBackend, DoctorOrderingFilter]
+    filterset_class = DoctorFilter
+    ordering_fields = ['max_successful_reserve', 'closest_free_reserve']
+
+    @cached_property
+    def now(self):
+        # Single time reference for everything that depends on the current time in this request
+        return datetime.now(tz=TEHRAN_TZ)
+
+    def get_queryset(self):
+        closest_free_reserve_subquery = Reserve.objects.filter(
+            doctor=OuterRef('pk'),
+            reserve_datetime__gte=self.now,
+            patient__isnull=True
+        ).order_by('reserve_datetime').values('reserve_datetime')[:1]
+
+        queryset = Doctor.objects.filter(status=Doctor.DOCTOR_STATUS_ACCEPTED).annotate(
+                    max_successful_reserve=F('stats__paid_reserve_count'),
+                    closest_free_reserve=Subquery(closest_free_reserve_subquery)
+                ).select_related('province', 'city', 'stats')\
                 .prefetch_related(
-                   Prefetch('reserves',
-                            queryset=Reserve.objects.filter(status=Reserve.RESERVE_STATUS_PAID),
-                            to_attr='doctor_reserves')
-                ).prefetch_related(
-                Prefetch('specialties',
+                    Prefetch('specialties',
                              queryset=DoctorSpecialty.objects.select_related('specialty'))
                 ).prefetch_related(
                     Prefetch('insurances',
                              queryset=DoctorInsurance.objects.select_related('insurance'))
-                ).prefetch_related(
-                    Prefetch('comments',
-                             queryset=Comment.objects.filter(status=Comment.COMMENT_STATUS_APPROVED).select_related('patient').order_by('-created_datetime'))
-                ).prefetch_related(
-                    Prefetch('reserves',
-                             queryset=Reserve.objects.filter(reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ), patient__isnull=True).order_by('reserve_datetime'),
-                             to_attr='doctor_free_reserves')
                 ).order_by('-confirm_datetime')
-    pagination_class = CustomLimitOffsetPagination
-    filter_backends = [DjangoFilterBackend, DoctorOrderingFilter]
-    filterset_class = DoctorFilter
-    ordering_fields = ['max_successful_reserve', 'closest_free_reserve']
+
+        # Only the detail views nest the doctor's comments, the figures about them come from the doctor's stats
+        if self.action in ['retrieve', 'me']:
+            return queryset.prefetch_related(
+                Prefetch('comments',
+                         queryset=Comment.objects.filter(status=Comment.COMMENT_STATUS_APPROVED).select_related('patient').order_by('-created_datetime'))
+            )
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
@@ -238,7 +253,7 @@ class DoctorViewSet(ModelViewSet):
     @action(detail=False, methods=['GET', 'PUT', 'PATCH', 'DELETE'], permission_classes=[IsDoctor])
     def me(self, request, *args, **kwargs):
         user = request.user
-        doctor = self.queryset.get(user_id=user.id)
+        doctor = self.get_queryset().get(user_id=user.id)
 
         if request.method == 'GET':
             serializer = serializers.DoctorDetailSerializer(doctor)
@@ -279,7 +294,44 @@ class AppointmentDoctorGenericAPIView(generics.GenericAPIView):
         return Response(serializer.data, status=status_code.HTTP_200_OK)
 
 
-class CommentViewSet(ModelViewSet):
+class AppointmentCalendarDoctorGenericAPIView(generics.GenericAPIView):
+    serializer_class = serializers.AppointmentCalendarQueryParamSerializer
+
+    @cached_property
+    def doctor(self):
+        doctor_pk = self.kwargs.get('pk')
+        doctor = get_object_or_404(Doctor, pk=doctor_pk)
+        return doctor
+
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        start_date, end_date = serializer.validated_data['start_date'], serializer.validated_data['end_date']
+
+        # Same lower limit as the appointments, so every counted slot shows up in the selected day's appointments
+        min_reserve_datetime = datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=5)
+        start_datetime = max(datetime.combine(start_date, datetime.min.time(), tzinfo=TEHRAN_TZ), min_reserve_datetime)
+        end_datetime = datetime.combine(end_date + timedelta(days=1), datetime.min.time(), tzinfo=TEHRAN_TZ)
+
+        # One GROUP BY over the doctor's reserves of the range, the slots of a day are fetched from the appointments
+        days = self.doctor.reserves.filter(
+            reserve_datetime__gte=start_datetime,
+            reserve_datetime__lt=end_datetime
+        ).annotate(
+            date=TruncDate('reserve_datetime', tzinfo=TEHRAN_TZ)
+        ).values('date').annotate(
+            free_count=Count('id', filter=Q(patient__isnull=True)),
+            taken_count=Count('id', filter=Q(patient__isnull=False))
+        ).order_by('date')
+
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'days': list(days)
+        }, status=status_code.HTTP_200_OK)
+
+
+class CommentViewSet(IdempotentResponseMixin, ModelViewSet):
     http_method_names = ['get', 'head', 'options', 'post', 'delete']
 
     def get_permissions(self):
@@ -301,7 +353,7 @@ class CommentViewSet(ModelViewSet):
         doctor_pk = self.kwargs.get('doctor_pk')
 
         if doctor_pk == 'me':
-            doctor = Doctor.objects.get(user=self.request.user)
+            doctor = self.request.user.doctor
         else:
             try:
                 doctor = Doctor.objects.get(id=doctor_pk)
@@ -328,7 +380,8 @@ class CommentListWaitingViewSet(ModelViewSet):
     http_method_names = ['get', 'head', 'options', 'patch']
     queryset = Comment.objects.filter(status=Comment.COMMENT_STATUS_WAITING).select_related('patient', 'doctor').order_by('-created_datetime')
     permission_classes = [IsAdminUser]
-    pagination_class = CustomLimitOffsetPagination
+    pagination_class = CachedCountLimitOffsetPagination
+    keyset_ordering = ('-created_datetime', '-id')
     filter_backends = [DjangoFilterBackend]
     filterset_class = CommentListWaitingFilter
 
@@ -340,9 +393,10 @@ class CommentListWaitingViewSet(ModelViewSet):
         return serializers.CommentListWaitingSerializer
 
 
-class ReserveDoctorViewSet(ModelViewSet):
+class ReserveDoctorViewSet(IdempotentResponseMixin, ModelViewSet):
     http_method_names = ['get', 'head', 'options', 'post', 'delete']
-    pagination_class = CustomLimitOffsetPagination
+    pagination_class = CachedCountLimitOffsetPagination
+    keyset_ordering = ('-reserve_datetime', '-id')
     filter_backends = [DjangoFilterBackend]
     filterset_class = ReserveDoctorFilter
 
@@ -351,7 +405,7 @@ class ReserveDoctorViewSet(ModelViewSet):
         doctor_pk = self.kwargs.get('doctor_pk')
 
         if doctor_pk == 'me':
-            doctor = Doctor.objects.get(user=self.request.user)
+            doctor = self.request.user.doctor
         else:
             try:
                 doctor = Doctor.objects.get(id=doctor_pk)
@@ -388,7 +442,63 @@ class ReserveDoctorViewSet(ModelViewSet):
         return {'doctor': self.doctor}
 
 
-class PaymentProcessSandboxGenericAPIView(generics.GenericAPIView):
+class ScheduleTemplateViewSet(ModelViewSet):
+    http_method_names = ['get', 'head', 'options', 'post', 'delete']
+
+    @cached_property
+    def doctor(self):
+        doctor_pk = self.kwargs.get('doctor_pk')
+
+        if doctor_pk == 'me':
+            doctor = self.request.user.doctor
+        else:
+            try:
+                doctor = Doctor.objects.get(id=doctor_pk)
+            except (Doctor.DoesNotExist, ValueError):
+                raise Http404
+
+        return doctor
+
+    def get_queryset(self):
+        return ScheduleTemplate.objects.filter(doctor=self.doctor).order_by('-id')
+
+    def get_permissions(self):
+        doctor_pk = self.kwargs.get('doctor_pk')
+
+        if doctor_pk == 'me':
+            if self.action == 'create_reserves':
+                return [IsDoctor(), IsDoctorOfficeAddressInfoComplete()]
+            return [IsDoctor()]
+        else:
+            if self.action == 'create_reserves':
+                return [IsAdminUser(), IsDoctorOfficeAddressInfoCompleteForAdmin()]
+            return [IsAdminUser()]
+
+    def get_serializer_class(self):
+        if self.action == 'create_reserves':
+            return serializers.ScheduleTemplateCreateReservesSerializer
+        return serializers.ScheduleTemplateSerializer
+
+    def get_serializer_context(self):
+        return {'request': self.request, 'doctor': self.doctor}
+
+    @action(detail=True, methods=['POST'])
+    def create_reserves(self, request, *args, **kwargs):
+        template = self.get_object()
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        created, skipped = create_reserves_from_schedule_template(template, serializer.validated_data['start_date'], serializer.validated_data['end_date'])
+
+        return Response({
+            'created_count': len(created),
+            'skipped_count': len(skipped),
+            'created': [reserve_datetime.strftime('%Y-%m-%d %H:%M') for reserve_datetime in created],
+            'skipped': [{'reserve_datetime': reserve_datetime.strftime('%Y-%m-%d %H:%M'), 'reason': reason} for reserve_datetime, reason in skipped]
+        }, status=status_code.HTTP_201_CREATED if created else status_code.HTTP_200_OK)
+
+
+class PaymentProcessSandboxGenericAPIView(IdempotentResponseMixin, generics.GenericAPIView):
     serializer_class = serializers.ReservePaymentQueryParamSerializer
     permission_classes = [IsAuthenticated, IsPatientInfoComplete]
 
@@ -398,66 +508,29 @@ class PaymentProcessSandboxGenericAPIView(generics.GenericAPIView):
                      queryset=DoctorSpecialty.objects.select_related('specialty'))
         ).select_related('doctor', 'patient__province', 'patient__city', 'patient__insurance')
 
-    def get(self, request, *args, **kwargs):
-        serializer_query_param = self.get_serializer(data=request.query_params)
+    def get_held_reserve(self, data):
+        serializer_query_param = self.get_serializer(data=data)
         serializer_query_param.is_valid(raise_exception=True)
 
         reserve_id = serializer_query_param.validated_data.get('reserve_id')
         reserve = self.get_queryset().get(pk=reserve_id)
 
-        if not reserve.patient:
-            patient = request.user.patient
-            reserve_queryset = Reserve.objects.filter(patient=patient, reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=5)).exclude(id=reserve.id)
-
-            if reserve_queryset.exists():
-                previous_reserve = reserve_queryset.first()
-                result_task = AsyncResult(previous_reserve.celery_task_id)
-                result_task.revoke()
-                previous_reserve.patient = None
-                previous_reserve.celery_task_id = ''
-                previous_reserve.celery_payment_expiration_datetime = None
-                previous_reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime'])
-            
-            reserve.patient = patient
-            eta = min(reserve.reserve_datetime - timedelta(minutes=5), datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=20))
-            task = manage_patient_after_end_of_reserve_purchase_time.apply_async((reserve.id, ), eta=eta)
-            reserve.celery_task_id = task.id
-            reserve.celery_payment_expiration_datetime = eta
+        hold_reserve_or_raise(reserve, self.request.user.patient)
+        return reserve
 
-            reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime'])
+    def get(self, request, *args, **kwargs):
+        reserve = self.get_held_reserve(request.query_params)
 
         serializer = serializers.ReservePaymentSerializer(reserve)
         return Response(serializer.data, status=status_code.HTTP_200_OK)
     
     def post(self, request, *args, **kwargs):
-        serializer_query_param = self.get_serializer(data=request.data)
-        serializer_query_param.is_valid(raise_exception=True)
-
-        reserve_id = serializer_query_param.validated_data.get('reserve_id')
-        reserve = self.get_queryset().get(pk=reserve_id)
-
-        if not reserve.patient:
-            patient = request.user.patient
-            reserve_queryset = Reserve.objects.filter(patient=patient, reserve_datetime__gte=datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=5)).exclude(id=reserve.id)
-
-            if reserve_queryset.exists():
-                previous_reserve = reserve_queryset.first()
-                result_task = AsyncResult(previous_reserve.celery_task_id)
-                result_task.revoke()
-                previous_reserve.patient = None
-                previous_reserve.celery_task_id = ''
-                previous_reserve.celery_payment_expiration_datetime = None
-                previous_reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime'])
+        # A retried request is redirected to the same payment page instead of requesting a new authority
+        return self.get_idempotent_response(self.request_payment, request, *args, **kwargs)
 
-            reserve.patient = patient
-            eta = min(reserve.reserve_datetime - timedelta(minutes=5), datetime.now(tz=TEHRAN_TZ) + timedelta(minutes=20))
-            task = manage_patient_after_end_of_reserve_purchase_time.apply_async((reserve.id, ), eta=eta)
+    def request_payment(self, request, *args, **kwargs):
+        reserve = self.get_held_reserve(request.data)
 
-            reserve.celery_task_id = task.id
-            reserve.celery_payment_expiration_datetime = eta
-
-            reserve.save(update_fields=['patient', 'celery_task_id', 'celery_payment_expiration_datetime'])
-        
         zarinpal_sandbox = ZarinpalSandbox(settings.ZARINPAL_MERCHANT_ID)
         data = zarinpal_sandbox.payment_request(
             toman_total_price=reserve.price, 
@@ -465,15 +538,21 @@ class PaymentProcessSandboxGenericAPIView(generics.GenericAPIView):
             callback_url=request.build_absolute_uri(reverse('online_reservation:payment-callback-sandbox'))
         )
 
+        # A gateway error isn't the client's, the response isn't kept for its idempotency key
+        if data.get('errors'):
+            return Response({'detail': _('Error from zarinpal.')}, status=status_code.HTTP_502_BAD_GATEWAY)
+
         authority = data['Authority']
-        
-        reserve.zarinpal_authority = authority
-        reserve.save(update_fields=['zarinpal_authority'])
 
-        if 'errors' not in data or len(data['errors']) == 0:
-            return redirect(zarinpal_sandbox.generate_payment_page_url(authority=authority))
-        else:
-            return Response({'detail': _('Error from zarinpal.')}, status=status_code.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            # Recorded for the patient who requested it, a late payment is never credited to another holder
+            ReservePayment.objects.create(reserve=reserve, patient=request.user.patient, authority=authority, amount=reserve.price)
+            reserve.zarinpal_authority = authority
+            reserve.zarinpal_ref_id = ''
+            reserve.payment_verification_status = ''
+            reserve.save(update_fields=['zarinpal_authority', 'zarinpal_ref_id', 'payment_verification_status'])
+
+        return redirect(zarinpal_sandbox.generate_payment_page_url(authority=authority))
 
 
 class PaymentCallbackSandboxAPIView(APIView):
@@ -482,31 +561,62 @@ class PaymentCallbackSandboxAPIView(APIView):
         status = request.query_params.get('Status')
         authority = request.query_params.get('Authority')
 
-        reserve = get_object_or_404(Reserve, zarinpal_authority=authority)
+        payment = get_object_or_404(ReservePayment.objects.only('reserve_id', 'patient_id', 'status'), authority=authority)
 
-        if status == 'OK':
-            zarinpal_sandbox = ZarinpalSandbox(settings.ZARINPAL_MERCHANT_ID)
-            data = zarinpal_sandbox.payment_verify(
-                toman_total_price=reserve.price, 
-                authority=authority
+        if status != 'OK':
+            return Response({'detail': _('The payment was unsuccessful.')}, status=status_code.HTTP_400_BAD_REQUEST)
+
+        if settings.PAYMENT_VERIFICATION_ASYNC and payment.status == ReservePayment.PAYMENT_STATUS_PENDING:
+            # Keeps the hold from being released, only while its patient still holds the reserve with this payment
+            Reserve.objects.filter(id=payment.reserve_id, patient_id=payment.patient_id, zarinpal_authority=authority).update(
+                payment_verification_status=Reserve.PAYMENT_VERIFICATION_PENDING
             )
-            
-            payment_status = data['Status']
-
-            if payment_status == 100:
-                reserve.status = Reserve.RESERVE_STATUS_PAID
-                reserve.zarinpal_ref_id = data['RefID']
-                reserve.save(update_fields=['status', 'zarinpal_ref_id'])
-
-                return Response({'detail': _('Your payment has been successfully complete.')}, status=status_code.HTTP_200_OK)
-            elif payment_status == 101:
-                return Response({'detail': _('Your payment has been successfully complete and has already been register.')}, status=status_code.HTTP_200_OK)
-            else:
-                return Response({'detail': _('The payment was unsuccessful.')}, status=status_code.HTTP_400_BAD_REQUEST)
+            transaction.on_commit(lambda: verify_pending_reserve_payment.delay(authority))
+
+            status_url = request.build_absolute_uri(f"{reverse('online_reservation:payment-status-sandbox')}?{urlencode({'Authority': authority})}")
+            return Response({
+                'detail': _('Your payment is being verified.'),
+                'status': PAYMENT_STATUS_PENDING,
+                'status_url': status_url
+            }, status=status_code.HTTP_202_ACCEPTED)
+
+        verification = verify_reserve_payment(authority)
+
+        if verification == VERIFICATION_PAID:
+            return Response({'detail': _('Your payment has been successfully complete.')}, status=status_code.HTTP_200_OK)
+        elif verification == VERIFICATION_ALREADY_PAID:
+            return Response({'detail': _('Your payment has been successfully complete and has already been register.')}, status=status_code.HTTP_200_OK)
+        elif verification == VERIFICATION_REFUND_DUE:
+            return Response({'detail': _('The reserve was released before your payment, it will be refunded.')}, status=status_code.HTTP_409_CONFLICT)
         else:
             return Response({'detail': _('The payment was unsuccessful.')}, status=status_code.HTTP_400_BAD_REQUEST)
 
 
+class PaymentStatusSandboxAPIView(APIView):
+    # The page the gateway redirects to polls it without the patient's token, it only gets the status
+    permission_classes = [AllowAny]
+
+    def get(self, request, *args, **kwargs):
+        authority = request.query_params.get('Authority')
+
+        payment = get_object_or_404(
+            ReservePayment.objects.select_related('reserve', 'patient').only(
+                'authority', 'ref_id', 'status', 'reserve__zarinpal_authority', 'reserve__payment_verification_status', 'patient__user_id'
+            ),
+            authority=authority
+        )
+        payment_status = get_payment_status(payment)
+
+        if not request.user.is_authenticated or payment.patient is None or payment.patient.user_id != request.user.id:
+            return Response({'status': payment_status}, status=status_code.HTTP_200_OK)
+
+        return Response({
+            'reserve_id': payment.reserve_id,
+            'status': payment_status,
+            'ref_id': payment.ref_id
+        }, status=status_code.HTTP_200_OK)
+
+
 class RequestDoctorGenericAPIView(generics.GenericAPIView):
     serializer_class = serializers.RequestDoctorSerializer
     permission_classes = [IsAuthenticated, IsDoctorOrPatient]